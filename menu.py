@@ -2,7 +2,9 @@ import nuke
 
 ### SAMURAI
 from scripts.nuke_samurai import CreateSamuraiNode, UpdatePath, GenerateMask, BoundingBox, InputInfos
+from scripts.samurai_queue import show_queue_panel
 
 m = nuke.menu('Nodes')
-m = m.addCommand('SAMURAI', 'CreateSamuraiNode()', tooltip="SAMURAI", icon="samurai_icon.png")
+m.addCommand('SAMURAI', 'CreateSamuraiNode()', tooltip="SAMURAI", icon="samurai_icon.png")
+m.addCommand('SAMURAI Queue', 'show_queue_panel()', tooltip="Run many SAMURAI nodes in one batch")
 ###
\ No newline at end of file
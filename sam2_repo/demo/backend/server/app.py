@@ -4,7 +4,7 @@
 # LICENSE file in the root directory of this source tree.
 
 import logging
-from typing import Any, Generator
+from typing import Any, Generator, Optional
 
 from app_conf import (
     GALLERY_PATH,
@@ -19,7 +19,7 @@ from data.schema import schema
 from data.store import set_videos
 from flask import Flask, make_response, Request, request, Response, send_from_directory
 from flask_cors import CORS
-from inference.data_types import PropagateDataResponse, PropagateInVideoRequest
+from inference.data_types import PropagateInVideoRequest
 from inference.multipart import MultipartResponseBuilder
 from inference.predictor import InferenceAPI
 from strawberry.flask.views import GraphQLView
@@ -80,6 +80,10 @@ def propagate_in_video() -> Response:
     args = {
         "session_id": data["session_id"],
         "start_frame_index": data.get("start_frame_index", 0),
+        "mask_format": data.get("mask_format", "json"),
+        "delta": bool(data.get("delta", False)),
+        "keyframe_interval": int(data.get("keyframe_interval", 0)),
+        "resume_frame_index": data.get("resume_frame_index"),
     }
 
     boundary = "frame"
@@ -91,26 +95,36 @@ def gen_track_with_mask_stream(
     boundary: str,
     session_id: str,
     start_frame_index: int,
+    mask_format: str = "json",
+    delta: bool = False,
+    keyframe_interval: int = 0,
+    resume_frame_index: Optional[int] = None,
 ) -> Generator[bytes, None, None]:
-    with inference_api.autocast_context():
-        request = PropagateInVideoRequest(
-            type="propagate_in_video",
-            session_id=session_id,
-            start_frame_index=start_frame_index,
-        )
-
-        for chunk in inference_api.propagate_in_video(request=request):
-            yield MultipartResponseBuilder.build(
-                boundary=boundary,
-                headers={
-                    "Content-Type": "application/json; charset=utf-8",
-                    "Frame-Current": "-1",
-                    # Total frames minus the reference frame
-                    "Frame-Total": "-1",
-                    "Mask-Type": "RLE[]",
-                },
-                body=chunk.to_json().encode("UTF-8"),
-            ).get_message()
+    # The propagation runs on an inference worker that pauses when this generator
+    # is not consumed (e.g. a slow client), so the output is never buffered here.
+    request = PropagateInVideoRequest(
+        type="propagate_in_video",
+        session_id=session_id,
+        start_frame_index=start_frame_index,
+        mask_format=mask_format,
+        delta=delta,
+        keyframe_interval=keyframe_interval,
+        resume_frame_index=resume_frame_index,
+    )
+
+    for chunk in inference_api.stream_propagate_in_video(request=request):
+        yield MultipartResponseBuilder.build(
+            boundary=boundary,
+            headers={
+                "Content-Type": chunk.content_type,
+                "Frame-Index": str(chunk.frame_index),
+                # Frames delivered so far, the reference frame counted once
+                "Frame-Current": str(chunk.frames_done),
+                "Frame-Total": str(chunk.num_frames),
+                "Mask-Type": chunk.mask_type,
+            },
+            body=chunk.body,
+        ).get_message()
 
 
 class MyGraphQLView(GraphQLView):
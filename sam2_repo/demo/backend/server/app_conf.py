@@ -19,6 +19,45 @@ logger.info(f"using model size {MODEL_SIZE}")
 
 FFMPEG_NUM_THREADS = int(os.getenv("FFMPEG_NUM_THREADS", "1"))
 
+# Number of inference worker threads (each with its own CUDA stream). Sessions
+# are spread over the workers, so sessions on different workers run in parallel.
+INFERENCE_NUM_WORKERS = int(os.getenv("INFERENCE_NUM_WORKERS", "1"))
+
+# Number of model copies the workers share (worker i uses copy i % N). One copy
+# is enough for inference; extra copies cost GPU memory.
+INFERENCE_NUM_REPLICAS = int(os.getenv("INFERENCE_NUM_REPLICAS", "1"))
+
+# Sessions without any request for this many seconds are closed (0 = never)
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", "3600"))
+
+# Sessions without any request for this many seconds are spilled to disk and
+# restored on their next request (0 = never)
+SESSION_IDLE_SPILL_SECONDS = float(os.getenv("SESSION_IDLE_SPILL_SECONDS", "600"))
+
+# Memory the sessions in memory may use in MiB; the least recently used idle
+# sessions are spilled to disk beyond it (0 = no limit)
+SESSION_MEMORY_BUDGET_MB = int(os.getenv("SESSION_MEMORY_BUDGET_MB", "0"))
+
+# Where spilled sessions are stored (a temporary directory by default)
+SESSION_SPILL_PATH = os.getenv("SESSION_SPILL_PATH")
+
+# Frames a propagation may run ahead of the client reading the stream; beyond
+# it the propagation pauses until the client catches up
+PROPAGATE_MAX_BUFFERED_FRAMES = int(os.getenv("PROPAGATE_MAX_BUFFERED_FRAMES", "2"))
+
+# Frame rate and bit depth ("8-bit fixed", "32-bit float", ...) of the image
+# sequences sessions are started on (e.g. /data/shot/%04d.png). Video files are
+# not supported by the sequence reader of this fork.
+SEQUENCE_FPS = float(os.getenv("SEQUENCE_FPS", "24"))
+SEQUENCE_BITS = os.getenv("SEQUENCE_BITS", "8-bit fixed")
+
+# Image features cached per session, in MiB on the device and in pinned host
+# memory, so re-propagating doesn't run the image encoder again. "auto" sizes
+# the host memory for the whole video, up to SESSION_MEMORY_BUDGET_MB (it needs
+# a memory budget, otherwise the host tier stays off)
+FEATURE_CACHE_GPU_MB = int(os.getenv("FEATURE_CACHE_GPU_MB", "256"))
+FEATURE_CACHE_CPU_MB = os.getenv("FEATURE_CACHE_CPU_MB", "0")
+
 # Path for all data used in API
 DATA_PATH = Path(os.getenv("DATA_PATH", "/data"))
 
@@ -111,6 +111,30 @@ class PropagateInVideoRequest(BaseRequest):
     type: str
     session_id: str
     start_frame_index: int
+    # "json" (a PropagateDataResponse per frame) or "binary" (a varint RLE frame
+    # record per frame, see sam2.utils.mask_codec)
+    mask_format: str = "json"
+    # binary only: encode masks as the XOR with the previous frame of the stream
+    delta: bool = False
+    # binary delta only: send a full (key) frame every this many frames, so a
+    # client can pick up the stream again after losing a frame (0 = first only)
+    keyframe_interval: int = 0
+    # continue an interrupted propagation at this frame (the next frame the
+    # client needs) instead of starting over
+    resume_frame_index: Optional[int] = None
+
+
+@dataclass
+class PropagateFrameChunk:
+    """A propagated frame, encoded for the response stream"""
+
+    frame_index: int
+    # frames delivered so far (including this one) out of num_frames
+    frames_done: int
+    num_frames: int
+    content_type: str
+    mask_type: str
+    body: bytes
 
 
 @dataclass_json
@@ -6,14 +6,27 @@
 import contextlib
 import logging
 import os
+import re
 import uuid
 from pathlib import Path
-from threading import Lock
 from typing import Any, Dict, Generator, List
 
-import numpy as np
 import torch
-from app_conf import APP_ROOT, MODEL_SIZE
+from app_conf import (
+    APP_ROOT,
+    FEATURE_CACHE_CPU_MB,
+    FEATURE_CACHE_GPU_MB,
+    INFERENCE_NUM_REPLICAS,
+    INFERENCE_NUM_WORKERS,
+    MODEL_SIZE,
+    PROPAGATE_MAX_BUFFERED_FRAMES,
+    SEQUENCE_BITS,
+    SEQUENCE_FPS,
+    SESSION_IDLE_SPILL_SECONDS,
+    SESSION_MEMORY_BUDGET_MB,
+    SESSION_SPILL_PATH,
+    SESSION_TTL_SECONDS,
+)
 from inference.data_types import (
     AddMaskRequest,
     AddPointsRequest,
@@ -27,25 +40,62 @@ from inference.data_types import (
     Mask,
     PropagateDataResponse,
     PropagateDataValue,
+    PropagateFrameChunk,
     PropagateInVideoRequest,
     RemoveObjectRequest,
     RemoveObjectResponse,
     StartSessionRequest,
     StartSessionResponse,
 )
-from pycocotools.mask import decode as decode_masks, encode as encode_masks
+from inference.scheduler import InferenceScheduler
+from inference.session_manager import SessionManager
+from pycocotools.mask import decode as decode_masks
 from sam2.build_sam import build_sam2_video_predictor
+from sam2.utils.amg import mask_to_rle_pytorch, rle_counts_to_string
+from sam2.utils.mask_codec import encode_frame, MaskDeltaEncoder
 
 
 logger = logging.getLogger(__name__)
 
 
+def _sequence_frame_numbers(path: str) -> List[int]:
+    """
+    Frame numbers of the image sequence `path` (a file pattern with %04d or
+    %03d, the only input the sequence reader of `init_state` supports)
+    """
+    folder, file_name = os.path.split(path)
+    pattern = "%04d" if "%04d" in file_name else "%03d" if "%03d" in file_name else None
+    if pattern is None:
+        raise ValueError(
+            f"{path} is not an image sequence; sessions need a frame pattern "
+            "with %04d or %03d (e.g. frames/%04d.png)"
+        )
+    prefix, suffix = file_name.split(pattern, 1)
+    regex = re.compile(re.escape(prefix) + r"(\d+)" + re.escape(suffix))
+    frame_numbers = sorted(
+        int(match.group(1))
+        for match in map(regex.fullmatch, os.listdir(folder or "."))
+        if match is not None
+    )
+    if not frame_numbers:
+        raise FileNotFoundError(f"no frames found for {path}")
+    return frame_numbers
+
+
 class InferenceAPI:
 
     def __init__(self) -> None:
         super(InferenceAPI, self).__init__()
 
-        self.session_states: Dict[str, Any] = {}
+        # sessions are closed after SESSION_TTL_SECONDS without requests, and
+        # spilled to disk when idle or beyond the memory budget
+        self.session_states = SessionManager(
+            ttl=SESSION_TTL_SECONDS,
+            idle_spill_after=SESSION_IDLE_SPILL_SECONDS,
+            memory_budget=SESSION_MEMORY_BUDGET_MB * 1024**2,
+            spill_dir=SESSION_SPILL_PATH,
+            on_expire=self.__on_session_expired,
+        )
         self.score_thresh = 0
 
         if MODEL_SIZE == "tiny":
@@ -86,10 +136,31 @@ class InferenceAPI:
             )
 
         self.device = device
-        self.predictor = build_sam2_video_predictor(
-            model_cfg, checkpoint, device=device
+        self.predictors = [
+            build_sam2_video_predictor(model_cfg, checkpoint, device=device)
+            for _ in range(max(INFERENCE_NUM_REPLICAS, 1))
+        ]
+        self.predictor = self.predictors[0]
+
+        # Instead of a global lock, sessions are spread over worker threads that
+        # interleave them at frame granularity (see InferenceScheduler); each
+        # worker has its own CUDA stream
+        num_workers = max(INFERENCE_NUM_WORKERS, 1)
+        self.worker_streams = (
+            [torch.cuda.Stream(device) for _ in range(num_workers)]
+            if device.type == "cuda"
+            else None
+        )
+        self.scheduler = InferenceScheduler(
+            replicas=self.predictors,
+            num_workers=num_workers,
+            worker_context=self.__worker_context,
+            max_buffered=PROPAGATE_MAX_BUFFERED_FRAMES,
+        )
+        logger.info(
+            f"using {num_workers} inference workers and "
+            f"{len(self.predictors)} model replicas"
         )
-        self.inference_lock = Lock()
 
     def autocast_context(self):
         if self.device.type == "cuda":
@@ -97,41 +168,89 @@ class InferenceAPI:
         else:
             return contextlib.nullcontext()
 
+    @contextlib.contextmanager
+    def __worker_context(self, worker: int):
+        # autocast is thread-local, so it is entered on the worker thread itself
+        if self.worker_streams is None:
+            with self.autocast_context():
+                yield
+            return
+        stream = self.worker_streams[worker]
+        with torch.cuda.stream(stream), self.autocast_context():
+            yield
+        # results are handed to other threads, finish the work queued on the stream
+        stream.synchronize()
+
     def start_session(self, request: StartSessionRequest) -> StartSessionResponse:
-        with self.autocast_context(), self.inference_lock:
-            session_id = str(uuid.uuid4())
-            # for MPS devices, we offload the video frames to CPU by default to avoid
-            # memory fragmentation in MPS (which sometimes crashes the entire process)
-            offload_video_to_cpu = self.device.type == "mps"
-            inference_state = self.predictor.init_state(
+        session_id = str(uuid.uuid4())
+        # for MPS devices, we offload the video frames to CPU by default to avoid
+        # memory fragmentation in MPS (which sometimes crashes the entire process)
+        offload_video_to_cpu = self.device.type == "mps"
+        frame_numbers = _sequence_frame_numbers(request.path)
+        fit_feature_cache = FEATURE_CACHE_CPU_MB == "auto"
+        feature_cache_cpu_bytes = (
+            0 if fit_feature_cache else int(FEATURE_CACHE_CPU_MB) * 1024**2
+        )
+        if fit_feature_cache and self.session_states.memory_budget <= 0:
+            logger.warning(
+                "FEATURE_CACHE_CPU_MB=auto needs SESSION_MEMORY_BUDGET_MB, "
+                "the host feature cache stays off"
+            )
+            fit_feature_cache = False
+
+        def init_state(predictor):
+            inference_state, _, _ = predictor.init_state(
                 request.path,
                 offload_video_to_cpu=offload_video_to_cpu,
+                frame_range_min=frame_numbers[0],
+                frame_range_max=frame_numbers[-1] + 1,  # exclusive
+                # every frame of the sequence is tracked
+                original_fps=SEQUENCE_FPS,
+                target_fps=SEQUENCE_FPS,
+                bits=SEQUENCE_BITS,
+                frame_numbers=frame_numbers,
+                feature_cache_gpu_bytes=FEATURE_CACHE_GPU_MB * 1024**2,
+                feature_cache_cpu_bytes=feature_cache_cpu_bytes,
             )
-            self.session_states[session_id] = {
-                "canceled": False,
-                "state": inference_state,
-            }
-            return StartSessionResponse(session_id=session_id)
+            if fit_feature_cache:
+                # the whole video, as long as it fits in the sessions' memory budget
+                inference_state["cached_features"].fit_to_video(
+                    inference_state["num_frames"],
+                    self.device,
+                    max_bytes=self.session_states.memory_budget,
+                )
+            return inference_state
+
+        # the session is pinned to a worker, whose model replica builds its state
+        self.scheduler.add_session(session_id)
+        try:
+            inference_state = self.scheduler.run(session_id, init_state)
+        except Exception:
+            self.scheduler.remove_session(session_id)
+            raise
+        self.session_states.add(session_id, inference_state)
+        return StartSessionResponse(session_id=session_id)
 
     def close_session(self, request: CloseSessionRequest) -> CloseSessionResponse:
+        self.scheduler.remove_session(request.session_id)
         is_successful = self.__clear_session_state(request.session_id)
         return CloseSessionResponse(success=is_successful)
 
     def add_points(
         self, request: AddPointsRequest, test: str = ""
     ) -> PropagateDataResponse:
-        with self.autocast_context(), self.inference_lock:
-            session = self.__get_session(request.session_id)
-            inference_state = session["state"]
+        session = self.__get_session(request.session_id)
+        inference_state = session["state"]
 
-            frame_idx = request.frame_index
-            obj_id = request.object_id
-            points = request.points
-            labels = request.labels
-            clear_old_points = request.clear_old_points
+        frame_idx = request.frame_index
+        obj_id = request.object_id
+        points = request.points
+        labels = request.labels
+        clear_old_points = request.clear_old_points
 
+        def run(predictor):
             # add new prompts and instantly get the output on the same frame
-            frame_idx, object_ids, masks = self.predictor.add_new_points_or_box(
+            frame_idx_out, object_ids, masks = predictor.add_new_points_or_box(
                 inference_state=inference_state,
                 frame_idx=frame_idx,
                 obj_id=obj_id,
@@ -140,17 +259,22 @@ class InferenceAPI:
                 clear_old_points=clear_old_points,
                 normalize_coords=False,
             )
+            mask_rles = mask_to_rle_pytorch((masks > self.score_thresh)[:, 0])
+            return frame_idx_out, object_ids, mask_rles
 
-            masks_binary = (masks > self.score_thresh)[:, 0].cpu().numpy()
-
-            rle_mask_list = self.__get_rle_mask_list(
-                object_ids=object_ids, masks=masks_binary
+        # run lengths are computed on the worker, their string compression runs here
+        with self.session_states.use(request.session_id):
+            frame_idx, object_ids, mask_rles = self.scheduler.run(
+                request.session_id, run
             )
+        rle_mask_list = self.__get_rle_mask_list(
+            object_ids=object_ids, rles=mask_rles
+        )
 
-            return PropagateDataResponse(
-                frame_index=frame_idx,
-                results=rle_mask_list,
-            )
+        return PropagateDataResponse(
+            frame_index=frame_idx,
+            results=rle_mask_list,
+        )
 
     def add_mask(self, request: AddMaskRequest) -> PropagateDataResponse:
         """
@@ -158,39 +282,44 @@ class InferenceAPI:
         - mask is a numpy array of shape [H_im, W_im] (containing 1 for foreground and 0 for background).
         Note: providing an input mask would overwrite any previous input points on this frame.
         """
-        with self.autocast_context(), self.inference_lock:
-            session_id = request.session_id
-            frame_idx = request.frame_index
-            obj_id = request.object_id
-            rle_mask = {
-                "counts": request.mask.counts,
-                "size": request.mask.size,
-            }
+        session_id = request.session_id
+        frame_idx = request.frame_index
+        obj_id = request.object_id
+        rle_mask = {
+            "counts": request.mask.counts,
+            "size": request.mask.size,
+        }
 
-            mask = decode_masks(rle_mask)
+        mask = decode_masks(rle_mask)
 
-            logger.info(
-                f"add mask on frame {frame_idx} in session {session_id}: {obj_id=}, {mask.shape=}"
-            )
-            session = self.__get_session(session_id)
-            inference_state = session["state"]
+        logger.info(
+            f"add mask on frame {frame_idx} in session {session_id}: {obj_id=}, {mask.shape=}"
+        )
+        session = self.__get_session(session_id)
+        inference_state = session["state"]
 
-            frame_idx, obj_ids, video_res_masks = self.model.add_new_mask(
+        def run(predictor):
+            frame_idx_out, obj_ids, video_res_masks = predictor.add_new_mask(
                 inference_state=inference_state,
                 frame_idx=frame_idx,
                 obj_id=obj_id,
                 mask=torch.tensor(mask > 0),
             )
-            masks_binary = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-
-            rle_mask_list = self.__get_rle_mask_list(
-                object_ids=obj_ids, masks=masks_binary
+            mask_rles = mask_to_rle_pytorch(
+                (video_res_masks > self.score_thresh)[:, 0]
             )
+            return frame_idx_out, obj_ids, mask_rles
 
-            return PropagateDataResponse(
-                frame_index=frame_idx,
-                results=rle_mask_list,
-            )
+        with self.session_states.use(session_id):
+            frame_idx, obj_ids, mask_rles = self.scheduler.run(session_id, run)
+        rle_mask_list = self.__get_rle_mask_list(
+            object_ids=obj_ids, rles=mask_rles
+        )
+
+        return PropagateDataResponse(
+            frame_index=frame_idx,
+            results=rle_mask_list,
+        )
 
     def clear_points_in_frame(
         self, request: ClearPointsInFrameRequest
@@ -198,31 +327,37 @@ class InferenceAPI:
         """
         Remove all input points in a specific frame.
         """
-        with self.autocast_context(), self.inference_lock:
-            session_id = request.session_id
-            frame_idx = request.frame_index
-            obj_id = request.object_id
+        session_id = request.session_id
+        frame_idx = request.frame_index
+        obj_id = request.object_id
 
-            logger.info(
-                f"clear inputs on frame {frame_idx} in session {session_id}: {obj_id=}"
-            )
-            session = self.__get_session(session_id)
-            inference_state = session["state"]
-            frame_idx, obj_ids, video_res_masks = (
-                self.predictor.clear_all_prompts_in_frame(
+        logger.info(
+            f"clear inputs on frame {frame_idx} in session {session_id}: {obj_id=}"
+        )
+        session = self.__get_session(session_id)
+        inference_state = session["state"]
+
+        def run(predictor):
+            frame_idx_out, obj_ids, video_res_masks = (
+                predictor.clear_all_prompts_in_frame(
                     inference_state, frame_idx, obj_id
                 )
             )
-            masks_binary = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-
-            rle_mask_list = self.__get_rle_mask_list(
-                object_ids=obj_ids, masks=masks_binary
+            mask_rles = mask_to_rle_pytorch(
+                (video_res_masks > self.score_thresh)[:, 0]
             )
+            return frame_idx_out, obj_ids, mask_rles
 
-            return PropagateDataResponse(
-                frame_index=frame_idx,
-                results=rle_mask_list,
-            )
+        with self.session_states.use(session_id):
+            frame_idx, obj_ids, mask_rles = self.scheduler.run(session_id, run)
+        rle_mask_list = self.__get_rle_mask_list(
+            object_ids=obj_ids, rles=mask_rles
+        )
+
+        return PropagateDataResponse(
+            frame_index=frame_idx,
+            results=rle_mask_list,
+        )
 
     def clear_points_in_video(
         self, request: ClearPointsInVideoRequest
@@ -230,129 +365,222 @@ class InferenceAPI:
         """
         Remove all input points in all frames throughout the video.
         """
-        with self.autocast_context(), self.inference_lock:
-            session_id = request.session_id
-            logger.info(f"clear all inputs across the video in session {session_id}")
-            session = self.__get_session(session_id)
-            inference_state = session["state"]
-            self.predictor.reset_state(inference_state)
-            return ClearPointsInVideoResponse(success=True)
+        session_id = request.session_id
+        logger.info(f"clear all inputs across the video in session {session_id}")
+        session = self.__get_session(session_id)
+        inference_state = session["state"]
+        with self.session_states.use(session_id):
+            self.scheduler.run(
+                session_id, lambda predictor: predictor.reset_state(inference_state)
+            )
+        return ClearPointsInVideoResponse(success=True)
 
     def remove_object(self, request: RemoveObjectRequest) -> RemoveObjectResponse:
         """
         Remove an object id from the tracking state.
         """
-        with self.autocast_context(), self.inference_lock:
-            session_id = request.session_id
-            obj_id = request.object_id
-            logger.info(f"remove object in session {session_id}: {obj_id=}")
-            session = self.__get_session(session_id)
-            inference_state = session["state"]
-            new_obj_ids, updated_frames = self.predictor.remove_object(
+        session_id = request.session_id
+        obj_id = request.object_id
+        logger.info(f"remove object in session {session_id}: {obj_id=}")
+        session = self.__get_session(session_id)
+        inference_state = session["state"]
+
+        def run(predictor):
+            new_obj_ids, updated_frames = predictor.remove_object(
                 inference_state, obj_id
             )
-
-            results = []
-            for frame_index, video_res_masks in updated_frames:
-                masks = (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-                rle_mask_list = self.__get_rle_mask_list(
-                    object_ids=new_obj_ids, masks=masks
+            return new_obj_ids, [
+                (
+                    frame_index,
+                    mask_to_rle_pytorch((video_res_masks > self.score_thresh)[:, 0]),
                 )
-                results.append(
-                    PropagateDataResponse(
-                        frame_index=frame_index,
-                        results=rle_mask_list,
-                    )
+                for frame_index, video_res_masks in updated_frames
+            ]
+
+        with self.session_states.use(session_id):
+            new_obj_ids, updated_frames = self.scheduler.run(session_id, run)
+
+        results = []
+        for frame_index, mask_rles in updated_frames:
+            rle_mask_list = self.__get_rle_mask_list(
+                object_ids=new_obj_ids, rles=mask_rles
+            )
+            results.append(
+                PropagateDataResponse(
+                    frame_index=frame_index,
+                    results=rle_mask_list,
                 )
+            )
 
-            return RemoveObjectResponse(results=results)
+        return RemoveObjectResponse(results=results)
 
     def propagate_in_video(
         self, request: PropagateInVideoRequest
     ) -> Generator[PropagateDataResponse, None, None]:
-        session_id = request.session_id
-        start_frame_idx = request.start_frame_index
-        propagation_direction = "both"
-        max_frame_num_to_track = None
-
         """
         Propagate existing input points in all frames to track the object across video.
         """
+        for frame_idx, _, _, obj_ids, mask_rles, _ in self.__propagate(request):
+            yield PropagateDataResponse(
+                frame_index=frame_idx,
+                results=self.__get_rle_mask_list(object_ids=obj_ids, rles=mask_rles),
+            )
 
-        # Note that as this method is a generator, we also need to use autocast_context
-        # in caller to this method to ensure that it's called under the correct context
-        # (we've added `autocast_context` to `gen_track_with_mask_stream` in app.py).
-        with self.autocast_context(), self.inference_lock:
-            logger.info(
-                f"propagate in video in session {session_id}: "
-                f"{propagation_direction=}, {start_frame_idx=}, {max_frame_num_to_track=}"
+    def stream_propagate_in_video(
+        self, request: PropagateInVideoRequest
+    ) -> Generator[PropagateFrameChunk, None, None]:
+        """
+        Propagate like `propagate_in_video`, with each frame encoded for the
+        response stream in `request.mask_format` ("json" or "binary") along with
+        the propagation progress.
+        """
+        if request.mask_format not in ["json", "binary"]:
+            raise ValueError(f"invalid mask format: {request.mask_format}")
+        binary = request.mask_format == "binary"
+        delta = binary and request.delta
+        for frame_idx, frames_done, num_frames, obj_ids, mask_rles, flags in (
+            self.__propagate(
+                request, delta=delta, keyframe_interval=request.keyframe_interval
+            )
+        ):
+            if binary:
+                body = encode_frame(frame_idx, obj_ids, mask_rles, flags)
+                content_type = "application/octet-stream"
+                mask_type = "VarintRLE[]"
+            else:
+                response = PropagateDataResponse(
+                    frame_index=frame_idx,
+                    results=self.__get_rle_mask_list(
+                        object_ids=obj_ids, rles=mask_rles
+                    ),
+                )
+                body = response.to_json().encode("UTF-8")
+                content_type = "application/json; charset=utf-8"
+                mask_type = "RLE[]"
+            yield PropagateFrameChunk(
+                frame_index=frame_idx,
+                frames_done=frames_done,
+                num_frames=num_frames,
+                content_type=content_type,
+                mask_type=mask_type,
+                body=body,
             )
 
-            try:
-                session = self.__get_session(session_id)
-                session["canceled"] = False
+    def __propagate(
+        self,
+        request: PropagateInVideoRequest,
+        delta: bool = False,
+        keyframe_interval: int = 0,
+    ):
+        """
+        Yield (frame index, frames done, number of frames, object ids, uncompressed
+        RLEs, frame record flags) per frame. With `delta`, the RLEs are deltas
+        against the previous frame except on keyframes (the first frame, then every
+        `keyframe_interval` frames if > 0), see `MaskDeltaEncoder`.
+        """
+        session_id = request.session_id
+        start_frame_idx = request.start_frame_index
+        resume_frame_idx = request.resume_frame_index
+        propagation_direction = "both"
+        max_frame_num_to_track = None
+
+        # The propagation runs on the session's inference worker one frame at a time
+        # (interleaved with the requests of other sessions), under the worker's
+        # autocast context; the RLE compression of the masks runs here, in the caller.
+        # The worker stays at most PROPAGATE_MAX_BUFFERED_FRAMES ahead of the client.
+        logger.info(
+            f"propagate in video in session {session_id}: "
+            f"{propagation_direction=}, {start_frame_idx=}, {resume_frame_idx=}, "
+            f"{max_frame_num_to_track=}"
+        )
 
-                inference_state = session["state"]
-                if propagation_direction not in ["both", "forward", "backward"]:
-                    raise ValueError(
-                        f"invalid propagation direction: {propagation_direction}"
-                    )
+        try:
+            session = self.__get_session(session_id)
+            session["canceled"] = False
 
-                # First doing the forward propagation
-                if propagation_direction in ["both", "forward"]:
-                    for outputs in self.predictor.propagate_in_video(
-                        inference_state=inference_state,
-                        start_frame_idx=start_frame_idx,
-                        max_frame_num_to_track=max_frame_num_to_track,
-                        reverse=False,
-                    ):
-                        if session["canceled"]:
-                            return None
+            inference_state = session["state"]
+            num_frames = inference_state["num_frames"]
+            if propagation_direction not in ["both", "forward", "backward"]:
+                raise ValueError(
+                    f"invalid propagation direction: {propagation_direction}"
+                )
 
-                        frame_idx, obj_ids, video_res_masks = outputs
-                        masks_binary = (
-                            (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-                        )
-
-                        rle_mask_list = self.__get_rle_mask_list(
-                            object_ids=obj_ids, masks=masks_binary
-                        )
-
-                        yield PropagateDataResponse(
-                            frame_index=frame_idx,
-                            results=rle_mask_list,
-                        )
-
-                # Then doing the backward propagation (reverse in time)
-                if propagation_direction in ["both", "backward"]:
-                    for outputs in self.predictor.propagate_in_video(
+            # First doing the forward propagation, then the backward propagation
+            # (reverse in time), as (reverse, first frame) legs. The reference frame
+            # is sent by both legs but only counted once in the progress.
+            legs = []
+            if propagation_direction in ["both", "forward"]:
+                legs.append((False, start_frame_idx))
+            if propagation_direction in ["both", "backward"]:
+                legs.append((True, start_frame_idx))
+            frames_done = 0
+            if resume_frame_idx is not None:
+                # the tracked frames before the resume point are still in the
+                # session, so the propagation continues from there as it would have
+                if not 0 <= resume_frame_idx < num_frames:
+                    raise ValueError(f"invalid resume frame index: {resume_frame_idx}")
+                if resume_frame_idx >= start_frame_idx:
+                    # resume the forward leg, the backward leg runs in full
+                    legs = [
+                        (reverse, start_frame_idx if reverse else resume_frame_idx)
+                        for reverse, _ in legs
+                    ]
+                    frames_done = resume_frame_idx - start_frame_idx
+                else:
+                    # the forward leg is done, resume the backward leg
+                    legs = [
+                        (reverse, resume_frame_idx) for reverse, _ in legs if reverse
+                    ]
+                    frames_done = num_frames - 1 - resume_frame_idx
+
+            def propagate(predictor):
+                delta_encoder = MaskDeltaEncoder(keyframe_interval) if delta else None
+                for reverse, first_frame_idx in legs:
+                    # The Kalman filter restarts on each leg: the backward leg must not
+                    # start from the end of the forward leg, nor a resumed leg from
+                    # frames the worker had tracked ahead of the client
+                    predictor.reset_samurai_state(inference_state["samurai_state"])
+                    for outputs in predictor.propagate_in_video(
                         inference_state=inference_state,
-                        start_frame_idx=start_frame_idx,
+                        start_frame_idx=first_frame_idx,
                         max_frame_num_to_track=max_frame_num_to_track,
-                        reverse=True,
+                        reverse=reverse,
                     ):
                         if session["canceled"]:
                             return None
 
                         frame_idx, obj_ids, video_res_masks = outputs
-                        masks_binary = (
-                            (video_res_masks > self.score_thresh)[:, 0].cpu().numpy()
-                        )
-
-                        rle_mask_list = self.__get_rle_mask_list(
-                            object_ids=obj_ids, masks=masks_binary
-                        )
-
-                        yield PropagateDataResponse(
-                            frame_index=frame_idx,
-                            results=rle_mask_list,
-                        )
-            finally:
-                # Log upon completion (so that e.g. we can see if two propagations happen in parallel).
-                # Using `finally` here to log even when the tracking is aborted with GeneratorExit.
-                logger.info(
-                    f"propagation ended in session {session_id}; {self.__get_session_stats()}"
-                )
+                        masks = (video_res_masks > self.score_thresh)[:, 0]
+                        if delta_encoder is not None:
+                            mask_rles, flags = delta_encoder(obj_ids, masks)
+                        else:
+                            mask_rles, flags = mask_to_rle_pytorch(masks), 0
+                        yield reverse, frame_idx, obj_ids, mask_rles, flags
+
+            # the session is kept in memory (not spilled or expired) until the end
+            with self.session_states.use(session_id):
+                for reverse, frame_idx, obj_ids, mask_rles, flags in (
+                    self.scheduler.stream(session_id, propagate)
+                ):
+                    if session["canceled"]:
+                        return None
+
+                    if not (reverse and frame_idx == start_frame_idx):
+                        frames_done = min(frames_done + 1, num_frames)
+                    yield (
+                        frame_idx,
+                        frames_done,
+                        num_frames,
+                        obj_ids,
+                        mask_rles,
+                        flags,
+                    )
+        finally:
+            # Log upon completion (so that e.g. we can see if two propagations happen in parallel).
+            # Using `finally` here to log even when the tracking is aborted with GeneratorExit.
+            logger.info(
+                f"propagation ended in session {session_id}; {self.__get_session_stats()}"
+            )
 
     def cancel_propagate_in_video(
         self, request: CancelPropagateInVideoRequest
@@ -362,34 +590,34 @@ class InferenceAPI:
         return CancelPorpagateResponse(success=True)
 
     def __get_rle_mask_list(
-        self, object_ids: List[int], masks: np.ndarray
+        self, object_ids: List[int], rles: List[Dict[str, Any]]
     ) -> List[PropagateDataValue]:
         """
         Return a list of data values, i.e. list of object/mask combos.
         """
         return [
-            self.__get_mask_for_object(object_id=object_id, mask=mask)
-            for object_id, mask in zip(object_ids, masks)
+            self.__get_mask_for_object(object_id=object_id, rle=rle)
+            for object_id, rle in zip(object_ids, rles)
         ]
 
     def __get_mask_for_object(
-        self, object_id: int, mask: np.ndarray
+        self, object_id: int, rle: Dict[str, Any]
     ) -> PropagateDataValue:
         """
-        Create a data value for an object/mask combo.
+        Create a data value for an object/mask combo, from the uncompressed RLE
+        computed on the device by `mask_to_rle_pytorch` (the masks themselves
+        are never copied to the host).
         """
-        mask_rle = encode_masks(np.array(mask, dtype=np.uint8, order="F"))
-        mask_rle["counts"] = mask_rle["counts"].decode()
         return PropagateDataValue(
             object_id=object_id,
             mask=Mask(
-                size=mask_rle["size"],
-                counts=mask_rle["counts"],
+                size=rle["size"],
+                counts=rle_counts_to_string(rle["counts"]),
             ),
         )
 
     def __get_session(self, session_id: str):
-        session = self.session_states.get(session_id, None)
+        session = self.session_states.peek(session_id)
         if session is None:
             raise RuntimeError(
                 f"Cannot find session {session_id}; it might have expired"
@@ -397,25 +625,35 @@ class InferenceAPI:
         return session
 
     def __get_session_stats(self):
-        """Get a statistics string for live sessions and their GPU usage."""
-        # print both the session ids and their video frame numbers
-        live_session_strs = [
-            f"'{session_id}' ({session['state']['num_frames']} frames, "
-            f"{len(session['state']['obj_ids'])} objects)"
-            for session_id, session in self.session_states.items()
-        ]
+        """Get a statistics string for live sessions and their memory usage."""
+        # print the session ids, their video frame numbers and where their state is
+        live_session_strs = self.session_states.describe()
+        stats = self.session_states.stats()
         session_stats_str = (
-            "Test String Here - -"
-            f"live sessions: [{', '.join(live_session_strs)}], GPU memory: "
-            f"{torch.cuda.memory_allocated() // 1024**2} MiB used and "
-            f"{torch.cuda.memory_reserved() // 1024**2} MiB reserved"
-            f" (max over time: {torch.cuda.max_memory_allocated() // 1024**2} MiB used "
-            f"and {torch.cuda.max_memory_reserved() // 1024**2} MiB reserved)"
+            f"live sessions: [{', '.join(live_session_strs)}], "
+            f"{stats['resident_sessions']} in memory "
+            f"({stats['resident_bytes'] // 1024**2} MiB"
+        )
+        if stats["memory_budget"] > 0:
+            session_stats_str += f" of {stats['memory_budget'] // 1024**2} MiB budget"
+        session_stats_str += (
+            f"), {stats['spilled_sessions']} spilled to disk "
+            f"({stats['spilled_file_bytes'] // 1024**2} MiB); "
+            f"spilled {stats['num_spilled']} times, restored {stats['num_restored']} "
+            f"times, {stats['num_expired']} sessions expired"
         )
+        if self.device.type == "cuda":
+            session_stats_str += (
+                f"; GPU memory: "
+                f"{torch.cuda.memory_allocated() // 1024**2} MiB used and "
+                f"{torch.cuda.memory_reserved() // 1024**2} MiB reserved"
+                f" (max over time: {torch.cuda.max_memory_allocated() // 1024**2} MiB used "
+                f"and {torch.cuda.max_memory_reserved() // 1024**2} MiB reserved)"
+            )
         return session_stats_str
 
     def __clear_session_state(self, session_id: str) -> bool:
-        session = self.session_states.pop(session_id, None)
+        session = self.session_states.remove(session_id)
         if session is None:
             logger.warning(
                 f"cannot close session {session_id} as it does not exist (it might have expired); "
@@ -425,3 +663,7 @@ class InferenceAPI:
         else:
             logger.info(f"removed session {session_id}; {self.__get_session_stats()}")
             return True
+
+    def __on_session_expired(self, session_id: str) -> None:
+        self.scheduler.remove_session(session_id)
+        logger.info(f"expired session {session_id}; {self.__get_session_stats()}")
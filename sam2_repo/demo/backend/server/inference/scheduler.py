@@ -0,0 +1,298 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import itertools
+import logging
+import queue
+import threading
+from collections import deque
+from typing import (
+    Any,
+    Callable,
+    ContextManager,
+    Deque,
+    Dict,
+    Generator,
+    List,
+    Optional,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    """A unit of session work: a single call, or a generator run one step at a time."""
+
+    def __init__(
+        self,
+        seq: int,
+        fn: Optional[Callable[[Any], Any]] = None,
+        gen_fn: Optional[Callable[[Any], Generator]] = None,
+    ) -> None:
+        self.seq = seq
+        self.fn = fn
+        self.gen_fn = gen_fn
+        self.gen: Optional[Generator] = None
+        self.results: "queue.Queue" = queue.Queue()
+        # stream outputs not taken by the consumer yet (backpressure)
+        self.buffered = 0
+        self.cancelled = False
+        self.last_run = 0
+
+    @property
+    def interactive(self) -> bool:
+        return self.fn is not None
+
+
+class _Session:
+    def __init__(self, worker: int) -> None:
+        self.worker = worker
+        self.jobs: Deque[_Job] = deque()
+        self.busy = False
+
+
+class InferenceScheduler:
+    """
+    Runs the model work of many sessions concurrently instead of behind a
+    single lock.
+
+    Each session is assigned to one of `num_workers` worker threads (the one
+    with the fewest sessions). A worker runs with its own context from
+    `worker_context(worker)`, e.g. its own CUDA stream, and uses the model
+    replica `replicas[worker % len(replicas)]`. Pinning a session to a worker
+    keeps all of its tensors on one stream.
+
+    The work of a session runs in submission order, one job at a time, so an
+    interactive request made during a propagation of the same session waits
+    for it to end (or be cancelled), as before. Across the sessions of a
+    worker:
+    - interactive jobs (`run`) go first, in submission order
+    - propagations (`stream`) advance one step (one frame) at a time, taking
+      turns, so a long propagation neither blocks other sessions' clicks nor
+      starves other propagations
+    - a propagation doesn't run more than `max_buffered` steps ahead of the
+      client consuming it
+    """
+
+    def __init__(
+        self,
+        replicas: List[Any],
+        num_workers: int = 1,
+        worker_context: Optional[Callable[[int], ContextManager]] = None,
+        max_buffered: int = 2,
+    ) -> None:
+        assert len(replicas) > 0
+        self.replicas = replicas
+        self.num_workers = max(num_workers, 1)
+        self.worker_context = worker_context or (
+            lambda worker: contextlib.nullcontext()
+        )
+        self.max_buffered = max_buffered
+        self._sessions: Dict[str, _Session] = {}
+        self._cond = threading.Condition()
+        # started generators to close on their worker, after their session is removed
+        self._orphans: List[List[_Job]] = [[] for _ in range(self.num_workers)]
+        self._seq = itertools.count()
+        self._steps = itertools.count(1)
+        self._threads = []
+        for worker in range(self.num_workers):
+            thread = threading.Thread(
+                target=self._run_worker,
+                args=(worker,),
+                name=f"inference_worker_{worker}",
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def add_session(self, session_id: str) -> int:
+        """Assign a new session to the least loaded worker, returns the worker"""
+        with self._cond:
+            load = [0] * self.num_workers
+            for session in self._sessions.values():
+                load[session.worker] += 1
+            worker = load.index(min(load))
+            self._sessions[session_id] = _Session(worker)
+            return worker
+
+    def remove_session(self, session_id: str) -> None:
+        """Forget a session; its pending propagations are cancelled"""
+        with self._cond:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                for job in session.jobs:
+                    job.cancelled = True
+                self._orphans[session.worker].extend(session.jobs)
+            self._cond.notify_all()
+
+    def run(self, session_id: Optional[str], fn: Callable[[Any], Any]) -> Any:
+        """
+        Run `fn(replica)` on the session's worker and return its result (blocking).
+        With `session_id=None` (e.g. to create a session), `fn` runs on a worker
+        that is picked like for a new session.
+        """
+        job = _Job(next(self._seq), fn=fn)
+        temporary = session_id is None
+        if temporary:
+            session_id = f"__run_{job.seq}"
+            self.add_session(session_id)
+        try:
+            self._submit(session_id, job)
+            kind, value = job.results.get()
+        finally:
+            if temporary:
+                self.remove_session(session_id)
+        if kind == "error":
+            raise value
+        return value
+
+    def stream(
+        self, session_id: str, gen_fn: Callable[[Any], Generator]
+    ) -> Generator[Any, None, None]:
+        """
+        Run the generator `gen_fn(replica)` on the session's worker one step at
+        a time, yielding its outputs. Closing the returned generator cancels it.
+        """
+        job = _Job(next(self._seq), gen_fn=gen_fn)
+        self._submit(session_id, job)
+        finished = False
+        try:
+            while True:
+                kind, value = job.results.get()
+                with self._cond:
+                    job.buffered -= 1
+                    self._cond.notify_all()
+                if kind == "item":
+                    yield value
+                elif kind == "done":
+                    finished = True
+                    return
+                else:
+                    finished = True
+                    raise value
+        finally:
+            if not finished:
+                with self._cond:
+                    job.cancelled = True
+                    self._cond.notify_all()
+
+    def _submit(self, session_id: str, job: _Job) -> None:
+        with self._cond:
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise RuntimeError(
+                    f"Cannot find session {session_id}; it might have expired"
+                )
+            session.jobs.append(job)
+            self._cond.notify_all()
+
+    # worker side
+
+    def _runnable(self, session: _Session) -> Optional[_Job]:
+        if session.busy or not session.jobs:
+            return None
+        job = session.jobs[0]
+        if job.cancelled or job.interactive or job.buffered < self.max_buffered:
+            return job
+        return None
+
+    def _next_job(self, worker: int):
+        """(session, job) to run next on `worker`, or None (holding the lock)"""
+        candidates = []
+        for session in self._sessions.values():
+            if session.worker != worker:
+                continue
+            job = self._runnable(session)
+            if job is not None:
+                candidates.append((session, job))
+        if not candidates:
+            return None
+        # cancelled jobs are cleaned up first, then interactive jobs in submission
+        # order, then the propagation that has waited the longest for its next step
+        return min(
+            candidates,
+            key=lambda c: (
+                not c[1].cancelled,
+                not c[1].interactive,
+                c[1].last_run,
+                c[1].seq,
+            ),
+        )
+
+    def _run_worker(self, worker: int) -> None:
+        while True:
+            with self._cond:
+                orphans, picked = [], None
+                while not orphans and picked is None:
+                    orphans, self._orphans[worker] = self._orphans[worker], []
+                    picked = None if orphans else self._next_job(worker)
+                    if not orphans and picked is None:
+                        self._cond.wait()
+                if picked is not None:
+                    session, job = picked
+                    session.busy = True
+                    if not job.interactive and not job.cancelled:
+                        job.buffered += 1
+                        job.last_run = next(self._steps)
+
+            if orphans:
+                with self.worker_context(worker):
+                    for job in orphans:
+                        self._close(job)
+                continue
+
+            replica = self.replicas[worker % len(self.replicas)]
+            done = True
+            try:
+                with self.worker_context(worker):
+                    done = self._step(job, replica)
+                    if not done and job.cancelled:
+                        # cancelled (or its session removed) during this step
+                        self._close(job)
+                        done = True
+            finally:
+                with self._cond:
+                    session.busy = False
+                    if done and session.jobs and session.jobs[0] is job:
+                        session.jobs.popleft()
+                    self._cond.notify_all()
+
+    def _step(self, job: _Job, replica: Any) -> bool:
+        """Run one unit of `job`, returns whether the job is finished"""
+        if job.cancelled:
+            self._close(job)
+            return True
+        if job.interactive:
+            try:
+                job.results.put(("result", job.fn(replica)))
+            except Exception as e:
+                job.results.put(("error", e))
+            return True
+        try:
+            if job.gen is None:
+                job.gen = job.gen_fn(replica)
+            job.results.put(("item", next(job.gen)))
+            return False
+        except StopIteration:
+            job.results.put(("done", None))
+            return True
+        except Exception as e:
+            logger.exception("inference stream failed")
+            job.results.put(("error", e))
+            return True
+
+    def _close(self, job: _Job) -> None:
+        """End a cancelled job, waking up its caller if it is still waiting"""
+        if job.gen is not None:
+            try:
+                job.gen.close()
+            except Exception:
+                logger.exception("failed to close a cancelled inference stream")
+            job.gen = None
+        if job.interactive:
+            job.results.put(("error", RuntimeError("the session was closed")))
+        else:
+            job.results.put(("done", None))
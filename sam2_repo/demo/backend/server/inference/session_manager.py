@@ -0,0 +1,455 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import contextlib
+import gzip
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections.abc import MutableMapping
+from typing import Any, Callable, Dict, Generator, List, Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+
+class _SpilledTensor:
+    """Placeholder left in a spilled inference state for the tensor at `index`"""
+
+    __slots__ = ("index",)
+
+    def __init__(self, index: int) -> None:
+        self.index = index
+
+
+def _map_state(value: Any, fn: Callable[[Any], Any]) -> Any:
+    """
+    Apply `fn` to the tensors and placeholders of an inference state, in place
+    for dicts and lists (tuples are rebuilt). Mappings that page their own
+    values out (RollingMemoryStore) are only walked over their resident frames.
+    """
+    if isinstance(value, (torch.Tensor, _SpilledTensor)):
+        return fn(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            value[key] = _map_state(item, fn)
+        return value
+    if isinstance(value, MutableMapping):
+        is_resident = getattr(value, "is_resident", lambda key: True)
+        for key in [key for key in value if is_resident(key)]:
+            value[key] = _map_state(value[key], fn)
+        return value
+    if isinstance(value, list):
+        for i, item in enumerate(value):
+            value[i] = _map_state(item, fn)
+        return value
+    if isinstance(value, tuple):
+        return tuple(_map_state(item, fn) for item in value)
+    return value
+
+
+def _state_bytes(state: Dict[str, Any]) -> int:
+    """Bytes held by the tensors of an inference state (shared storages counted once)"""
+    storages = {}
+
+    def count(x):
+        if isinstance(x, torch.Tensor):
+            storage = x.untyped_storage()
+            storages[(x.device, storage.data_ptr())] = storage.nbytes()
+        return x
+
+    _map_state(state, count)
+    cached_features = state.get("cached_features")
+    cache_bytes = 0
+    if cached_features is not None and hasattr(cached_features, "stats"):
+        cache_stats = cached_features.stats()
+        cache_bytes = cache_stats["gpu_bytes"] + cache_stats["cpu_bytes"]
+    return sum(storages.values()) + cache_bytes
+
+
+def _close_state(state: Dict[str, Any]) -> None:
+    """
+    Release what an inference state holds besides tensors: the decode threads of
+    its frame loader and the spill files of its memory store
+    """
+    non_cond_outputs = state.get("output_dict", {}).get("non_cond_frame_outputs")
+    for resource in (state.get("images"), non_cond_outputs):
+        close = getattr(resource, "close", None)
+        if close is None:
+            continue
+        try:
+            close()
+        except Exception:
+            logger.exception("failed to close a session state")
+
+
+class SessionManager:
+    """
+    Holds the sessions of InferenceAPI and bounds the memory they use.
+
+    Each session is a dict {"canceled": bool, "state": inference_state}. Sessions
+    are used through `use(session_id)` while a request works on them; idle
+    sessions (not in use) are:
+    - closed after `ttl` seconds without access (e.g. an abandoned browser tab)
+    - spilled to disk after `idle_spill_after` seconds without access, or as
+      soon as the resident sessions exceed `memory_budget` bytes (least recently
+      used first)
+
+    Spilling saves all tensors of the session (frames, outputs, memories) into
+    one gzip-compressed file under `spill_dir` and drops the image feature cache,
+    which is recomputed on demand. The next `use` of the session loads it back
+    on the devices it was on. `ttl`, `idle_spill_after` and `memory_budget` of 0
+    disable the corresponding limit.
+
+    The limits are enforced by a sweeper thread (every `sweep_interval` seconds,
+    and right after a request when there is a memory budget), never in the
+    request threads. Spill and restore files are written and read without the
+    manager's lock, so only requests to the session being moved wait for it.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 0,
+        idle_spill_after: float = 0,
+        memory_budget: int = 0,
+        spill_dir: Optional[str] = None,
+        compress_level: int = 1,
+        sweep_interval: float = 60,
+        on_expire: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.ttl = ttl
+        self.idle_spill_after = idle_spill_after
+        self.memory_budget = memory_budget
+        self.compress_level = compress_level
+        self.on_expire = on_expire
+        self._spill_dir = spill_dir
+        self._own_spill_dir = False
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        # bookkeeping of each session: last access time, users, size, spill file
+        # and the spill or restore in progress ("io")
+        self._info: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.RLock()
+        # notified when a session is done spilling or restoring
+        self._io_done = threading.Condition(self._lock)
+        # wakes the sweeper up before its next interval
+        self._wake = threading.Event()
+        self._num_spilled = 0
+        self._num_restored = 0
+        self._num_expired = 0
+        has_limits = ttl > 0 or idle_spill_after > 0 or memory_budget > 0
+        if sweep_interval > 0 and has_limits:
+            # expire and spill sessions even when no requests come in
+            thread = threading.Thread(
+                target=self._sweep_loop,
+                args=(sweep_interval,),
+                name="session_sweeper",
+                daemon=True,
+            )
+            thread.start()
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def add(self, session_id: str, state: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            session = {"canceled": False, "state": state}
+            self._sessions[session_id] = session
+            self._info[session_id] = {
+                "last_access": time.monotonic(),
+                "users": 0,
+                "nbytes": _state_bytes(state),
+                "spill_path": None,
+                "io": None,
+            }
+        self._request_sweep()
+        return session
+
+    def peek(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """The session (possibly spilled), without touching or restoring it"""
+        return self._sessions.get(session_id)
+
+    @contextlib.contextmanager
+    def use(self, session_id: str) -> Generator[Dict[str, Any], None, None]:
+        """
+        The session, restored if it was spilled; it is not spilled or expired
+        until the block exits.
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                raise RuntimeError(
+                    f"Cannot find session {session_id}; it might have expired"
+                )
+            info = self._info[session_id]
+            # a spill or restore of this session in progress finishes first
+            while info["io"] is not None:
+                self._io_done.wait()
+            if self._sessions.get(session_id) is not session:
+                raise RuntimeError(
+                    f"Cannot find session {session_id}; it might have expired"
+                )
+            info["users"] += 1
+            info["last_access"] = time.monotonic()
+            restore = info["spill_path"] is not None
+            if restore:
+                info["io"] = "restoring"
+        try:
+            if restore:
+                self._restore(session_id, session, info)
+            yield session
+        finally:
+            with self._lock:
+                info["users"] -= 1
+                info["last_access"] = time.monotonic()
+                removed = self._sessions.get(session_id) is not session
+                if not removed and info["users"] == 0:
+                    info["nbytes"] = _state_bytes(session["state"])
+                close = removed and info["users"] == 0 and info["io"] is None
+            if close:
+                # removed while in use
+                _close_state(session["state"])
+            self._request_sweep()
+
+    def remove(self, session_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            info = self._info.pop(session_id, None)
+            # a session in use or being spilled is closed (and its file removed)
+            # once that is done
+            spill_path, close = None, False
+            if info is not None and info["io"] is None:
+                spill_path = info["spill_path"]
+                close = info["users"] == 0
+        if spill_path is not None:
+            self._remove_file(spill_path)
+        if close:
+            _close_state(session["state"])
+        return session
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            resident = [i for i in self._info.values() if i["spill_path"] is None]
+            spilled = [i for i in self._info.values() if i["spill_path"] is not None]
+            return {
+                "sessions": len(self._sessions),
+                "resident_sessions": len(resident),
+                "resident_bytes": sum(i["nbytes"] for i in resident),
+                "active_sessions": sum(i["users"] > 0 for i in resident),
+                "spilled_sessions": len(spilled),
+                "spilled_file_bytes": sum(i["spill_bytes"] for i in spilled),
+                "memory_budget": self.memory_budget,
+                "num_spilled": self._num_spilled,
+                "num_restored": self._num_restored,
+                "num_expired": self._num_expired,
+            }
+
+    def describe(self) -> List[str]:
+        """One line per session: id, frames, objects and where its state is"""
+        with self._lock:
+            lines = []
+            for session_id, session in self._sessions.items():
+                info = self._info[session_id]
+                state = session["state"]
+                where = (
+                    "spilled"
+                    if info["spill_path"] is not None
+                    else f"{info['nbytes'] // 1024**2} MiB"
+                )
+                lines.append(
+                    f"'{session_id}' ({state['num_frames']} frames, "
+                    f"{len(state['obj_ids'])} objects, {where})"
+                )
+            return lines
+
+    def close(self) -> None:
+        """Remove all sessions and the spill files"""
+        with self._lock:
+            for session_id in list(self._sessions):
+                self.remove(session_id)
+            if self._own_spill_dir and self._spill_dir is not None:
+                shutil.rmtree(self._spill_dir, ignore_errors=True)
+                self._spill_dir = None
+                self._own_spill_dir = False
+
+    # limits
+
+    def sweep(self) -> None:
+        """Close expired sessions and spill idle ones (the file I/O runs unlocked)"""
+        expired, to_spill = self._plan_sweep()
+        for session_id, session, info in expired:
+            logger.info(
+                f"closing session {session_id} after "
+                f"{time.monotonic() - info['last_access']:.0f}s without access"
+            )
+            if info["spill_path"] is not None:
+                self._remove_file(info["spill_path"])
+            _close_state(session["state"])
+            if self.on_expire is not None:
+                self.on_expire(session_id)
+        for session_id, session, info in to_spill:
+            try:
+                self._spill(session_id, session, info)
+            except Exception:
+                # the session stays in memory, the others are still spilled
+                logger.exception(f"failed to spill session {session_id}")
+
+    def _sweep_loop(self, interval: float) -> None:
+        while True:
+            self._wake.wait(interval)
+            self._wake.clear()
+            try:
+                self.sweep()
+            except Exception:
+                logger.exception("failed to sweep sessions")
+
+    def _request_sweep(self) -> None:
+        """Have the sweeper check the memory budget now, not at its next interval"""
+        if self.memory_budget > 0:
+            self._wake.set()
+
+    def _plan_sweep(self):
+        """
+        Remove the expired sessions and mark the sessions to spill as "spilling"
+        (so they are not used until the spill is done), under the lock
+        """
+        with self._lock:
+            now = time.monotonic()
+            idle = sorted(
+                (info["last_access"], session_id)
+                for session_id, info in self._info.items()
+                if info["users"] == 0 and info["io"] is None
+            )
+            expired, to_spill = [], []
+            for last_access, session_id in idle:
+                info = self._info[session_id]
+                if self.ttl > 0 and now - last_access > self.ttl:
+                    session = self._sessions.pop(session_id)
+                    expired.append((session_id, session, self._info.pop(session_id)))
+                    self._num_expired += 1
+                elif (
+                    self.idle_spill_after > 0
+                    and now - last_access > self.idle_spill_after
+                    and info["spill_path"] is None
+                ):
+                    to_spill.append(session_id)
+
+            if self.memory_budget > 0:
+                resident_bytes = sum(
+                    info["nbytes"]
+                    for session_id, info in self._info.items()
+                    if info["spill_path"] is None and session_id not in to_spill
+                )
+                for _, session_id in idle:
+                    if resident_bytes <= self.memory_budget:
+                        break
+                    info = self._info.get(session_id)
+                    if (
+                        info is None
+                        or info["spill_path"] is not None
+                        or session_id in to_spill
+                    ):
+                        continue
+                    resident_bytes -= info["nbytes"]
+                    to_spill.append(session_id)
+
+            for session_id in to_spill:
+                self._info[session_id]["io"] = "spilling"
+            to_spill = [
+                (session_id, self._sessions[session_id], self._info[session_id])
+                for session_id in to_spill
+            ]
+            if to_spill and self._spill_dir is None:
+                self._spill_dir = tempfile.mkdtemp(prefix="sam2_sessions_")
+                self._own_spill_dir = True
+            return expired, to_spill
+
+    # spilling
+
+    def _spill(
+        self, session_id: str, session: Dict[str, Any], info: Dict[str, Any]
+    ) -> None:
+        """Save a session marked "spilling" to disk (called without the lock)"""
+        state = session["state"]
+        os.makedirs(self._spill_dir, exist_ok=True)
+        path = os.path.join(self._spill_dir, f"{session_id}.pt.gz")
+        tensors = []
+        saved = False
+        try:
+            # features are cheaper to recompute than to store
+            if state.get("cached_features") is not None:
+                state["cached_features"].clear()
+            if state.get("encoded_ahead") is not None:
+                state["encoded_ahead"].clear()
+
+            def take(x):
+                tensors.append(x)
+                return _SpilledTensor(len(tensors) - 1)
+
+            _map_state(state, take)
+            # one torch.save keeps the views sharing storage (e.g. "output_dict_per_obj"
+            # slices of "output_dict") shared after loading, on their original devices
+            with gzip.open(path, "wb", compresslevel=self.compress_level) as f:
+                torch.save(tensors, f)
+            saved = True
+        finally:
+            if not saved:
+                # keep the session in memory
+                _map_state(
+                    state,
+                    lambda x: tensors[x.index] if isinstance(x, _SpilledTensor) else x,
+                )
+            with self._lock:
+                removed = self._sessions.get(session_id) is not session
+                if saved and not removed:
+                    info["spill_path"] = path
+                    info["spill_bytes"] = os.path.getsize(path)
+                    self._num_spilled += 1
+                info["io"] = None
+                self._io_done.notify_all()
+        if removed:
+            # closed while it was being spilled
+            self._remove_file(path)
+            _close_state(state)
+            return
+        logger.info(
+            f"spilled session {session_id} ({info['nbytes'] // 1024**2} MiB in memory, "
+            f"{info['spill_bytes'] // 1024**2} MiB on disk)"
+        )
+
+    def _restore(
+        self, session_id: str, session: Dict[str, Any], info: Dict[str, Any]
+    ) -> None:
+        """Load a session marked "restoring" back (called without the lock)"""
+        path = info["spill_path"]
+        restored = False
+        try:
+            with gzip.open(path, "rb") as f:
+                tensors = torch.load(f)
+            _map_state(session["state"], lambda x: tensors[x.index])
+            restored = True
+        finally:
+            with self._lock:
+                removed = self._sessions.get(session_id) is not session
+                if restored:
+                    info["spill_path"] = None
+                    self._num_restored += 1
+                info["io"] = None
+                self._io_done.notify_all()
+            if restored or removed:
+                self._remove_file(path)
+        logger.info(f"restored session {session_id} from disk")
+
+    def _remove_file(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
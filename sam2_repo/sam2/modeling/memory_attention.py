@@ -63,11 +63,15 @@ class MemoryAttentionLayer(nn.Module):
         tgt = tgt + self.dropout1(tgt2)
         return tgt
 
-    def _forward_ca(self, tgt, memory, query_pos, pos, num_k_exclude_rope=0):
+    def _forward_ca(
+        self, tgt, memory, query_pos, pos, num_k_exclude_rope=0, memory_mask=None
+    ):
         kwds = {}
         if num_k_exclude_rope > 0:
             assert isinstance(self.cross_attn_image, RoPEAttention)
             kwds = {"num_k_exclude_rope": num_k_exclude_rope}
+        if memory_mask is not None:
+            kwds["attn_mask"] = memory_mask
 
         # Cross-Attention
         tgt2 = self.norm2(tgt)
@@ -87,11 +91,14 @@ class MemoryAttentionLayer(nn.Module):
         pos: Optional[Tensor] = None,
         query_pos: Optional[Tensor] = None,
         num_k_exclude_rope: int = 0,
+        memory_mask: Optional[Tensor] = None,
     ) -> torch.Tensor:
 
         # Self-Attn, Cross-Attn
         tgt = self._forward_sa(tgt, query_pos)
-        tgt = self._forward_ca(tgt, memory, query_pos, pos, num_k_exclude_rope)
+        tgt = self._forward_ca(
+            tgt, memory, query_pos, pos, num_k_exclude_rope, memory_mask
+        )
         # MLP
         tgt2 = self.norm3(tgt)
         tgt2 = self.linear2(self.dropout(self.activation(self.linear1(tgt2))))
@@ -123,6 +130,7 @@ class MemoryAttention(nn.Module):
         curr_pos: Optional[Tensor] = None,  # pos_enc for self-attention inputs
         memory_pos: Optional[Tensor] = None,  # pos_enc for cross-attention inputs
         num_obj_ptr_tokens: int = 0,  # number of object pointer *tokens*
+        memory_mask: Optional[Tensor] = None,  # [memory_len] bool, False = padding
     ):
         if isinstance(curr, list):
             assert isinstance(curr_pos, list)
@@ -147,10 +155,16 @@ class MemoryAttention(nn.Module):
             memory = memory.transpose(0, 1)
             memory_pos = memory_pos.transpose(0, 1)
 
+        if memory_mask is not None:
+            # broadcast over (batch, heads, queries) in scaled_dot_product_attention
+            memory_mask = memory_mask.view(1, 1, 1, -1)
+
         for layer in self.layers:
             kwds = {}
             if isinstance(layer.cross_attn_image, RoPEAttention):
                 kwds = {"num_k_exclude_rope": num_obj_ptr_tokens}
+            if memory_mask is not None:
+                kwds["memory_mask"] = memory_mask
 
             output = layer(
                 tgt=output,
@@ -8,7 +8,7 @@ import contextlib
 import math
 import warnings
 from functools import partial
-from typing import Tuple, Type
+from typing import Optional, Tuple, Type
 
 import torch
 import torch.nn.functional as F
@@ -28,13 +28,19 @@ OLD_GPU, USE_FLASH_ATTN, MATH_KERNEL_ON = get_sdpa_settings()
 ALLOW_ALL_KERNELS = False
 
 
-def sdp_kernel_context(dropout_p):
+def sdp_kernel_context(dropout_p, masked=False):
     """
     Get the context for the attention scaled dot-product kernel. We use Flash Attention
     by default, but fall back to all available kernels if Flash Attention fails.
+    Flash Attention doesn't take an attention mask, so `masked` attention (padded
+    memories, see `SAM2Base.compile_tracking_step`) uses the other kernels.
     """
     if ALLOW_ALL_KERNELS:
         return contextlib.nullcontext()
+    if masked:
+        return torch.backends.cuda.sdp_kernel(
+            enable_flash=False, enable_math=True, enable_mem_efficient=True
+        )
 
     return torch.backends.cuda.sdp_kernel(
         enable_flash=USE_FLASH_ATTN,
@@ -255,7 +261,9 @@ class Attention(nn.Module):
         x = x.transpose(1, 2)
         return x.reshape(b, n_tokens, n_heads * c_per_head)  # B x N_tokens x C
 
-    def forward(self, q: Tensor, k: Tensor, v: Tensor) -> Tensor:
+    def forward(
+        self, q: Tensor, k: Tensor, v: Tensor, attn_mask: Optional[Tensor] = None
+    ) -> Tensor:
         # Input projections
         q = self.q_proj(q)
         k = self.k_proj(k)
@@ -269,8 +277,10 @@ class Attention(nn.Module):
         dropout_p = self.dropout_p if self.training else 0.0
         # Attention
         try:
-            with sdp_kernel_context(dropout_p):
-                out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            with sdp_kernel_context(dropout_p, masked=attn_mask is not None):
+                out = F.scaled_dot_product_attention(
+                    q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+                )
         except Exception as e:
             # Fall back to all kernels if the Flash attention kernel fails
             warnings.warn(
@@ -281,7 +291,9 @@ class Attention(nn.Module):
             )
             global ALLOW_ALL_KERNELS
             ALLOW_ALL_KERNELS = True
-            out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            out = F.scaled_dot_product_attention(
+                q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+            )
 
         out = self._recombine_heads(out)
         out = self.out_proj(out)
@@ -312,7 +324,12 @@ class RoPEAttention(Attention):
         self.rope_k_repeat = rope_k_repeat
 
     def forward(
-        self, q: Tensor, k: Tensor, v: Tensor, num_k_exclude_rope: int = 0
+        self,
+        q: Tensor,
+        k: Tensor,
+        v: Tensor,
+        num_k_exclude_rope: int = 0,
+        attn_mask: Optional[Tensor] = None,
     ) -> Tensor:
         # Input projections
         q = self.q_proj(q)
@@ -343,8 +360,10 @@ class RoPEAttention(Attention):
         dropout_p = self.dropout_p if self.training else 0.0
         # Attention
         try:
-            with sdp_kernel_context(dropout_p):
-                out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            with sdp_kernel_context(dropout_p, masked=attn_mask is not None):
+                out = F.scaled_dot_product_attention(
+                    q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+                )
         except Exception as e:
             # Fall back to all kernels if the Flash attention kernel fails
             warnings.warn(
@@ -355,7 +374,9 @@ class RoPEAttention(Attention):
             )
             global ALLOW_ALL_KERNELS
             ALLOW_ALL_KERNELS = True
-            out = F.scaled_dot_product_attention(q, k, v, dropout_p=dropout_p)
+            out = F.scaled_dot_product_attention(
+                q, k, v, attn_mask=attn_mask, dropout_p=dropout_p
+            )
 
         out = self._recombine_heads(out)
         out = self.out_proj(out)
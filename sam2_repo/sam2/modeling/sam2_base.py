@@ -4,6 +4,9 @@
 # This source code is licensed under the license found in the
 # LICENSE file in the root directory of this source tree.
 
+import bisect
+import os
+
 from loguru import logger
 
 import torch
@@ -17,6 +20,7 @@ from sam2.modeling.sam.prompt_encoder import PromptEncoder
 from sam2.modeling.sam.transformer import TwoWayTransformer
 from sam2.modeling.sam2_utils import get_1d_sine_pe, MLP, select_closest_cond_frames
 
+from sam2.utils.amg import batched_mask_logits_to_box
 from sam2.utils.kalman_filter import KalmanFilter
 
 # a large negative value as a placeholder score for missing objects
@@ -107,6 +111,9 @@ class SAM2Base(torch.nn.Module):
         memory_bank_iou_threshold: float = 0.5,
         memory_bank_obj_score_threshold: float = 0.0,
         memory_bank_kf_score_threshold: float = 0.0,
+        # Take the candidate boxes for motion scoring from the low-res mask logits
+        # (4x smaller, boxes accurate to 4 pixels) instead of the upsampled masks
+        samurai_bbox_from_low_res: bool = False,
     ):
         super().__init__()
 
@@ -200,13 +207,7 @@ class SAM2Base(torch.nn.Module):
 
         # Init Kalman Filter
         self.kf = KalmanFilter()
-        self.kf_mean = None
-        self.kf_covariance = None
-        self.stable_frames = 0
-
-        # Debug purpose
-        self.history = {} # debug
-        self.frame_cnt = 0 # debug
+        self.reset_samurai_state()
 
         # Hyperparameters for SAMURAI
         self.stable_frames_threshold = stable_frames_threshold
@@ -216,6 +217,7 @@ class SAM2Base(torch.nn.Module):
         self.memory_bank_iou_threshold = memory_bank_iou_threshold
         self.memory_bank_obj_score_threshold = memory_bank_obj_score_threshold
         self.memory_bank_kf_score_threshold = memory_bank_kf_score_threshold
+        self.samurai_bbox_from_low_res = samurai_bbox_from_low_res
 
         print(f"\033[93mSAMURAI mode: {self.samurai_mode}\033[0m")
 
@@ -231,6 +233,160 @@ class SAM2Base(torch.nn.Module):
                 fullgraph=True,
                 dynamic=False,
             )
+        # Pad memories and object pointers to fixed sizes, see `compile_tracking_step`
+        self.static_memory_shapes = False
+        # Upsample all candidate masks to the image size (e.g. for training losses),
+        # otherwise only the selected mask is (unless SAMURAI needs full-res boxes)
+        self.upsample_candidate_masks = True
+
+    def compile_tracking_step(self, mode=None, cache_dir=None):
+        """
+        Opt-in compiled tracking: compile the modules that run on every tracked
+        frame (memory attention, SAM mask decoder, memory encoder) with static
+        shapes. Memories and object pointers are padded to a fixed number of
+        slots (the padding is masked out in attention), so each module is
+        compiled once per video size and object count instead of again every
+        time the memory bank grows.
+
+        `cache_dir` keeps the compiled kernels on disk (Inductor's FX graph
+        cache), so later processes skip most of the compilation. Use
+        `warm_up_tracking_step` to compile before the first tracked frame.
+        """
+        if self.static_memory_shapes:
+            return
+        if self.max_cond_frames_in_attn <= 0:
+            logger.warning(
+                "compiled tracking without a limit on the conditioning frames in "
+                "attention (max_cond_frames_in_attn=-1): the modules are recompiled "
+                "for every new number of conditioning frames"
+            )
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+            os.environ["TORCHINDUCTOR_FX_GRAPH_CACHE"] = "1"
+            import torch._inductor.config as inductor_config
+
+            if hasattr(inductor_config, "fx_graph_cache"):
+                inductor_config.fx_graph_cache = True
+        # Compile the forward functions (not the modules) to allow loading checkpoints.
+        for module in (self.memory_attention, self.sam_mask_decoder, self.memory_encoder):
+            module.forward = torch.compile(module.forward, mode=mode, dynamic=False)
+        self.static_memory_shapes = True
+
+    def warm_up_tracking_step(self, batch_size=1, num_frames=None, num_iters=2):
+        """
+        Run the tracking step on placeholder inputs with the shapes of tracking
+        `batch_size` objects in a video of `num_frames` frames, so the modules
+        compiled by `compile_tracking_step` are built before the first real
+        frame. Call it under the same autocast / inference mode as tracking.
+        """
+        device = self.device
+        B, C = batch_size, self.hidden_dim
+        H = W = self.image_size // self.backbone_stride
+        if num_frames is None:
+            num_frames = self.max_obj_ptrs_in_encoder
+
+        feat_sizes, vision_feats, vision_pos_embeds = [], [], []
+        for level in range(self.num_feature_levels):
+            scale = 2 ** (self.num_feature_levels - 1 - level)
+            channels = C
+            if level < self.num_feature_levels - 1:
+                channels = C // 8 if level == 0 else C // 4  # conv_s0 / conv_s1
+            feat_sizes.append((H * scale, W * scale))
+            vision_feats.append(torch.zeros(H * W * scale**2, B, channels, device=device))
+            vision_pos_embeds.append(torch.zeros(H * W * scale**2, B, C, device=device))
+
+        # a conditioning frame and a previous frame, padded like any other frame
+        placeholder_out = {
+            "maskmem_features": torch.zeros(B, self.mem_dim, H, W, device=device),
+            "maskmem_pos_enc": [torch.zeros(B, self.mem_dim, H, W, device=device)],
+            "obj_ptr": torch.zeros(B, C, device=device),
+        }
+        output_dict = {
+            "cond_frame_outputs": {0: placeholder_out},
+            "non_cond_frame_outputs": {1: placeholder_out},
+        }
+        for _ in range(num_iters):
+            self.track_step(
+                frame_idx=2,
+                is_init_cond_frame=False,
+                current_vision_feats=vision_feats,
+                current_vision_pos_embeds=vision_pos_embeds,
+                feat_sizes=feat_sizes,
+                point_inputs=None,
+                mask_inputs=None,
+                output_dict=output_dict,
+                num_frames=num_frames,
+                samurai_state=self.init_samurai_state(),
+            )
+
+    def build_memory_constants(self, maskmem_pos_enc, num_frames):
+        """
+        Positional encodings of memory conditioning that are the same on every
+        frame of a video, so `_prepare_memory_conditioned_features` gathers them
+        by index instead of recomputing them per frame and slot:
+        - "maskmem_pos_by_tpos": [num_maskmem, HW, 1, mem_dim], the spatial
+          encoding (`maskmem_pos_enc`, the same for all memory frames) plus the
+          temporal encoding of each memory slot
+        - "obj_ptr_pos": [2 * num_frames - 1, mem_dim], the projected temporal
+          encoding of every possible object pointer position (signed frame
+          distance, shifted by "obj_ptr_pos_offset")
+        """
+        pos_enc = maskmem_pos_enc[-1][0:1]
+        device = pos_enc.device
+        constants = {}
+        # computed once in fp32, whatever autocast the first frame runs under
+        with torch.autocast(device.type, enabled=False):
+            pos_enc = pos_enc.float().flatten(2).permute(2, 0, 1)
+            constants["maskmem_pos_by_tpos"] = pos_enc[None] + self.maskmem_tpos_enc.float()
+            if self.use_obj_ptrs_in_encoder and self.add_tpos_enc_to_obj_ptrs:
+                t_diff_max = min(num_frames, self.max_obj_ptrs_in_encoder) - 1
+                tpos_dim = self.hidden_dim if self.proj_tpos_enc_in_obj_ptrs else self.mem_dim
+                positions = torch.arange(-(num_frames - 1), num_frames, device=device)
+                obj_pos = get_1d_sine_pe(positions / t_diff_max, dim=tpos_dim)
+                constants["obj_ptr_pos"] = self.obj_ptr_tpos_proj(obj_pos)
+                constants["obj_ptr_pos_offset"] = num_frames - 1
+        return constants
+
+    def _static_memory_slots(self, num_frames, num_cond_frames):
+        """
+        (memory frames, object pointers) the memories are padded to with
+        `static_memory_shapes`. Without a limit on the conditioning frames in
+        attention (`max_cond_frames_in_attn=-1`), the slots follow the number of
+        conditioning frames, so the modules are recompiled when one is added.
+        """
+        if self.max_cond_frames_in_attn > 0:
+            num_cond_slots = self.max_cond_frames_in_attn
+        else:
+            num_cond_slots = max(num_cond_frames, 1)
+        max_obj_ptrs_in_encoder = min(
+            num_frames or self.max_obj_ptrs_in_encoder, self.max_obj_ptrs_in_encoder
+        )
+        return (
+            num_cond_slots + self.num_maskmem - 1,
+            num_cond_slots + max_obj_ptrs_in_encoder - 1,
+        )
+
+    @staticmethod
+    def init_samurai_state():
+        """
+        Per-video SAMURAI tracking state: one Kalman filter row per object
+        (kf_mean [B, 8], kf_covariance [B, 8, 8], stable_frames [B]), created on
+        the first tracked frame. The video predictor keeps it in the inference state.
+        """
+        return {"kf_mean": None, "kf_covariance": None, "stable_frames": None}
+
+    def reset_samurai_state(self, samurai_state=None):
+        """
+        Reset SAMURAI tracking state (Kalman filters and stable-frame counters),
+        e.g. before tracking the same video again in the other direction.
+        Without an argument this resets the model-level state used by callers
+        that don't pass their own `samurai_state` to `track_step`.
+        """
+        if samurai_state is None:
+            self.samurai_state = self.init_samurai_state()
+        else:
+            samurai_state.update(self.init_samurai_state())
 
     @property
     def device(self):
@@ -299,6 +455,7 @@ class SAM2Base(torch.nn.Module):
         mask_inputs=None,
         high_res_features=None,
         multimask_output=False,
+        samurai_state=None,
     ):
         """
         Forward SAM prompt encoders and mask heads.
@@ -318,6 +475,8 @@ class SAM2Base(torch.nn.Module):
         - multimask_output: if it's True, we output 3 candidate masks and their 3
           corresponding IoU estimates, and if it's False, we output only 1 mask and
           its corresponding IoU estimate.
+        - samurai_state: per-video SAMURAI tracking state (see `init_samurai_state`),
+          the model-level state is used if it's None.
 
         Outputs:
         - low_res_multimasks: [B, M, H*4, W*4] shape (where M = 3 if
@@ -327,7 +486,8 @@ class SAM2Base(torch.nn.Module):
         - high_res_multimasks: [B, M, H*16, W*16] shape (where M = 3
           if `multimask_output=True` and M = 1 if `multimask_output=False`),
           upsampled from the low-resolution masks, with shape size as the image
-          (stride is 1 pixel).
+          (stride is 1 pixel). None if `upsample_candidate_masks` is False and
+          the candidates aren't needed at full resolution for mask selection.
         - ious, [B, M] shape, where (where M = 3 if `multimask_output=True` and M = 1
           if `multimask_output=False`), the estimated IoU of each output mask.
         - low_res_masks: [B, 1, H*4, W*4] shape, the best mask in `low_res_multimasks`.
@@ -408,105 +568,44 @@ class SAM2Base(torch.nn.Module):
         # convert masks from possibly bfloat16 (or float16) to float32
         # (older PyTorch versions before 2.1 don't support `interpolate` on bf16)
         low_res_multimasks = low_res_multimasks.float()
-        high_res_multimasks = F.interpolate(
-            low_res_multimasks,
-            size=(self.image_size, self.image_size),
-            mode="bilinear",
-            align_corners=False,
-        )
+        high_res_multimasks = None
+        if self.upsample_candidate_masks or (
+            multimask_output and self.samurai_mode and not self.samurai_bbox_from_low_res
+        ):
+            high_res_multimasks = self._upsample_mask_logits(low_res_multimasks)
 
         sam_output_token = sam_output_tokens[:, 0]
         kf_ious = None
         if multimask_output and self.samurai_mode:
-            if self.kf_mean is None and self.kf_covariance is None or self.stable_frames == 0:
-                best_iou_inds = torch.argmax(ious, dim=-1)
-                batch_inds = torch.arange(B, device=device)
-                low_res_masks = low_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
-                high_res_masks = high_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
-                non_zero_indices = torch.argwhere(high_res_masks[0][0] > 0.0)
-                if len(non_zero_indices) == 0:
-                    high_res_bbox = [0, 0, 0, 0]
-                else:
-                    y_min, x_min = non_zero_indices.min(dim=0).values
-                    y_max, x_max = non_zero_indices.max(dim=0).values
-                    high_res_bbox = [x_min.item(), y_min.item(), x_max.item(), y_max.item()]
-                self.kf_mean, self.kf_covariance = self.kf.initiate(self.kf.xyxy_to_xyah(high_res_bbox))
-                if sam_output_tokens.size(1) > 1:
-                    sam_output_token = sam_output_tokens[batch_inds, best_iou_inds]
-                self.frame_cnt += 1
-                self.stable_frames += 1
-            elif self.stable_frames < self.stable_frames_threshold:
-                self.kf_mean, self.kf_covariance = self.kf.predict(self.kf_mean, self.kf_covariance)
-                best_iou_inds = torch.argmax(ious, dim=-1)
-                batch_inds = torch.arange(B, device=device)
-                low_res_masks = low_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
-                high_res_masks = high_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
-                non_zero_indices = torch.argwhere(high_res_masks[0][0] > 0.0)
-                if len(non_zero_indices) == 0:
-                    high_res_bbox = [0, 0, 0, 0]
-                else:
-                    y_min, x_min = non_zero_indices.min(dim=0).values
-                    y_max, x_max = non_zero_indices.max(dim=0).values
-                    high_res_bbox = [x_min.item(), y_min.item(), x_max.item(), y_max.item()]
-                if ious[0][best_iou_inds] > self.stable_ious_threshold:
-                    self.kf_mean, self.kf_covariance = self.kf.update(self.kf_mean, self.kf_covariance, self.kf.xyxy_to_xyah(high_res_bbox))
-                    self.stable_frames += 1
-                else:
-                    self.stable_frames = 0
-                if sam_output_tokens.size(1) > 1:
-                    sam_output_token = sam_output_tokens[batch_inds, best_iou_inds]
-                self.frame_cnt += 1
-            else:
-                self.kf_mean, self.kf_covariance = self.kf.predict(self.kf_mean, self.kf_covariance)
-                high_res_multibboxes = []
-                batch_inds = torch.arange(B, device=device)
-                for i in range(ious.shape[1]):
-                    non_zero_indices = torch.argwhere(high_res_multimasks[batch_inds, i].unsqueeze(1)[0][0] > 0.0)
-                    if len(non_zero_indices) == 0:
-                        high_res_multibboxes.append([0, 0, 0, 0])
-                    else:
-                        y_min, x_min = non_zero_indices.min(dim=0).values
-                        y_max, x_max = non_zero_indices.max(dim=0).values
-                        high_res_multibboxes.append([x_min.item(), y_min.item(), x_max.item(), y_max.item()])
-                # compute the IoU between the predicted bbox and the high_res_multibboxes
-                kf_ious = torch.tensor(self.kf.compute_iou(self.kf_mean[:4], high_res_multibboxes), device=device)
-                # weighted iou
-                weighted_ious = self.kf_score_weight * kf_ious + (1 - self.kf_score_weight) * ious
-                best_iou_inds = torch.argmax(weighted_ious, dim=-1)
-                batch_inds = torch.arange(B, device=device)
-                low_res_masks = low_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
-                high_res_masks = high_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
-                if sam_output_tokens.size(1) > 1:
-                    sam_output_token = sam_output_tokens[batch_inds, best_iou_inds]
-
-                if False:
-                    # make all these on cpu                        
-                    self.history[self.frame_cnt] = {
-                        "kf_predicted_bbox": self.kf.xyah_to_xyxy(self.kf_mean[:4]),
-                        # "multi_masks": high_res_multimasks.cpu(),
-                        "ious": ious.cpu(),
-                        "multi_bboxes": high_res_multibboxes,
-                        "kf_ious": kf_ious,
-                        "weighted_ious": weighted_ious.cpu(),
-                        "final_selection": best_iou_inds.cpu(),
-                    }
-                self.frame_cnt += 1
-
-                if ious[0][best_iou_inds] < self.stable_ious_threshold:
-                    self.stable_frames = 0
-                else:
-                    self.kf_mean, self.kf_covariance = self.kf.update(self.kf_mean, self.kf_covariance, self.kf.xyxy_to_xyah(high_res_multibboxes[best_iou_inds]))
+            # Motion-aware mask selection, one Kalman filter per object (batched)
+            best_iou_inds, kf_ious = self._samurai_select_masks(
+                ious,
+                low_res_multimasks,
+                high_res_multimasks,
+                self.samurai_state if samurai_state is None else samurai_state,
+            )
+            batch_inds = torch.arange(B, device=device)
+            low_res_masks = low_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
+            if sam_output_tokens.size(1) > 1:
+                sam_output_token = sam_output_tokens[batch_inds, best_iou_inds]
         elif multimask_output and not self.samurai_mode:
             # take the best mask prediction (with the highest IoU estimation)
             best_iou_inds = torch.argmax(ious, dim=-1)
             batch_inds = torch.arange(B, device=device)
             low_res_masks = low_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
-            high_res_masks = high_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
             if sam_output_tokens.size(1) > 1:
                 sam_output_token = sam_output_tokens[batch_inds, best_iou_inds]
         else:
             best_iou_inds = 0
-            low_res_masks, high_res_masks = low_res_multimasks, high_res_multimasks
+            low_res_masks = low_res_multimasks
+
+        if high_res_multimasks is None:
+            # only the selected mask is needed at the image size
+            high_res_masks = self._upsample_mask_logits(low_res_masks)
+        elif multimask_output:
+            high_res_masks = high_res_multimasks[batch_inds, best_iou_inds].unsqueeze(1)
+        else:
+            high_res_masks = high_res_multimasks
 
         # Extract object pointer from the SAM output token (with occlusion handling)
         obj_ptr = self.obj_ptr_proj(sam_output_token)
@@ -529,10 +628,103 @@ class SAM2Base(torch.nn.Module):
             high_res_masks,
             obj_ptr,
             object_score_logits,
-            ious[0][best_iou_inds],
-            kf_ious[best_iou_inds] if kf_ious is not None else None,
+            # IoU estimate of the selected mask of each object
+            ious[torch.arange(B, device=device), best_iou_inds] if torch.is_tensor(best_iou_inds) else ious[:, best_iou_inds],
+            kf_ious,
+        )
+
+    def _upsample_mask_logits(self, mask_logits):
+        """Resize mask logits to the image size (stride 1 pixel)"""
+        return F.interpolate(
+            mask_logits,
+            size=(self.image_size, self.image_size),
+            mode="bilinear",
+            align_corners=False,
+        )
+
+    def _samurai_select_masks(self, ious, low_res_multimasks, high_res_multimasks, samurai_state):
+        """
+        SAMURAI mask selection for all B objects at once.
+
+        Each object has its own Kalman filter row in `samurai_state` (see
+        `init_samurai_state`) and goes through the same phases as in the paper:
+        - not stable yet (stable_frames == 0): (re)initiate the filter from the box
+          of the mask with the highest IoU estimate
+        - stabilizing (< stable_frames_threshold): predict, pick the highest IoU
+          estimate, update the filter if that IoU is above stable_ious_threshold
+        - stable: predict, pick the mask with the best weighted sum of IoU estimate
+          and IoU with the predicted box, update unless the IoU is below the threshold
+
+        The phases are evaluated for every object with the same tensor ops
+        (selected per row with torch.where), so there are no host syncs.
+
+        Returns the selected mask index [B] and the motion score (IoU with the
+        predicted box) of the selected mask [B] (NaN for objects not stable yet).
+        """
+        B = ious.size(0)
+        device = ious.device
+        batch_inds = torch.arange(B, device=device)
+
+        # Start over when tracking begins or the set of objects changed
+        kf_mean = samurai_state["kf_mean"]
+        if kf_mean is None or kf_mean.size(0) != B or kf_mean.device != device:
+            samurai_state["kf_mean"] = torch.zeros(B, 8, dtype=torch.float64, device=device)
+            samurai_state["kf_covariance"] = torch.zeros(B, 8, 8, dtype=torch.float64, device=device)
+            samurai_state["stable_frames"] = torch.zeros(B, dtype=torch.long, device=device)
+        stable_frames = samurai_state["stable_frames"]
+        initiating = stable_frames == 0
+        stable = stable_frames >= self.stable_frames_threshold
+
+        # Boxes of all candidate masks (x_min, y_min, x_max, y_max) in image pixels,
+        # [0, 0, 0, 0] if empty - one fused pass over the logits, no host sync
+        if self.samurai_bbox_from_low_res:
+            scale = self.image_size // low_res_multimasks.size(-1)
+            bboxes = batched_mask_logits_to_box(low_res_multimasks, scale=scale)
+        else:
+            bboxes = batched_mask_logits_to_box(high_res_multimasks)
+        bboxes = bboxes.to(torch.float64)
+
+        pred_mean, pred_cov = self.kf.batch_predict(
+            samurai_state["kf_mean"], samurai_state["kf_covariance"]
+        )
+        kf_ious = self.kf.batch_compute_iou(pred_mean[:, :4], bboxes)
+        weighted_ious = self.kf_score_weight * kf_ious + (1 - self.kf_score_weight) * ious
+        best_iou_inds = torch.where(
+            stable, torch.argmax(weighted_ious, dim=-1), torch.argmax(ious, dim=-1)
+        )
+        best_ious = ious[batch_inds, best_iou_inds]
+
+        measurements = self.kf.batch_xyxy_to_xyah(bboxes[batch_inds, best_iou_inds])
+        init_mean, init_cov = self.kf.batch_initiate(measurements)
+        upd_mean, upd_cov = self.kf.batch_update(pred_mean, pred_cov, measurements)
+
+        is_good = torch.where(
+            stable,
+            best_ious >= self.stable_ious_threshold,
+            best_ious > self.stable_ious_threshold,
+        )
+        do_update = ~initiating & is_good
+        new_mean = torch.where(do_update[:, None], upd_mean, pred_mean)
+        new_cov = torch.where(do_update[:, None, None], upd_cov, pred_cov)
+        samurai_state["kf_mean"] = torch.where(initiating[:, None], init_mean, new_mean)
+        samurai_state["kf_covariance"] = torch.where(initiating[:, None, None], init_cov, new_cov)
+        samurai_state["stable_frames"] = torch.where(
+            initiating,
+            torch.ones_like(stable_frames),
+            torch.where(
+                is_good,
+                torch.where(stable, stable_frames, stable_frames + 1),
+                torch.zeros_like(stable_frames),
+            ),
         )
 
+        kf_score = torch.where(
+            stable,
+            kf_ious[batch_inds, best_iou_inds],
+            torch.full_like(best_ious, float("nan"), dtype=kf_ious.dtype),
+        )
+        return best_iou_inds, kf_score
+
     def _use_mask_as_output(self, backbone_features, high_res_features, mask_inputs):
         """
         Directly turn binary `mask_inputs` into a output mask logits without using SAM.
@@ -615,6 +807,80 @@ class SAM2Base(torch.nn.Module):
 
         return backbone_out, vision_feats, vision_pos_embeds, feat_sizes
 
+    def _memory_bank_qualifies(self, out):
+        """
+        Whether a frame output meets the SAMURAI memory bank thresholds
+        (mask affinity, object score and, if present, motion score).
+
+        The memory index is shared by all objects, so a frame qualifies only if
+        every object meets the thresholds. Objects whose Kalman filter is not
+        stable yet have no motion score (NaN) and are judged on the others.
+        """
+        if "best_iou_score" not in out or "object_score_logits" not in out:
+            return False  # e.g. consolidated outputs of clicked frames
+        # one value per object
+        ious = out["best_iou_score"].detach().float().reshape(-1)
+        obj_scores = out["object_score_logits"].detach().float().reshape(-1)
+        qualifies = (ious > self.memory_bank_iou_threshold) & (
+            obj_scores > self.memory_bank_obj_score_threshold
+        )
+        kf_ious = out.get("kf_ious")
+        if kf_ious is not None:
+            kf_ious = kf_ious.detach().float().reshape(-1)
+            qualifies &= torch.isnan(kf_ious) | (
+                kf_ious > self.memory_bank_kf_score_threshold
+            )
+        # a single device-to-host copy for all objects
+        return bool(qualifies.all())
+
+    def index_memory_frame(self, output_dict, frame_idx, out):
+        """
+        Update the SAMURAI memory bank index when `out` is stored as the
+        non-conditioning output of `frame_idx` in `output_dict`.
+
+        The index (`output_dict["samurai_memory_index"]`) is a sorted list of frame
+        indices whose output qualified when it was stored, so frame selection in
+        `_prepare_memory_conditioned_features` doesn't have to read the scores of
+        every previous frame back from the device on each new frame.
+        """
+        if not self.samurai_mode:
+            return
+        qualifies = self._memory_bank_qualifies(out)
+        out["samurai_memory_ok"] = qualifies
+        if qualifies:
+            index = output_dict.setdefault("samurai_memory_index", [])
+            pos = bisect.bisect_left(index, frame_idx)
+            if pos == len(index) or index[pos] != frame_idx:
+                index.insert(pos, frame_idx)
+
+    def _select_memory_bank_frames(self, output_dict, frame_idx, track_in_reverse):
+        """
+        Up to (num_maskmem - 1) qualifying memory frames closest to `frame_idx` in
+        tracking order, ordered from the oldest to the newest. Only the last
+        (num_maskmem - 1) entries are ever attended to, so collecting more (the
+        original limit was max_obj_ptrs_in_encoder - 1) doesn't change the result.
+        Entries whose output was removed or replaced since indexing are skipped.
+        """
+        index = output_dict.get("samurai_memory_index", [])
+        non_cond_outputs = output_dict["non_cond_frame_outputs"]
+        max_frames = min(self.num_maskmem, self.max_obj_ptrs_in_encoder) - 1
+        valid_indices = []
+
+        if track_in_reverse:
+            positions = range(bisect.bisect_right(index, frame_idx), len(index))
+        else:
+            positions = range(bisect.bisect_left(index, frame_idx) - 1, -1, -1)
+        for pos in positions:
+            i = index[pos]
+            if not track_in_reverse and i <= 1:
+                break  # frames 0 and 1 are never memory bank candidates
+            prev_out = non_cond_outputs.get(i, None)
+            if prev_out is not None and prev_out.get("samurai_memory_ok", False):
+                valid_indices.insert(0, i)
+            if len(valid_indices) >= max_frames:
+                break
+        return valid_indices
+
     def _prepare_memory_conditioned_features(
         self,
         frame_idx,
@@ -625,6 +891,7 @@ class SAM2Base(torch.nn.Module):
         output_dict,
         num_frames,
         track_in_reverse=False,  # tracking in reverse time order (for demo usage)
+        memory_constants=None,  # see `build_memory_constants`
     ):
         """Fuse the current frame's visual feature map with previous memory."""
         B = current_vision_feats[-1].size(1)  # batch size on this frame
@@ -638,6 +905,9 @@ class SAM2Base(torch.nn.Module):
             return pix_feat
 
         num_obj_ptr_tokens = 0
+        # padded memory spans [start, end) that are masked out in attention
+        # (only with `static_memory_shapes`)
+        padded_spans = []
         tpos_sign_mul = -1 if track_in_reverse else 1
         # Step 1: condition the visual features of the current frame on previous memories
         if not is_init_cond_frame:
@@ -659,22 +929,14 @@ class SAM2Base(torch.nn.Module):
             stride = 1 if self.training else self.memory_temporal_stride_for_eval
 
             if self.samurai_mode:
-                valid_indices = [] 
-                if frame_idx > 1:  # Ensure we have previous frames to evaluate
-                    for i in range(frame_idx - 1, 1, -1):  # Iterate backwards through previous frames
-                        iou_score = output_dict["non_cond_frame_outputs"][i]["best_iou_score"]  # Get mask affinity score
-                        obj_score = output_dict["non_cond_frame_outputs"][i]["object_score_logits"]  # Get object score
-                        kf_score = output_dict["non_cond_frame_outputs"][i]["kf_score"] if "kf_score" in output_dict["non_cond_frame_outputs"][i] else None  # Get motion score if available
-                        # Check if the scores meet the criteria for being a valid index
-                        if iou_score.item() > self.memory_bank_iou_threshold and \
-                           obj_score.item() > self.memory_bank_obj_score_threshold and \
-                           (kf_score is None or kf_score.item() > self.memory_bank_kf_score_threshold):
-                            valid_indices.insert(0, i)  
-                        # Check the number of valid indices
-                        if len(valid_indices) >= self.max_obj_ptrs_in_encoder - 1:  
-                            break
-                if frame_idx - 1 not in valid_indices: 
-                    valid_indices.append(frame_idx - 1)
+                # Frames tracked before this one: frame_idx - 1, frame_idx - 2, ... or
+                # frame_idx + 1, frame_idx + 2, ... when tracking in reverse
+                prev_frame_idx = frame_idx + 1 if track_in_reverse else frame_idx - 1
+                valid_indices = self._select_memory_bank_frames(
+                    output_dict, frame_idx, track_in_reverse
+                )
+                if prev_frame_idx not in valid_indices: 
+                    valid_indices.append(prev_frame_idx)
                 for t_pos in range(1, self.num_maskmem):  # Iterate over the number of mask memories
                     idx = t_pos - self.num_maskmem  # Calculate the index for valid indices
                     if idx < -len(valid_indices):  # Skip if index is out of bounds
@@ -722,15 +984,37 @@ class SAM2Base(torch.nn.Module):
                 # so we load it back to GPU (it's a no-op if it's already on GPU).
                 feats = prev["maskmem_features"].to(device, non_blocking=True)
                 to_cat_memory.append(feats.flatten(2).permute(2, 0, 1))
-                # Spatial positional encoding (it might have been offloaded to CPU in eval)
-                maskmem_enc = prev["maskmem_pos_enc"][-1].to(device)
-                maskmem_enc = maskmem_enc.flatten(2).permute(2, 0, 1)
-                # Temporal positional encoding
-                maskmem_enc = (
-                    maskmem_enc + self.maskmem_tpos_enc[self.num_maskmem - t_pos - 1]
-                )
+                if memory_constants is not None:
+                    # spatial + temporal positional encoding, precomputed per slot
+                    maskmem_enc = memory_constants["maskmem_pos_by_tpos"][
+                        self.num_maskmem - t_pos - 1
+                    ].expand(-1, B, -1)
+                else:
+                    # Spatial positional encoding (it might have been offloaded to CPU in eval)
+                    maskmem_enc = prev["maskmem_pos_enc"][-1].to(device)
+                    maskmem_enc = maskmem_enc.flatten(2).permute(2, 0, 1)
+                    # Temporal positional encoding
+                    maskmem_enc = (
+                        maskmem_enc + self.maskmem_tpos_enc[self.num_maskmem - t_pos - 1]
+                    )
                 to_cat_memory_pos_embed.append(maskmem_enc)
 
+            if self.static_memory_shapes:
+                # pad the memory with empty frames up to a fixed number of frames
+                num_mem_slots, num_ptr_slots = self._static_memory_slots(
+                    num_frames, len(cond_outputs)
+                )
+                num_mem_pad = num_mem_slots - len(to_cat_memory)
+                assert num_mem_pad >= 0, "more memory frames than static slots"
+                if num_mem_pad > 0:
+                    num_mem_tokens = sum(x.shape[0] for x in to_cat_memory)
+                    pad = current_vision_feats[-1].new_zeros(
+                        num_mem_pad * H * W, B, self.mem_dim
+                    )
+                    to_cat_memory.append(pad)
+                    to_cat_memory_pos_embed.append(pad)
+                    padded_spans.append((num_mem_tokens, num_mem_tokens + pad.shape[0]))
+
             # Construct the list of past object pointers
             if self.use_obj_ptrs_in_encoder:
                 max_obj_ptrs_in_encoder = min(num_frames, self.max_obj_ptrs_in_encoder)
@@ -767,13 +1051,34 @@ class SAM2Base(torch.nn.Module):
                     if out is not None:
                         pos_and_ptrs.append((t_diff, out["obj_ptr"]))
                 # If we have at least one object pointer, add them to the across attention
-                if len(pos_and_ptrs) > 0:
-                    pos_list, ptrs_list = zip(*pos_and_ptrs)
-                    # stack object pointers along dim=0 into [ptr_seq_len, B, C] shape
-                    obj_ptrs = torch.stack(ptrs_list, dim=0)
+                # (with static shapes, always add the padded pointer slots)
+                if len(pos_and_ptrs) > 0 or self.static_memory_shapes:
+                    if len(pos_and_ptrs) > 0:
+                        pos_list, ptrs_list = zip(*pos_and_ptrs)
+                        # stack object pointers along dim=0 into [ptr_seq_len, B, C] shape
+                        obj_ptrs = torch.stack(ptrs_list, dim=0)
+                    else:
+                        pos_list = ()
+                        obj_ptrs = current_vision_feats[-1].new_zeros(0, B, C)
+                    num_ptrs = len(pos_list)
+                    if self.static_memory_shapes:
+                        assert num_ptrs <= num_ptr_slots, "more pointers than static slots"
+                    if self.static_memory_shapes and num_ptrs < num_ptr_slots:
+                        # pad with empty pointers up to a fixed number of pointers
+                        num_ptr_pad = num_ptr_slots - num_ptrs
+                        pos_list = pos_list + (0,) * num_ptr_pad
+                        obj_ptrs = torch.cat(
+                            [obj_ptrs, obj_ptrs.new_zeros(num_ptr_pad, B, C)], dim=0
+                        )
                     # a temporal positional embedding based on how far each object pointer is from
                     # the current frame (sine embedding normalized by the max pointer num).
-                    if self.add_tpos_enc_to_obj_ptrs:
+                    if self.add_tpos_enc_to_obj_ptrs and memory_constants is not None:
+                        # gather the precomputed encodings of these pointer positions
+                        offset = memory_constants["obj_ptr_pos_offset"]
+                        obj_pos = torch.tensor([p + offset for p in pos_list], device=device)
+                        obj_pos = memory_constants["obj_ptr_pos"][obj_pos]
+                        obj_pos = obj_pos.unsqueeze(1).expand(-1, B, self.mem_dim)
+                    elif self.add_tpos_enc_to_obj_ptrs:
                         t_diff_max = max_obj_ptrs_in_encoder - 1
                         tpos_dim = C if self.proj_tpos_enc_in_obj_ptrs else self.mem_dim
                         obj_pos = torch.tensor(pos_list, device=device)
@@ -789,6 +1094,13 @@ class SAM2Base(torch.nn.Module):
                         )
                         obj_ptrs = obj_ptrs.permute(0, 2, 1, 3).flatten(0, 1)
                         obj_pos = obj_pos.repeat_interleave(C // self.mem_dim, dim=0)
+                    if len(pos_list) > num_ptrs:
+                        # pointer tokens are grouped per pointer, padding comes last
+                        num_mem_tokens = sum(x.shape[0] for x in to_cat_memory)
+                        num_ptr_tokens = num_ptrs * obj_ptrs.shape[0] // len(pos_list)
+                        padded_spans.append(
+                            (num_mem_tokens + num_ptr_tokens, num_mem_tokens + obj_ptrs.shape[0])
+                        )
                     to_cat_memory.append(obj_ptrs)
                     to_cat_memory_pos_embed.append(obj_pos)
                     num_obj_ptr_tokens = obj_ptrs.shape[0]
@@ -809,6 +1121,12 @@ class SAM2Base(torch.nn.Module):
         # Step 2: Concatenate the memories and forward through the transformer encoder
         memory = torch.cat(to_cat_memory, dim=0)
         memory_pos_embed = torch.cat(to_cat_memory_pos_embed, dim=0)
+        memory_mask = None
+        if self.static_memory_shapes and not is_init_cond_frame:
+            # always pass a mask, so frames that need no padding use the same graph
+            memory_mask = torch.ones(memory.shape[0], dtype=torch.bool, device=device)
+            for start, end in padded_spans:
+                memory_mask[start:end] = False
 
         pix_feat_with_mem = self.memory_attention(
             curr=current_vision_feats,
@@ -816,6 +1134,7 @@ class SAM2Base(torch.nn.Module):
             memory=memory,
             memory_pos=memory_pos_embed,
             num_obj_ptr_tokens=num_obj_ptr_tokens,
+            memory_mask=memory_mask,
         )
         # reshape the output (HW)BC => BCHW
         pix_feat_with_mem = pix_feat_with_mem.permute(1, 2, 0).view(B, C, H, W)
@@ -884,6 +1203,8 @@ class SAM2Base(torch.nn.Module):
         num_frames,
         track_in_reverse,
         prev_sam_mask_logits,
+        samurai_state=None,
+        memory_constants=None,
     ):
         current_out = {"point_inputs": point_inputs, "mask_inputs": mask_inputs}
         # High-resolution feature maps for the SAM head, reshape (HW)BC => BCHW
@@ -913,6 +1234,7 @@ class SAM2Base(torch.nn.Module):
                 output_dict=output_dict,
                 num_frames=num_frames,
                 track_in_reverse=track_in_reverse,
+                memory_constants=memory_constants,
             )
             # apply SAM-style segmentation head
             # here we might feed previously predicted low-res SAM mask logits into the SAM mask decoder,
@@ -928,6 +1250,7 @@ class SAM2Base(torch.nn.Module):
                 mask_inputs=mask_inputs,
                 high_res_features=high_res_features,
                 multimask_output=multimask_output,
+                samurai_state=samurai_state,
             )
 
         return current_out, sam_outputs, high_res_features, pix_feat
@@ -977,6 +1300,10 @@ class SAM2Base(torch.nn.Module):
         run_mem_encoder=True,
         # The previously predicted SAM mask logits (which can be fed together with new clicks in demo).
         prev_sam_mask_logits=None,
+        # Per-video SAMURAI tracking state (Kalman filter per object), see `init_samurai_state`.
+        samurai_state=None,
+        # Precomputed memory positional encodings of the video, see `build_memory_constants`.
+        memory_constants=None,
     ):
         current_out, sam_outputs, _, _ = self._track_step(
             frame_idx,
@@ -990,6 +1317,8 @@ class SAM2Base(torch.nn.Module):
             num_frames,
             track_in_reverse,
             prev_sam_mask_logits,
+            samurai_state,
+            memory_constants,
         )
 
         (
@@ -12,6 +12,8 @@ import torch
 from tqdm import tqdm
 
 from sam2.modeling.sam2_base import NO_OBJ_SCORE, SAM2Base
+from sam2.utils.feature_cache import FeatureCache
+from sam2.utils.memory_store import RollingMemoryStore
 from sam2.utils.misc import concat_points, fill_holes_in_mask_scores, ImgSequences
 
 
@@ -39,6 +41,8 @@ class SAM2VideoPredictor(SAM2Base):
         self.clear_non_cond_mem_around_input = clear_non_cond_mem_around_input
         self.clear_non_cond_mem_for_multi_obj = clear_non_cond_mem_for_multi_obj
         self.add_all_frames_to_correct_as_cond = add_all_frames_to_correct_as_cond
+        # inference only needs the selected mask at the image size
+        self.upsample_candidate_masks = False
 
     @torch.inference_mode()
     def init_state(
@@ -51,10 +55,36 @@ class SAM2VideoPredictor(SAM2Base):
         frame_range_max = None,
         original_fps = None,
         target_fps = None,
-        bits = None
+        bits = None,
+        num_decode_workers = 4,
+        frame_numbers = None,
+        reference_index = 0,
+        memory_policy = "keep_all",
+        spill_dir = None,
+        feature_cache_gpu_bytes = 256 << 20,
+        feature_cache_cpu_bytes = 0,
+        encoder_batch_size = 1,
     ):
         
-        """Initialize an inference state."""
+        """
+        Initialize an inference state.
+
+        `frame_numbers` optionally gives the frame number to read for each index
+        (read straight from the path pattern); `reference_index` is the index the
+        fps stride is counted from.
+
+        `memory_policy` bounds the non-conditioning frame outputs kept during
+        propagation (see `RollingMemoryStore`): "keep_all" (default), "evict" or
+        "spill" (to `spill_dir`, a temp dir by default).
+
+        Image encoder outputs are cached per frame (see `FeatureCache`) up to
+        `feature_cache_gpu_bytes` on the device, plus `feature_cache_cpu_bytes`
+        in pinned host memory (0 disables the host tier; see
+        `FeatureCache.fit_to_video` to size it for the whole video).
+
+        With `encoder_batch_size` > 1, propagation runs the image encoder ahead of
+        the tracked frame in batches of that many frames (on a side stream on CUDA).
+        """
         compute_device = self.device
          # device of the model
 
@@ -66,7 +96,12 @@ class SAM2VideoPredictor(SAM2Base):
             original_fps = original_fps, 
             target_fps = target_fps, 
             bits= bits, 
-            image_size = self.image_size
+            image_size = self.image_size,
+            offload_video_to_cpu = offload_video_to_cpu,
+            num_decode_workers = num_decode_workers,
+            frame_numbers = frame_numbers,
+            reference_index = reference_index,
+            compute_device = compute_device,
             
             ).ReadSequence()
         
@@ -93,8 +128,17 @@ class SAM2VideoPredictor(SAM2Base):
         # inputs on each frame
         inference_state["point_inputs_per_obj"] = {}
         inference_state["mask_inputs_per_obj"] = {}
-        # visual features on a small number of recently visited frames for quick interactions
-        inference_state["cached_features"] = {}
+        # visual features on recently visited frames for quick interactions and re-propagation
+        inference_state["cached_features"] = FeatureCache(
+            gpu_bytes=feature_cache_gpu_bytes, cpu_bytes=feature_cache_cpu_bytes
+        )
+        # image features encoded ahead of the tracked frame, see `_encode_ahead`
+        inference_state["encoder_batch_size"] = encoder_batch_size
+        inference_state["encoded_ahead"] = {}
+        if compute_device.type == "cuda" and encoder_batch_size > 1:
+            inference_state["encoder_stream"] = torch.cuda.Stream(device=compute_device)
+        else:
+            inference_state["encoder_stream"] = None
         # values that don't change across frames (so we only need to hold one copy of them)
         inference_state["constants"] = {}
         # mapping between client-side object id and model-side object index
@@ -104,7 +148,9 @@ class SAM2VideoPredictor(SAM2Base):
         # A storage to hold the model's tracking results and states on each frame
         inference_state["output_dict"] = {
             "cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
-            "non_cond_frame_outputs": {},  # dict containing {frame_idx: <out>}
+            # dict-like {frame_idx: <out>}, bounded according to `memory_policy`
+            "non_cond_frame_outputs": RollingMemoryStore(memory_policy, spill_dir),
+            "samurai_memory_index": [],  # sorted frame indices usable as SAMURAI memory
         }
         # Slice (view) of each object tracking results, sharing the same memory with "output_dict"
         inference_state["output_dict_per_obj"] = {}
@@ -120,6 +166,8 @@ class SAM2VideoPredictor(SAM2Base):
         # metadata for each tracking frame (e.g. which direction it's tracked)
         inference_state["tracking_has_started"] = False
         inference_state["frames_already_tracked"] = {}
+        # SAMURAI tracking state of this video (a Kalman filter per object)
+        inference_state["samurai_state"] = self.init_samurai_state()
         # Warm up the visual backbone and cache the image feature on frame 0
         self._get_image_feature(inference_state, frame_idx=0, batch_size=1)
         return inference_state, images, frame_start
@@ -635,6 +683,8 @@ class SAM2VideoPredictor(SAM2Base):
                 )
                 # merge them into "output_dict" and also create per-object slices
                 output_dict[storage_key][frame_idx] = consolidated_out
+                if not is_cond:
+                    self.index_memory_frame(output_dict, frame_idx, consolidated_out)
                 self._add_output_per_object(
                     inference_state, frame_idx, consolidated_out, storage_key
                 )
@@ -673,6 +723,19 @@ class SAM2VideoPredictor(SAM2Base):
             input_frames_inds.update(mask_inputs_per_frame.keys())
         assert all_consolidated_frame_inds == input_frames_inds
 
+    @torch.inference_mode()
+    def warm_up(self, inference_state):
+        """
+        Build the compiled tracking step (see `compile_tracking_step`) for the
+        objects and frame count of this video before propagation starts.
+        """
+        if not self.static_memory_shapes:
+            return
+        self.warm_up_tracking_step(
+            batch_size=self._get_obj_num(inference_state),
+            num_frames=inference_state["num_frames"],
+        )
+
     @torch.inference_mode()
     def propagate_in_video(
         self,
@@ -680,8 +743,16 @@ class SAM2VideoPredictor(SAM2Base):
         start_frame_idx=None,
         max_frame_num_to_track=None,
         reverse=False,
+        low_res_output=False,
     ):
-        """Propagate the input points across frames to track in the entire video."""
+        """
+        Propagate the input points across frames to track in the entire video.
+
+        With `low_res_output`, the yielded masks are the low-res mask logits
+        (B, 1, 256, 256 for a 1024 model) instead of logits resized to the video
+        resolution, so resizing can be left to whoever writes the masks (see
+        `resize_mask_logits`).
+        """
         self.propagate_in_video_preflight(inference_state)
 
         output_dict = inference_state["output_dict"]
@@ -714,50 +785,76 @@ class SAM2VideoPredictor(SAM2Base):
             )
             processing_order = range(start_frame_idx, end_frame_idx + 1)
 
-        for frame_idx in tqdm(processing_order, desc="Propagate"):
+        # Look-ahead image encoding: keep up to two batches of frames encoded ahead
+        encoder_batch_size = inference_state["encoder_batch_size"]
+        processing_order = list(processing_order)
+        next_to_encode = 0
+
+        try:
+            for pos, frame_idx in enumerate(tqdm(processing_order, desc="Propagate")):
+                if encoder_batch_size > 1 and next_to_encode - pos < encoder_batch_size:
+                    batch_end = next_to_encode + encoder_batch_size
+                    self._encode_ahead(
+                        inference_state, processing_order[next_to_encode:batch_end]
+                    )
+                    next_to_encode += encoder_batch_size
             
-            # We skip those frames already in consolidated outputs (these are frames
-            # that received input clicks or mask). Note that we cannot directly run
-            # batched forward on them via `_run_single_frame_inference` because the
-            # number of clicks on each object might be different.
-            if frame_idx in consolidated_frame_inds["cond_frame_outputs"]:
-                storage_key = "cond_frame_outputs"
-                current_out = output_dict[storage_key][frame_idx]
-                pred_masks = current_out["pred_masks"]
-                if clear_non_cond_mem:
-                    # clear non-conditioning memory of the surrounding frames
-                    self._clear_non_cond_mem_around_input(inference_state, frame_idx)
-            elif frame_idx in consolidated_frame_inds["non_cond_frame_outputs"]:
-                storage_key = "non_cond_frame_outputs"
-                current_out = output_dict[storage_key][frame_idx]
-                pred_masks = current_out["pred_masks"]
-            else:
-                storage_key = "non_cond_frame_outputs"
-                current_out, pred_masks = self._run_single_frame_inference(
-                    inference_state=inference_state,
-                    output_dict=output_dict,
-                    frame_idx=frame_idx,
-                    batch_size=batch_size,
-                    is_init_cond_frame=False,
-                    point_inputs=None,
-                    mask_inputs=None,
-                    reverse=reverse,
-                    run_mem_encoder=True,
+                # We skip those frames already in consolidated outputs (these are frames
+                # that received input clicks or mask). Note that we cannot directly run
+                # batched forward on them via `_run_single_frame_inference` because the
+                # number of clicks on each object might be different.
+                if frame_idx in consolidated_frame_inds["cond_frame_outputs"]:
+                    storage_key = "cond_frame_outputs"
+                    current_out = output_dict[storage_key][frame_idx]
+                    pred_masks = current_out["pred_masks"]
+                    if clear_non_cond_mem:
+                        # clear non-conditioning memory of the surrounding frames
+                        self._clear_non_cond_mem_around_input(inference_state, frame_idx)
+                elif frame_idx in consolidated_frame_inds["non_cond_frame_outputs"]:
+                    storage_key = "non_cond_frame_outputs"
+                    current_out = output_dict[storage_key][frame_idx]
+                    pred_masks = current_out["pred_masks"]
+                else:
+                    storage_key = "non_cond_frame_outputs"
+                    current_out, pred_masks = self._run_single_frame_inference(
+                        inference_state=inference_state,
+                        output_dict=output_dict,
+                        frame_idx=frame_idx,
+                        batch_size=batch_size,
+                        is_init_cond_frame=False,
+                        point_inputs=None,
+                        mask_inputs=None,
+                        reverse=reverse,
+                        run_mem_encoder=True,
+                    )
+                    output_dict[storage_key][frame_idx] = current_out
+                    self.index_memory_frame(output_dict, frame_idx, current_out)
+                # Create slices of per-object outputs for subsequent interaction with each
+                # individual object after tracking.
+                self._add_output_per_object(
+                    inference_state, frame_idx, current_out, storage_key
                 )
-                output_dict[storage_key][frame_idx] = current_out
-            # Create slices of per-object outputs for subsequent interaction with each
-            # individual object after tracking.
-            self._add_output_per_object(
-                inference_state, frame_idx, current_out, storage_key
-            )
-            inference_state["frames_already_tracked"][frame_idx] = {"reverse": reverse}
-
-            # Resize the output mask to the original video resolution (we directly use
-            # the mask scores on GPU for output to avoid any CPU conversion in between)
-            _, video_res_masks = self._get_orig_video_res_output(
-                inference_state, pred_masks
-            )
-            yield frame_idx, obj_ids, video_res_masks
+                inference_state["frames_already_tracked"][frame_idx] = {"reverse": reverse}
+                # Drop (or spill) outputs that memory attention can no longer reach
+                self._trim_memory(inference_state, frame_idx, reverse)
+
+                if low_res_output:
+                    out_masks = pred_masks.to(inference_state["device"], non_blocking=True)
+                    if self.non_overlap_masks:
+                        out_masks = self._apply_non_overlapping_constraints(out_masks)
+                    yield frame_idx, obj_ids, out_masks
+                    continue
+
+                # Resize the output mask to the original video resolution (we directly use
+                # the mask scores on GPU for output to avoid any CPU conversion in between)
+                _, video_res_masks = self._get_orig_video_res_output(
+                    inference_state, pred_masks
+                )
+                yield frame_idx, obj_ids, video_res_masks
+        finally:
+            # features encoded ahead of a propagation that stopped early (cancelled,
+            # `max_frame_num_to_track`, a closed generator) would stay on the device
+            inference_state["encoded_ahead"].clear()
 
     def _add_output_per_object(
         self, inference_state, frame_idx, current_out, storage_key
@@ -827,6 +924,7 @@ class SAM2VideoPredictor(SAM2Base):
                 # The frame is not a conditioning frame anymore since it's not receiving inputs,
                 # so we "downgrade" its output (if exists) to a non-conditioning frame output.
                 output_dict["non_cond_frame_outputs"][frame_idx] = out
+                self.index_memory_frame(output_dict, frame_idx, out)
                 inference_state["frames_already_tracked"].pop(frame_idx, None)
             # Similarly, do it for the sliced output on each object.
             for obj_idx2 in range(batch_size):
@@ -872,6 +970,60 @@ class SAM2VideoPredictor(SAM2Base):
         inference_state["output_dict_per_obj"].clear()
         inference_state["temp_output_dict_per_obj"].clear()
 
+    def _trim_memory(self, inference_state, frame_idx, reverse):
+        """
+        Keep only the non-conditioning outputs that memory attention can still read
+        (what happens to the others depends on the store's memory policy):
+        - the last `num_maskmem` memory frames (with stride) and the object pointer
+          window before the next frame of this pass,
+        - the same windows on both sides of each conditioning frame, where a pass
+          in the other direction starts (e.g. backward from the reference frame),
+        - the SAMURAI memory bank frames each of those would select.
+        """
+        output_dict = inference_state["output_dict"]
+        store = output_dict["non_cond_frame_outputs"]
+        if not isinstance(store, RollingMemoryStore) or store.policy == "keep_all":
+            return
+
+        window = max(
+            self.num_maskmem * self.memory_temporal_stride_for_eval,
+            self.max_obj_ptrs_in_encoder,
+        )
+        next_frame_idx = frame_idx - 1 if reverse else frame_idx + 1
+        anchors = [(next_frame_idx, reverse)]
+        for cond_frame_idx in output_dict["cond_frame_outputs"]:
+            anchors.append((cond_frame_idx, False))
+            anchors.append((cond_frame_idx, True))
+
+        keep = set()
+        for anchor_idx, anchor_reverse in anchors:
+            if anchor_reverse:
+                keep.update(range(anchor_idx + 1, anchor_idx + window + 1))
+            else:
+                keep.update(range(anchor_idx - window, anchor_idx))
+            if self.samurai_mode:
+                keep.update(
+                    self._select_memory_bank_frames(
+                        output_dict, anchor_idx, anchor_reverse
+                    )
+                )
+
+        for t in store.trim(keep):
+            # the per-object slices share storage with the evicted output
+            for obj_output_dict in inference_state["output_dict_per_obj"].values():
+                obj_output_dict["non_cond_frame_outputs"].pop(t, None)
+
+    def get_feature_cache_stats(self, inference_state):
+        """Hit/miss counters and size of the image feature cache (see `FeatureCache.stats`)"""
+        return inference_state["cached_features"].stats()
+
+    def get_memory_stats(self, inference_state):
+        """Size of the stored non-conditioning outputs (see `RollingMemoryStore.stats`)"""
+        store = inference_state["output_dict"]["non_cond_frame_outputs"]
+        if isinstance(store, RollingMemoryStore):
+            return store.stats()
+        return {"policy": "keep_all", "resident_frames": len(store)}
+
     def _reset_tracking_results(self, inference_state):
         """Reset all tracking inputs and results across the videos."""
         for v in inference_state["point_inputs_per_obj"].values():
@@ -886,28 +1038,88 @@ class SAM2VideoPredictor(SAM2Base):
             v["non_cond_frame_outputs"].clear()
         inference_state["output_dict"]["cond_frame_outputs"].clear()
         inference_state["output_dict"]["non_cond_frame_outputs"].clear()
+        inference_state["output_dict"]["samurai_memory_index"].clear()
         inference_state["consolidated_frame_inds"]["cond_frame_outputs"].clear()
         inference_state["consolidated_frame_inds"]["non_cond_frame_outputs"].clear()
         inference_state["tracking_has_started"] = False
         inference_state["frames_already_tracked"].clear()
+        self.reset_samurai_state(inference_state["samurai_state"])
+        inference_state["encoded_ahead"].clear()
+
+    def _encode_ahead(self, inference_state, frame_inds):
+        """
+        Run the image encoder on a batch of upcoming frames (it doesn't depend on
+        memory, unlike the rest of tracking). On CUDA the batch runs on a side
+        stream, so it overlaps with memory attention and mask decoding of the
+        frames being tracked; on CPU the batch just makes better use of the cores.
+        The features wait in inference_state["encoded_ahead"] until
+        `_get_image_feature` picks them up.
+        """
+        consolidated_frame_inds = inference_state["consolidated_frame_inds"]
+        frame_inds = [
+            t
+            for t in frame_inds
+            if t not in consolidated_frame_inds["cond_frame_outputs"]
+            and t not in consolidated_frame_inds["non_cond_frame_outputs"]
+            and t not in inference_state["cached_features"]
+            and t not in inference_state["encoded_ahead"]
+        ]
+        if not frame_inds:
+            return
+
+        device = inference_state["device"]
+        images = torch.stack([inference_state["images"][t] for t in frame_inds])
+        stream = inference_state["encoder_stream"]
+        event = None
+        if stream is None:
+            backbone_out = self.forward_image(images.to(device).float())
+        else:
+            # weights and earlier work must be ready before the side stream reads them
+            stream.wait_stream(torch.cuda.current_stream(device))
+            with torch.cuda.stream(stream):
+                batch = images.to(device, non_blocking=True).float()
+                backbone_out = self.forward_image(batch)
+                event = torch.cuda.Event()
+                event.record(stream)
+
+        for i, t in enumerate(frame_inds):
+            inference_state["encoded_ahead"][t] = {
+                "backbone_fpn": [x[i : i + 1] for x in backbone_out["backbone_fpn"]],
+                "vision_pos_enc": [x[i : i + 1] for x in backbone_out["vision_pos_enc"]],
+                "event": event,
+            }
 
     def _get_image_feature(self, inference_state, frame_idx, batch_size):
-        """Compute the image features on a given frame."""
-        # Look up in the cache first
-        image, backbone_out = inference_state["cached_features"].get(
-            frame_idx, (None, None)
-        )
+        """
+        Compute the image features on a given frame.
+        The returned image is None when the features come from the cache (the
+        input frames themselves aren't cached).
+        """
+        device = inference_state["device"]
+        expanded_image = None
+        # Features encoded ahead (see `_encode_ahead`), then the cache
+        backbone_out = inference_state["encoded_ahead"].pop(frame_idx, None)
+        if backbone_out is not None:
+            event = backbone_out.pop("event")
+            if event is not None:
+                # make the tracking stream wait for the side stream, and keep the
+                # allocator from reusing the features' memory while it uses them
+                current_stream = torch.cuda.current_stream(device)
+                current_stream.wait_event(event)
+                for x in backbone_out["backbone_fpn"] + backbone_out["vision_pos_enc"]:
+                    x.record_stream(current_stream)
+            inference_state["cached_features"].put(frame_idx, backbone_out)
+        else:
+            backbone_out = inference_state["cached_features"].get(frame_idx, device)
         if backbone_out is None:
             # Cache miss -- we will run inference on a single image
-            device = inference_state["device"]
             image = inference_state["images"][frame_idx].to(device).float().unsqueeze(0)
             backbone_out = self.forward_image(image)
-            # Cache the most recent frame's feature (for repeated interactions with
-            # a frame; we can use an LRU cache for more frames in the future).
-            inference_state["cached_features"] = {frame_idx: (image, backbone_out)}
+            inference_state["cached_features"].put(frame_idx, backbone_out)
+            # expand the image to have the same dimension as the number of objects
+            expanded_image = image.expand(batch_size, -1, -1, -1)
 
         # expand the features to have the same dimension as the number of objects
-        expanded_image = image.expand(batch_size, -1, -1, -1)
         expanded_backbone_out = {
             "backbone_fpn": backbone_out["backbone_fpn"].copy(),
             "vision_pos_enc": backbone_out["vision_pos_enc"].copy(),
@@ -949,6 +1161,11 @@ class SAM2VideoPredictor(SAM2Base):
 
         # point and mask should not appear as input simultaneously on the same frame
         assert point_inputs is None or mask_inputs is None
+        if batch_size == self._get_obj_num(inference_state):
+            samurai_state = inference_state["samurai_state"]
+        else:
+            # a single object's clicks - don't disturb the filters of the whole batch
+            samurai_state = self.init_samurai_state()
         current_out = self.track_step(
             frame_idx=frame_idx,
             is_init_cond_frame=is_init_cond_frame,
@@ -962,6 +1179,8 @@ class SAM2VideoPredictor(SAM2Base):
             track_in_reverse=reverse,
             run_mem_encoder=run_mem_encoder,
             prev_sam_mask_logits=prev_sam_mask_logits,
+            samurai_state=samurai_state,
+            memory_constants=self._get_memory_constants(inference_state),
         )
 
         # optionally offload the output to CPU memory to save GPU space
@@ -1055,6 +1274,22 @@ class SAM2VideoPredictor(SAM2Base):
             expanded_maskmem_pos_enc = None
         return expanded_maskmem_pos_enc
 
+    def _get_memory_constants(self, inference_state):
+        """
+        Precomputed memory positional encodings (see `build_memory_constants`),
+        kept in inference_state["constants"] once the first memory is encoded.
+        """
+        model_constants = inference_state["constants"]
+        if "maskmem_pos_by_tpos" not in model_constants:
+            if "maskmem_pos_enc" not in model_constants:
+                return None  # no memory encoded yet
+            model_constants.update(
+                self.build_memory_constants(
+                    model_constants["maskmem_pos_enc"], inference_state["num_frames"]
+                )
+            )
+        return model_constants
+
     @torch.inference_mode()
     def remove_object(self, inference_state, obj_id, strict=False, need_output=True):
         """
@@ -1138,6 +1373,8 @@ class SAM2VideoPredictor(SAM2Base):
                 out["object_score_logits"] = out["object_score_logits"][
                     remain_old_obj_inds
                 ]
+                # write back - spilled outputs come back from disk as copies
+                output_dict[storage_key][frame_idx] = out
                 # also update the per-object slices
                 self._add_output_per_object(
                     inference_state, frame_idx, out, storage_key
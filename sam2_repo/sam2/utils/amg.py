@@ -110,33 +110,88 @@ def mask_to_rle_pytorch(tensor: torch.Tensor) -> List[Dict[str, Any]]:
     """
     Encodes masks to an uncompressed RLE, in the format expected by
     pycoco tools.
+
+    The run lengths of all masks are computed on the masks' device in one pass
+    and copied to the host in a single transfer (a few KB per mask).
     """
     # Put in fortran order and flatten h,w
     b, h, w = tensor.shape
-    tensor = tensor.permute(0, 2, 1).flatten(1)
+    tensor = tensor.permute(0, 2, 1).flatten(1).bool()
+    if b == 0:
+        return []
 
-    # Compute change indices
+    # Compute change indices, sorted by mask then position
     diff = tensor[:, 1:] ^ tensor[:, :-1]
     change_indices = diff.nonzero()
+    rows, ends = change_indices[:, 0], change_indices[:, 1] + 1
+
+    # Length of the run ending at each change: distance to the previous change
+    # of the same mask (or to the start of the mask)
+    starts = torch.zeros_like(ends)
+    if ends.numel() > 0:
+        starts[1:] = ends[:-1]
+        is_first = torch.ones_like(rows, dtype=torch.bool)
+        is_first[1:] = rows[1:] != rows[:-1]
+        starts[is_first] = 0
+    run_lengths = ends - starts
+    # The last run of each mask ends at h * w
+    num_changes = torch.bincount(rows, minlength=b)
+    last_ends = torch.zeros(b, dtype=ends.dtype, device=ends.device)
+    has_changes = num_changes > 0
+    last_idx = torch.cumsum(num_changes, 0) - 1
+    last_ends[has_changes] = ends[last_idx[has_changes]]
+    last_runs = h * w - last_ends
+
+    # One host transfer for everything
+    host = torch.cat(
+        [num_changes, tensor[:, 0].to(num_changes.dtype), last_runs, run_lengths]
+    ).cpu()
+    num_changes, first_values = host[:b].tolist(), host[b : 2 * b].tolist()
+    last_runs, run_lengths = host[2 * b : 3 * b].tolist(), host[3 * b :].tolist()
 
     # Encode run length
     out = []
+    offset = 0
     for i in range(b):
-        cur_idxs = change_indices[change_indices[:, 0] == i, 1]
-        cur_idxs = torch.cat(
-            [
-                torch.tensor([0], dtype=cur_idxs.dtype, device=cur_idxs.device),
-                cur_idxs + 1,
-                torch.tensor([h * w], dtype=cur_idxs.dtype, device=cur_idxs.device),
-            ]
-        )
-        btw_idxs = cur_idxs[1:] - cur_idxs[:-1]
-        counts = [] if tensor[i, 0] == 0 else [0]
-        counts.extend(btw_idxs.detach().cpu().tolist())
+        counts = [] if first_values[i] == 0 else [0]
+        counts.extend(run_lengths[offset : offset + num_changes[i]])
+        counts.append(last_runs[i])
+        offset += num_changes[i]
         out.append({"size": [h, w], "counts": counts})
     return out
 
 
+def rle_counts_to_string(counts: List[int]) -> str:
+    """
+    Compresses uncompressed RLE counts to the string of COCO compressed RLEs
+    (the same as pycocotools' `rleToString`), without building a mask on the host.
+    """
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1F
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return "".join(chars)
+
+
+def mask_to_coco_rle_pytorch(tensor: torch.Tensor) -> List[Dict[str, Any]]:
+    """
+    Encodes masks [B, H, W] to COCO compressed RLEs ({"size", "counts": str}),
+    with the run lengths computed on the masks' device (see `mask_to_rle_pytorch`).
+    """
+    return [
+        {"size": rle["size"], "counts": rle_counts_to_string(rle["counts"])}
+        for rle in mask_to_rle_pytorch(tensor)
+    ]
+
+
 def rle_to_mask(rle: Dict[str, Any]) -> np.ndarray:
     """Compute a binary mask from an uncompressed RLE."""
     h, w = rle["size"]
@@ -346,3 +401,35 @@ def batched_mask_to_box(masks: torch.Tensor) -> torch.Tensor:
         out = out[0]
 
     return out
+
+
+def batched_mask_logits_to_box(
+    mask_logits: torch.Tensor, threshold: float = 0.0, scale: int = 1
+) -> torch.Tensor:
+    """
+    Same boxes as `batched_mask_to_box(mask_logits > threshold)` (XYXY, [0,0,0,0]
+    for an empty mask, input C1xC2x...xHxW, output C1xC2x...x4), without
+    materializing the binary masks: row/column occupancy comes from one max
+    reduction over each axis of the logits, the edges from those H and W sized
+    vectors. Runs entirely on the device (no host sync).
+
+    With `scale` > 1 the logits are taken as a low-res version of a mask `scale`
+    times larger and the boxes are returned in the coordinates of the large mask
+    (each low-res pixel covers `scale` x `scale` pixels).
+    """
+    h, w = mask_logits.shape[-2:]
+    in_height = torch.amax(mask_logits, dim=-1) > threshold  # ...xH
+    in_width = torch.amax(mask_logits, dim=-2) > threshold  # ...xW
+
+    # argmax returns the first maximal index: first/last occupied row and column
+    top_edges = torch.argmax(in_height.to(torch.uint8), dim=-1)
+    bottom_edges = h - 1 - torch.argmax(in_height.flip(-1).to(torch.uint8), dim=-1)
+    left_edges = torch.argmax(in_width.to(torch.uint8), dim=-1)
+    right_edges = w - 1 - torch.argmax(in_width.flip(-1).to(torch.uint8), dim=-1)
+
+    out = torch.stack([left_edges, top_edges, right_edges, bottom_edges], dim=-1)
+    if scale > 1:
+        out = out * scale
+        out[..., 2:] += scale - 1
+    is_empty = ~torch.any(in_height, dim=-1)
+    return out * (~is_empty).unsqueeze(-1)
@@ -0,0 +1,157 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+from collections import OrderedDict
+
+import torch
+
+# Upper bound of the cache sized by `FeatureCache.fit_to_video` (host memory)
+AUTO_CACHE_MAX_BYTES = 8 << 30
+
+
+def _entry_bytes(feats):
+    return sum(x.numel() * x.element_size() for x in feats)
+
+
+def _compact(x):
+    """A copy if `x` is a view into a larger tensor (e.g. one frame of a batch)"""
+    if x.untyped_storage().nbytes() > x.numel() * x.element_size():
+        return x.clone()
+    return x
+
+
+class FeatureCache:
+    """
+    Byte-budgeted LRU cache of image encoder outputs keyed by frame index, so
+    interacting with a frame again or re-running propagation over the same
+    frames doesn't run the image encoder again.
+
+    - GPU tier: up to `gpu_bytes` of features on the compute device (the most
+      recent frame is always kept, even if it alone exceeds the budget)
+    - CPU tier (optional, `cpu_bytes` > 0): frames pushed out of the GPU tier
+      are copied to pinned host memory and moved back on a hit
+
+    "vision_pos_enc" only depends on the feature map sizes, so a single copy is
+    shared by all cached frames and only "backbone_fpn" is stored per frame.
+    """
+
+    def __init__(self, gpu_bytes=256 << 20, cpu_bytes=0):
+        self.gpu_bytes = gpu_bytes
+        self.cpu_bytes = cpu_bytes
+        self._gpu = OrderedDict()  # frame_idx -> [backbone_fpn tensors], LRU first
+        self._cpu = OrderedDict()
+        self._gpu_used = 0
+        self._cpu_used = 0
+        self._vision_pos_enc = None
+        self.hits = 0
+        self.cpu_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self._gpu or frame_idx in self._cpu
+
+    def __len__(self):
+        return len(self._gpu) + len(self._cpu)
+
+    def get(self, frame_idx, device):
+        """backbone_out dict of a cached frame (on `device`), or None on a miss"""
+        feats = self._gpu.get(frame_idx)
+        if feats is not None:
+            self._gpu.move_to_end(frame_idx)
+            self.hits += 1
+        elif frame_idx in self._cpu:
+            cpu_feats = self._cpu.pop(frame_idx)
+            self._cpu_used -= _entry_bytes(cpu_feats)
+            feats = [x.to(device, non_blocking=True) for x in cpu_feats]
+            self._add_gpu(frame_idx, feats)
+            self.cpu_hits += 1
+        else:
+            self.misses += 1
+            return None
+        return {
+            "backbone_fpn": list(feats),
+            "vision_pos_enc": list(self._vision_pos_enc),
+        }
+
+    def put(self, frame_idx, backbone_out):
+        if self._vision_pos_enc is None or any(
+            a.shape != b.shape
+            for a, b in zip(self._vision_pos_enc, backbone_out["vision_pos_enc"])
+        ):
+            self._vision_pos_enc = [_compact(x) for x in backbone_out["vision_pos_enc"]]
+        self._discard(frame_idx)
+        # frames encoded in a batch are copied out, so a cached frame doesn't keep
+        # the whole batch alive (and the byte budget stays accurate)
+        self._add_gpu(frame_idx, [_compact(x) for x in backbone_out["backbone_fpn"]])
+
+    def clear(self):
+        self._gpu.clear()
+        self._cpu.clear()
+        self._gpu_used = 0
+        self._cpu_used = 0
+        self._vision_pos_enc = None
+
+    def stats(self):
+        return {
+            "gpu_frames": len(self._gpu),
+            "gpu_bytes": self._gpu_used,
+            "cpu_frames": len(self._cpu),
+            "cpu_bytes": self._cpu_used,
+            "hits": self.hits,
+            "cpu_hits": self.cpu_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def fit_to_video(self, num_frames, device, max_bytes=AUTO_CACHE_MAX_BYTES):
+        """
+        Size the cache to hold the features of all `num_frames` frames (up to
+        `max_bytes`), from the size of the frames cached so far: the CPU tier on
+        CUDA, otherwise the device tier (which is in host memory already).
+        """
+        num_cached = len(self._gpu)
+        if num_cached == 0:
+            return
+        video_bytes = min(self._gpu_used // num_cached * num_frames, max_bytes)
+        if torch.device(device).type == "cuda":
+            self.cpu_bytes = max(self.cpu_bytes, video_bytes - self.gpu_bytes)
+        else:
+            self.gpu_bytes = max(self.gpu_bytes, video_bytes)
+
+    def _add_gpu(self, frame_idx, feats):
+        self._gpu[frame_idx] = feats
+        self._gpu_used += _entry_bytes(feats)
+        while self._gpu_used > self.gpu_bytes and len(self._gpu) > 1:
+            old_idx, old_feats = self._gpu.popitem(last=False)
+            self._gpu_used -= _entry_bytes(old_feats)
+            self._add_cpu(old_idx, old_feats)
+
+    def _add_cpu(self, frame_idx, feats):
+        nbytes = _entry_bytes(feats)
+        if nbytes > self.cpu_bytes:
+            self.evictions += 1
+            return
+        pin = torch.cuda.is_available()
+        cpu_feats = []
+        for x in feats:
+            host = torch.empty(x.shape, dtype=x.dtype, pin_memory=pin)
+            host.copy_(x, non_blocking=pin)
+            cpu_feats.append(host)
+        self._cpu[frame_idx] = cpu_feats
+        self._cpu_used += nbytes
+        while self._cpu_used > self.cpu_bytes:
+            _, old_feats = self._cpu.popitem(last=False)
+            self._cpu_used -= _entry_bytes(old_feats)
+            self.evictions += 1
+
+    def _discard(self, frame_idx):
+        feats = self._gpu.pop(frame_idx, None)
+        if feats is not None:
+            self._gpu_used -= _entry_bytes(feats)
+        feats = self._cpu.pop(frame_idx, None)
+        if feats is not None:
+            self._cpu_used -= _entry_bytes(feats)
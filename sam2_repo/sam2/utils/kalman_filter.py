@@ -1,5 +1,6 @@
 import numpy as np
 import scipy.linalg
+import torch
 
 
 """
@@ -322,3 +323,99 @@ class KalmanFilter(object):
         x2 = xc + a * h / 2
         y2 = yc + h / 2
         return [x1, y1, x2, y2]
+
+    # Batched (N objects) torch versions of the methods above. Each row of
+    # `mean` (Nx8) / `covariance` (Nx8x8) is an independent track; all rows are
+    # processed with the same tensor ops on the device the tensors live on, and
+    # none of them reads values back to the host.
+
+    def _batch_motion_mat(self, ref):
+        return torch.as_tensor(self._motion_mat, dtype=ref.dtype, device=ref.device)
+
+    def batch_initiate(self, measurements):
+        """Create N tracks from Nx4 measurements (x, y, a, h). See `initiate`."""
+        h = measurements[:, 3]
+        std = torch.stack([
+            2 * self._std_weight_position * h,
+            2 * self._std_weight_position * h,
+            torch.full_like(h, 1e-2),
+            2 * self._std_weight_position * h,
+            10 * self._std_weight_velocity * h,
+            10 * self._std_weight_velocity * h,
+            torch.full_like(h, 1e-5),
+            10 * self._std_weight_velocity * h], dim=1)
+        mean = torch.cat([measurements, torch.zeros_like(measurements)], dim=1)
+        covariance = torch.diag_embed(std.square())
+        return mean, covariance
+
+    def batch_predict(self, mean, covariance):
+        """Prediction step for N tracks. See `predict`."""
+        h = mean[:, 3]
+        std = torch.stack([
+            self._std_weight_position * h,
+            self._std_weight_position * h,
+            torch.full_like(h, 1e-2),
+            self._std_weight_position * h,
+            self._std_weight_velocity * h,
+            self._std_weight_velocity * h,
+            torch.full_like(h, 1e-5),
+            self._std_weight_velocity * h], dim=1)
+        motion_cov = torch.diag_embed(std.square())
+        motion_mat = self._batch_motion_mat(mean)
+
+        mean = mean @ motion_mat.T
+        covariance = motion_mat @ covariance @ motion_mat.T + motion_cov
+        return mean, covariance
+
+    def batch_update(self, mean, covariance, measurements):
+        """
+        Correction step for N tracks with Nx4 measurements. See `update`.
+        Rows whose projected covariance isn't positive definite (e.g. tracks that
+        were never initiated) come back as NaN - mask them out with torch.where.
+        """
+        h = mean[:, 3]
+        std = torch.stack([
+            self._std_weight_position * h,
+            self._std_weight_position * h,
+            torch.full_like(h, 1e-1),
+            self._std_weight_position * h], dim=1)
+        projected_mean = mean[:, :4]
+        projected_cov = covariance[:, :4, :4] + torch.diag_embed(std.square())
+
+        chol_factor, _ = torch.linalg.cholesky_ex(projected_cov)
+        # K^T = S^-1 (P H^T)^T, with H selecting the first 4 state dims
+        kalman_gain = torch.cholesky_solve(covariance[:, :4, :], chol_factor).transpose(1, 2)
+        innovation = measurements - projected_mean
+
+        new_mean = mean + (kalman_gain @ innovation.unsqueeze(-1)).squeeze(-1)
+        new_covariance = covariance - kalman_gain @ projected_cov @ kalman_gain.transpose(1, 2)
+        return new_mean, new_covariance
+
+    def batch_compute_iou(self, pred_bboxes, bboxes):
+        """
+        IoU between N predicted boxes (Nx4, xyah) and N sets of M candidate boxes
+        (NxMx4, xyxy). Returns NxM; empty candidates ([0, 0, 0, 0]) get 0.
+        """
+        pred_bboxes = self.batch_xyah_to_xyxy(pred_bboxes).unsqueeze(1)
+        bboxes = bboxes.to(pred_bboxes.dtype)
+        x1 = torch.maximum(pred_bboxes[..., 0], bboxes[..., 0])
+        y1 = torch.maximum(pred_bboxes[..., 1], bboxes[..., 1])
+        x2 = torch.minimum(pred_bboxes[..., 2], bboxes[..., 2])
+        y2 = torch.minimum(pred_bboxes[..., 3], bboxes[..., 3])
+        intersection_area = (x2 - x1).clamp(min=0) * (y2 - y1).clamp(min=0)
+        pred_area = (pred_bboxes[..., 2] - pred_bboxes[..., 0]) * (pred_bboxes[..., 3] - pred_bboxes[..., 1])
+        area = (bboxes[..., 2] - bboxes[..., 0]) * (bboxes[..., 3] - bboxes[..., 1])
+        union_area = pred_area + area - intersection_area
+        iou = torch.where(union_area != 0, intersection_area / union_area, torch.zeros_like(union_area))
+        is_empty = (bboxes == 0).all(dim=-1)
+        return torch.where(is_empty, torch.zeros_like(iou), iou)
+
+    def batch_xyxy_to_xyah(self, bboxes):
+        x1, y1, x2, y2 = bboxes.unbind(-1)
+        h = y2 - y1
+        h = torch.where(h == 0, torch.ones_like(h), h)
+        return torch.stack([(x1 + x2) / 2, (y1 + y2) / 2, (x2 - x1) / h, h], dim=-1)
+
+    def batch_xyah_to_xyxy(self, bboxes):
+        xc, yc, a, h = bboxes.unbind(-1)
+        return torch.stack([xc - a * h / 2, yc - h / 2, xc + a * h / 2, yc + h / 2], dim=-1)
@@ -0,0 +1,358 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+"""
+Compact binary encoding of per-frame object masks.
+
+A frame record is a sequence of unsigned LEB128 varints:
+
+    frame_index, flags, num_objects,
+    then per object: object_id, height, width, num_counts, counts...
+
+where counts are the uncompressed COCO RLE run lengths of the mask in column-major
+order, starting with a run of zeros (see `mask_to_rle_pytorch`). A record without
+flags is a keyframe. With a delta flag, each mask is instead the XOR of the
+object's mask with its mask in a reference record (the objects and mask sizes of
+both records are then the same), which for tracked objects is a few short runs
+along the edges:
+- `FLAG_DELTA`: the reference is the previous record of the stream
+- `FLAG_KEYFRAME_DELTA`: the reference is the last keyframe, so any frame is
+  decoded from two records (used by mask files, see `MaskFileWriter`)
+
+A mask file (.smk) holds the records of a shot for random access:
+
+    MASK_FILE_MAGIC, version byte,
+    records, each prefixed with its length as a varint,
+    index: num_records, then per record: frame_index, offset, keyframe offset,
+    offset of the index (8 bytes, little-endian), MASK_FILE_MAGIC
+"""
+
+import os
+import struct
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from sam2.utils.amg import mask_to_rle_pytorch
+
+FLAG_DELTA = 1
+FLAG_KEYFRAME_DELTA = 2
+
+MASK_FILE_EXT = ".smk"
+MASK_FILE_MAGIC = b"SAMK"
+MASK_FILE_VERSION = 1
+
+
+def encode_varint(value: int, out: bytearray) -> None:
+    """Append `value` (>= 0) to `out` as an unsigned LEB128 varint"""
+    if value < 0:
+        raise ValueError(f"varints are unsigned, got {value}")
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def decode_varint(data: bytes, pos: int) -> Tuple[int, int]:
+    """The varint at `pos` in `data` and the position after it"""
+    value = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def encode_frame(
+    frame_idx: int,
+    obj_ids: Sequence[int],
+    rles: Sequence[Dict[str, Any]],
+    flags: int = 0,
+) -> bytes:
+    """Encode the uncompressed RLEs of the objects of a frame as a frame record"""
+    out = bytearray()
+    encode_varint(frame_idx, out)
+    encode_varint(flags, out)
+    encode_varint(len(obj_ids), out)
+    for obj_id, rle in zip(obj_ids, rles):
+        h, w = rle["size"]
+        counts = rle["counts"]
+        encode_varint(obj_id, out)
+        encode_varint(h, out)
+        encode_varint(w, out)
+        encode_varint(len(counts), out)
+        for count in counts:
+            encode_varint(count, out)
+    return bytes(out)
+
+
+def decode_frame(data: bytes) -> Tuple[int, int, List[Tuple[int, Dict[str, Any]]]]:
+    """Frame index, flags and [(object id, uncompressed RLE)] of a frame record"""
+    frame_idx, pos = decode_varint(data, 0)
+    flags, pos = decode_varint(data, pos)
+    num_objects, pos = decode_varint(data, pos)
+    objects = []
+    for _ in range(num_objects):
+        obj_id, pos = decode_varint(data, pos)
+        h, pos = decode_varint(data, pos)
+        w, pos = decode_varint(data, pos)
+        num_counts, pos = decode_varint(data, pos)
+        counts = []
+        for _ in range(num_counts):
+            count, pos = decode_varint(data, pos)
+            counts.append(count)
+        objects.append((obj_id, {"size": [h, w], "counts": counts}))
+    return frame_idx, flags, objects
+
+
+def rle_to_mask_fast(rle: Dict[str, Any]) -> np.ndarray:
+    """Binary mask [H, W] of an uncompressed RLE, without a Python loop over runs"""
+    h, w = rle["size"]
+    counts = np.asarray(rle["counts"], dtype=np.int64)
+    values = np.zeros(len(counts), dtype=bool)
+    values[1::2] = True
+    mask = np.repeat(values, counts)
+    return mask.reshape(w, h).T
+
+
+def _apply_delta(
+    objects: List[Tuple[int, Dict[str, Any]]],
+    reference: Optional[Dict[int, np.ndarray]],
+    frame_idx: int,
+) -> Dict[int, np.ndarray]:
+    """{object id: mask} of decoded objects, XORed with `reference` if given"""
+    masks = {}
+    for obj_id, rle in objects:
+        mask = rle_to_mask_fast(rle)
+        if reference is not None:
+            if obj_id not in reference:
+                raise ValueError(
+                    f"delta record for frame {frame_idx} without a reference "
+                    f"mask of object {obj_id}"
+                )
+            mask = mask ^ reference[obj_id]
+        masks[obj_id] = mask
+    return masks
+
+
+class MaskDeltaEncoder:
+    """
+    Turns the binary masks [B, H, W] of consecutive frames into what to encode,
+    computed on the masks' device: the masks themselves for a keyframe, otherwise
+    their XOR with the reference masks (`reference` "previous": the previous
+    frame, "keyframe": the last keyframe). A keyframe is emitted for the first
+    frame, when the objects or mask sizes change, and every `keyframe_interval`
+    frames (0 = never). Returns the uncompressed RLEs and the record flags.
+    """
+
+    def __init__(self, keyframe_interval: int = 0, reference: str = "previous") -> None:
+        if reference not in ["previous", "keyframe"]:
+            raise ValueError(f"invalid delta reference: {reference}")
+        self.keyframe_interval = keyframe_interval
+        self.reference = reference
+        self.reset()
+
+    def reset(self) -> None:
+        """Start over, the next frame is a keyframe"""
+        self.prev_obj_ids: Optional[List[int]] = None
+        self.prev_masks: Optional[torch.Tensor] = None
+        self.key_masks: Optional[torch.Tensor] = None
+        self.frames_since_keyframe = 0
+
+    def __call__(
+        self, obj_ids: Sequence[int], masks: torch.Tensor
+    ) -> Tuple[List[Dict[str, Any]], int]:
+        masks = masks.bool()
+        obj_ids = list(obj_ids)
+        keyframe = (
+            self.prev_masks is None
+            or self.prev_obj_ids != obj_ids
+            or self.prev_masks.shape != masks.shape
+            or 0 < self.keyframe_interval <= self.frames_since_keyframe
+        )
+        if keyframe:
+            rles, flags = mask_to_rle_pytorch(masks), 0
+            self.key_masks = masks
+            self.frames_since_keyframe = 1
+        elif self.reference == "previous":
+            rles, flags = mask_to_rle_pytorch(masks ^ self.prev_masks), FLAG_DELTA
+            self.frames_since_keyframe += 1
+        else:
+            rles = mask_to_rle_pytorch(masks ^ self.key_masks)
+            flags = FLAG_KEYFRAME_DELTA
+            self.frames_since_keyframe += 1
+        self.prev_obj_ids, self.prev_masks = obj_ids, masks
+        return rles, flags
+
+
+class MaskStreamDecoder:
+    """
+    Decodes the frame records of a stream in order, applying deltas to the masks
+    of their reference record. Returns the frame index and {object id: mask [H, W]}.
+    """
+
+    def __init__(self) -> None:
+        self.prev_masks: Optional[Dict[int, np.ndarray]] = None
+        self.key_masks: Optional[Dict[int, np.ndarray]] = None
+
+    def decode(self, data: bytes) -> Tuple[int, Dict[int, np.ndarray]]:
+        frame_idx, flags, objects = decode_frame(data)
+        if flags & FLAG_DELTA:
+            reference = self.prev_masks or {}
+        elif flags & FLAG_KEYFRAME_DELTA:
+            reference = self.key_masks or {}
+        else:
+            reference = None
+        masks = _apply_delta(objects, reference, frame_idx)
+        if reference is None:
+            self.key_masks = masks
+        self.prev_masks = masks
+        return frame_idx, masks
+
+
+class MaskFileWriter:
+    """
+    Writes the masks of a shot to a mask file: keyframes every `keyframe_interval`
+    frames (and whenever the written frames are not consecutive, e.g. when the
+    propagation turns around), the other frames as deltas against their keyframe.
+    """
+
+    def __init__(self, path: str, keyframe_interval: int = 32) -> None:
+        self.path = path
+        self.encoder = MaskDeltaEncoder(keyframe_interval, reference="keyframe")
+        self.file = open(path, "wb")
+        self.file.write(MASK_FILE_MAGIC + bytes([MASK_FILE_VERSION]))
+        self.index: List[Tuple[int, int, int]] = []
+        self.prev_frame_idx: Optional[int] = None
+        self.keyframe_offset = 0
+        self.num_bytes = 0
+
+    def write(
+        self, frame_idx: int, obj_ids: Sequence[int], masks: torch.Tensor
+    ) -> None:
+        """Add the binary masks [B, H, W] of the objects of a frame"""
+        prev_frame_idx = self.prev_frame_idx
+        if prev_frame_idx is not None and abs(frame_idx - prev_frame_idx) != 1:
+            self.encoder.reset()
+        self.prev_frame_idx = frame_idx
+        rles, flags = self.encoder(obj_ids, masks)
+        record = encode_frame(frame_idx, obj_ids, rles, flags)
+        offset = self.file.tell()
+        if flags == 0:
+            self.keyframe_offset = offset
+        prefix = bytearray()
+        encode_varint(len(record), prefix)
+        self.file.write(prefix)
+        self.file.write(record)
+        self.index.append((frame_idx, offset, self.keyframe_offset))
+
+    def close(self) -> None:
+        if self.file is None:
+            return
+        index_offset = self.file.tell()
+        index = bytearray()
+        encode_varint(len(self.index), index)
+        for frame_idx, offset, keyframe_offset in self.index:
+            encode_varint(frame_idx, index)
+            encode_varint(offset, index)
+            encode_varint(keyframe_offset, index)
+        self.file.write(index)
+        self.file.write(struct.pack("<Q", index_offset) + MASK_FILE_MAGIC)
+        self.num_bytes = self.file.tell()
+        self.file.close()
+        self.file = None
+
+    def __enter__(self) -> "MaskFileWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class MaskFileReader:
+    """
+    Random access to the masks of a mask file: `reader[frame_idx]` decodes
+    {object id: mask [H, W]} from the frame's record and its keyframe only.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, "rb")
+        header = self.file.read(len(MASK_FILE_MAGIC) + 1)
+        if header[:-1] != MASK_FILE_MAGIC:
+            raise ValueError(f"{path} is not a mask file")
+        if header[-1] != MASK_FILE_VERSION:
+            raise ValueError(f"unsupported mask file version {header[-1]} in {path}")
+        trailer_size = 8 + len(MASK_FILE_MAGIC)
+        self.file.seek(-trailer_size, os.SEEK_END)
+        trailer = self.file.read(trailer_size)
+        if trailer[8:] != MASK_FILE_MAGIC:
+            raise ValueError(f"{path} is truncated (no index)")
+        (index_offset,) = struct.unpack("<Q", trailer[:8])
+        self.file.seek(index_offset)
+        data = self.file.read()[:-trailer_size]
+        num_records, pos = decode_varint(data, 0)
+        # frame index -> (record offset, keyframe offset); a frame written twice
+        # is read from its last record
+        self.index: Dict[int, Tuple[int, int]] = {}
+        for _ in range(num_records):
+            frame_idx, pos = decode_varint(data, pos)
+            offset, pos = decode_varint(data, pos)
+            keyframe_offset, pos = decode_varint(data, pos)
+            self.index[frame_idx] = (offset, keyframe_offset)
+        # (offset, masks) of the last decoded keyframe
+        self._keyframe_cache: Tuple[Optional[int], Any] = (None, None)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, frame_idx: int) -> bool:
+        return frame_idx in self.index
+
+    def __getitem__(self, frame_idx: int) -> Dict[int, np.ndarray]:
+        return self.read(frame_idx)
+
+    def frames(self) -> List[int]:
+        return sorted(self.index)
+
+    def read(self, frame_idx: int) -> Dict[int, np.ndarray]:
+        if frame_idx not in self.index:
+            raise KeyError(frame_idx)
+        offset, keyframe_offset = self.index[frame_idx]
+        _, flags, objects = decode_frame(self._record(offset))
+        if flags & FLAG_DELTA:
+            raise ValueError(f"frame {frame_idx} is a delta against the previous frame")
+        reference = None
+        if flags & FLAG_KEYFRAME_DELTA:
+            # consecutive frames share their keyframe, keep the last one decoded
+            if self._keyframe_cache[0] != keyframe_offset:
+                key_idx, _, key_objects = decode_frame(self._record(keyframe_offset))
+                self._keyframe_cache = (
+                    keyframe_offset,
+                    _apply_delta(key_objects, None, key_idx),
+                )
+            reference = self._keyframe_cache[1]
+        return _apply_delta(objects, reference, frame_idx)
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> "MaskFileReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def _record(self, offset: int) -> bytes:
+        self.file.seek(offset)
+        prefix = self.file.read(10)
+        length, pos = decode_varint(prefix, 0)
+        self.file.seek(offset + pos)
+        return self.file.read(length)
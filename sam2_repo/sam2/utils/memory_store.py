@@ -0,0 +1,185 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# All rights reserved.
+
+# This source code is licensed under the license found in the
+# LICENSE file in the root directory of this source tree.
+
+import os
+import shutil
+import tempfile
+from collections.abc import MutableMapping
+
+import torch
+
+
+MEMORY_POLICIES = ("keep_all", "evict", "spill")
+
+
+def _tensor_bytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (list, tuple)):
+        return sum(_tensor_bytes(v) for v in value)
+    return 0
+
+
+def _map_tensors(value, fn):
+    if isinstance(value, torch.Tensor):
+        return fn(value)
+    if isinstance(value, list):
+        return [_map_tensors(v, fn) for v in value]
+    if isinstance(value, tuple):
+        return tuple(_map_tensors(v, fn) for v in value)
+    return value
+
+
+class RollingMemoryStore(MutableMapping):
+    """
+    A {frame_idx: out} mapping for the non-conditioning frame outputs that can be
+    bounded during long propagations (used as `output_dict["non_cond_frame_outputs"]`).
+
+    `trim(keep)` is called by the predictor after each tracked frame with the set of
+    frames memory attention can still reach; what happens to the other frames depends
+    on the policy:
+    - "keep_all": nothing (the original unbounded behavior)
+    - "evict": their outputs are dropped
+    - "spill": their outputs are saved to `spill_dir` and loaded back on access
+
+    `stats()` reports how many frames are resident / spilled / evicted and their size.
+    """
+
+    def __init__(self, policy="keep_all", spill_dir=None):
+        if policy not in MEMORY_POLICIES:
+            raise ValueError(f"unknown memory policy {policy!r}, expected one of {MEMORY_POLICIES}")
+        self.policy = policy
+        self._frames = {}  # frame_idx -> out, in memory
+        self._spilled = {}  # frame_idx -> (path, {key: device}, nbytes)
+        self._spill_dir = spill_dir
+        self._own_spill_dir = False
+        self._num_evicted = 0
+        self._num_reloaded = 0
+        self._peak_resident = 0
+
+    # mapping interface
+
+    def __getitem__(self, frame_idx):
+        out = self._frames.get(frame_idx)
+        if out is not None:
+            return out
+        if frame_idx in self._spilled:
+            return self._load(frame_idx)
+        raise KeyError(frame_idx)
+
+    def __setitem__(self, frame_idx, out):
+        self._discard_spilled(frame_idx)
+        self._frames[frame_idx] = out
+        self._peak_resident = max(self._peak_resident, len(self._frames))
+
+    def __delitem__(self, frame_idx):
+        if frame_idx in self._frames:
+            del self._frames[frame_idx]
+        elif frame_idx in self._spilled:
+            self._discard_spilled(frame_idx)
+        else:
+            raise KeyError(frame_idx)
+
+    def __contains__(self, frame_idx):
+        return frame_idx in self._frames or frame_idx in self._spilled
+
+    def __iter__(self):
+        yield from list(self._frames)
+        yield from list(self._spilled)
+
+    def __len__(self):
+        return len(self._frames) + len(self._spilled)
+
+    def clear(self):
+        self._frames.clear()
+        for frame_idx in list(self._spilled):
+            self._discard_spilled(frame_idx)
+
+    def is_resident(self, frame_idx):
+        return frame_idx in self._frames
+
+    # bounding
+
+    def trim(self, keep):
+        """
+        Evict or spill (depending on the policy) every resident frame not in `keep`.
+        Returns the frame indices that left memory.
+        """
+        if self.policy == "keep_all":
+            return []
+        removed = [t for t in self._frames if t not in keep]
+        for frame_idx in removed:
+            out = self._frames.pop(frame_idx)
+            if self.policy == "spill":
+                self._spill(frame_idx, out)
+            else:
+                self._num_evicted += 1
+        return removed
+
+    def stats(self):
+        resident_bytes = sum(
+            _tensor_bytes(v) for out in self._frames.values() for v in out.values()
+        )
+        return {
+            "policy": self.policy,
+            "resident_frames": len(self._frames),
+            "peak_resident_frames": self._peak_resident,
+            "resident_bytes": resident_bytes,
+            "spilled_frames": len(self._spilled),
+            "spilled_bytes": sum(nbytes for _, _, nbytes in self._spilled.values()),
+            "evicted_frames": self._num_evicted,
+            "reloaded_frames": self._num_reloaded,
+        }
+
+    def close(self):
+        """Remove the spill files (and the spill directory if it was created here)"""
+        self.clear()
+        if self._own_spill_dir and self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+            self._own_spill_dir = False
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    # spilling
+
+    def _spill(self, frame_idx, out):
+        if self._spill_dir is None:
+            self._spill_dir = tempfile.mkdtemp(prefix="sam2_memory_")
+            self._own_spill_dir = True
+        os.makedirs(self._spill_dir, exist_ok=True)
+        path = os.path.join(self._spill_dir, f"{frame_idx:06d}.pt")
+        devices = {}
+        cpu_out = {}
+        for key, value in out.items():
+            if isinstance(value, torch.Tensor):
+                devices[key] = value.device
+            elif isinstance(value, list) and value and isinstance(value[0], torch.Tensor):
+                devices[key] = value[0].device
+            cpu_out[key] = _map_tensors(value, lambda t: t.cpu())
+        torch.save(cpu_out, path)
+        nbytes = sum(_tensor_bytes(v) for v in cpu_out.values())
+        self._spilled[frame_idx] = (path, devices, nbytes)
+
+    def _load(self, frame_idx):
+        path, devices, _ = self._spilled[frame_idx]
+        out = torch.load(path, map_location="cpu")
+        for key, device in devices.items():
+            out[key] = _map_tensors(out[key], lambda t: t.to(device, non_blocking=True))
+        self._num_reloaded += 1
+        return out
+
+    def _discard_spilled(self, frame_idx):
+        entry = self._spilled.pop(frame_idx, None)
+        if entry is not None:
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
@@ -7,8 +7,10 @@
 import os
 os.environ["OPENCV_IO_ENABLE_OPENEXR"]="1"
 import gc
+import math
 import warnings
-from threading import Thread
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from threading import RLock, Thread
 from tqdm import tqdm
 import numpy as np
 import torch
@@ -91,13 +93,97 @@ def get_sdpa_settings():
             )
         math_kernel_on = pytorch_version < (2, 2) or not use_flash_attn
     else:
-        old_gpu = True
-        use_flash_attn = False
+        # On CPU the flags pick between the fused (flash) CPU kernel, available
+        # on PyTorch 2.2+, and the math kernel; there is no mem-efficient CPU
+        # kernel. Math stays on for the cases the fused kernel can't handle.
+        pytorch_version = tuple(int(v) for v in torch.__version__.split(".")[:2])
+        old_gpu = False
+        use_flash_attn = pytorch_version >= (2, 2)
         math_kernel_on = True
 
     return old_gpu, use_flash_attn, math_kernel_on
 
 
+def resize_mask_logits(mask_logits, height, width, crop_to_bbox=True, fill_value=-1024.0):
+    """
+    Resize mask logits [B, 1, h, w] to [B, 1, height, width], the same way as
+    `F.interpolate(mode="bilinear", align_corners=False)`.
+
+    With `crop_to_bbox`, only the part of the output that can come out positive
+    (the box of the positive logits of all objects, grown by the bilinear support)
+    is interpolated and the rest is set to `fill_value`, so thresholding at 0
+    gives the same masks as a full resize for a fraction of the work on large
+    plates. This needs one host sync for the box.
+    """
+    mask_logits = mask_logits.float()
+    B, _, h, w = mask_logits.shape
+    if not crop_to_bbox:
+        return torch.nn.functional.interpolate(
+            mask_logits, size=(height, width), mode="bilinear", align_corners=False
+        )
+
+    out = mask_logits.new_full((B, 1, height, width), fill_value)
+    fg = mask_logits > 0
+    rows = fg.any(dim=3).any(dim=1).any(dim=0)
+    cols = fg.any(dim=2).any(dim=1).any(dim=0)
+    found, y0, y1, x0, x1 = torch.stack([
+        rows.any().long(),
+        rows.long().argmax(),
+        h - 1 - rows.flip(0).long().argmax(),
+        cols.long().argmax(),
+        w - 1 - cols.flip(0).long().argmax(),
+    ]).tolist()
+    if not found:
+        return out
+
+    # output pixel Y samples the input at (Y + 0.5) * h / height - 0.5 and reads the
+    # two input rows around it, so it can only be positive if they overlap [y0, y1]
+    Y0 = max(int(math.floor((y0 - 0.5) * height / h - 0.5)), 0)
+    Y1 = min(int(math.ceil((y1 + 1.5) * height / h - 0.5)) + 1, height)
+    X0 = max(int(math.floor((x0 - 0.5) * width / w - 0.5)), 0)
+    X1 = min(int(math.ceil((x1 + 1.5) * width / w - 0.5)) + 1, width)
+
+    # normalized sample positions of the crop in the full output (grid_sample with
+    # align_corners=False and border padding matches interpolate's sampling)
+    device = mask_logits.device
+    gy = (torch.arange(Y0, Y1, device=device, dtype=torch.float32) + 0.5) / height * 2 - 1
+    gx = (torch.arange(X0, X1, device=device, dtype=torch.float32) + 0.5) / width * 2 - 1
+    grid = torch.stack(torch.meshgrid(gx, gy, indexing="xy"), dim=-1)
+    out[:, :, Y0:Y1, X0:X1] = torch.nn.functional.grid_sample(
+        mask_logits,
+        grid.unsqueeze(0).expand(B, -1, -1, -1),
+        mode="bilinear",
+        padding_mode="border",
+        align_corners=False,
+    )
+    return out
+
+
+def get_default_device():
+    return torch.device("cuda") if torch.cuda.is_available() else torch.device("cpu")
+
+
+def cpu_supports_bf16():
+    """Whether oneDNN has native bfloat16 kernels on this CPU (AVX512-BF16 / AMX)"""
+    try:
+        return (
+            torch.backends.mkldnn.is_available()
+            and torch.ops.mkldnn._is_mkldnn_bf16_supported()
+        )
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def configure_cpu_threads(num_threads=None):
+    """
+    Set the number of intra-op threads used on CPU (None or 0 keeps the PyTorch
+    default of one per physical core). Returns the number of threads in use.
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    return torch.get_num_threads()
+
+
 def get_connected_components(mask):
     """
     Get the connected components (8-connectivity) of binary masks of shape (N, 1, H, W).
@@ -306,7 +392,7 @@ def create_reads(
 
 class ImgSequences :
     
-    def __init__(self, path, frame_range_min, frame_range_max, original_fps, target_fps, bits, image_size):
+    def __init__(self, path, frame_range_min, frame_range_max, original_fps, target_fps, bits, image_size, offload_video_to_cpu=True, num_prefetch_frames=16, num_decode_workers=4, frame_numbers=None, reference_index=0, compute_device=None):
         self.path = path
         self.frame_range_min = frame_range_min
         self.frame_range_max = frame_range_max
@@ -314,6 +400,16 @@ class ImgSequences :
         self.original_fps = original_fps
         self.bits = bits 
         self.image_size = image_size
+        self.offload_video_to_cpu = offload_video_to_cpu
+        self.num_prefetch_frames = num_prefetch_frames
+        self.num_decode_workers = num_decode_workers
+        # Explicit reading order: frame number to read for each index. When given,
+        # frames are found from the path pattern instead of listing the folder.
+        self.frame_numbers = frame_numbers
+        # Index the fps stride is counted from (it is always read)
+        self.reference_index = reference_index
+        # Device the frames are used on (the model's device; CUDA if available by default)
+        self.compute_device = get_default_device() if compute_device is None else torch.device(compute_device)
         self.input_path_folder = os.path.dirname(path) + "/"
         self.input_file_name = str(os.path.splitext(os.path.basename(path))[0])
         self.file_extension = str(os.path.splitext(os.path.basename(path))[1])
@@ -341,8 +437,7 @@ class ImgSequences :
         img_mean = torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
         img_std = torch.tensor(img_std, dtype=torch.float32)[:, None, None]
 
-        # CPU Offload option is coming soon
-        compute_device=torch.device("cuda")
+        compute_device = self.compute_device
 
         nuke.tprint('Reading image sequence : ' +str(self.path) )
         
@@ -351,6 +446,12 @@ class ImgSequences :
         
         target_fps = self.target_fps
         stride = max(round(original_fps / target_fps), 1)
+        if self.frame_numbers is not None:
+            images, original_height, original_width = self._read_frames(
+                self._frame_paths_from_numbers(), stride, compute_device, img_mean, img_std
+            )
+            return images, original_height, original_width, self.frame_numbers[0]
+
         # Get all frames in folder
         frame_paths = []  
         for filename in os.listdir(self.input_path_folder):
@@ -382,73 +483,247 @@ class ImgSequences :
         nuke.tprint('Process length : ' +str(process_len) )   
         nuke.tprint('Frame range : ' + str(self.frame_range_min) + " - " + str( self.frame_range_max-1)) 
         
-        images = torch.zeros(process_len, 3, self.image_size, self.image_size, dtype=torch.float32)
+        process_paths = frame_paths[frame_start:frame_start + process_len]
+        images, original_height, original_width = self._read_frames(
+            process_paths, stride, compute_device, img_mean, img_std
+        )
+        return images, original_height, original_width, frame_start
+
+    def _frame_paths_from_numbers(self):
+        """One path per entry of `frame_numbers`, filled into the %04d / %03d pattern"""
+        pattern = "%04d" if "%04d" in self.input_file_name else "%03d"
+        paths = []
+        for frame_number in self.frame_numbers:
+            fpath = self.path.replace(pattern, pattern % frame_number)
+            if not os.path.exists(fpath):
+                raise FileNotFoundError(f"Frame {frame_number} not found: {fpath}")
+            paths.append(fpath)
+        nuke.tprint('Frames : ' + str(self.frame_numbers[0]) + " - " + str(self.frame_numbers[-1]) + " (" + str(len(paths)) + " frames)")
+        return paths
+
+    def _read_frames(self, frame_paths, stride, compute_device, img_mean, img_std):
+        # Only frames on the fps stride are read, the others stay blank (as before)
+        process_paths = []
+        for frame_count, fpath in enumerate(frame_paths):
+            if (frame_count - self.reference_index) % stride == 0:
+                process_paths.append(fpath)
+            else:
+                process_paths.append(None)
+
+        # Frames are decoded lazily around the tracking cursor instead of
+        # holding the whole (process_len, 3, S, S) tensor in memory
+        images = StreamingFrameLoader(
+            process_paths,
+            self.image_size,
+            self.bits,
+            offload_video_to_cpu=self.offload_video_to_cpu,
+            img_mean=img_mean,
+            img_std=img_std,
+            compute_device=compute_device,
+            num_prefetch_frames=self.num_prefetch_frames,
+            num_decode_workers=self.num_decode_workers,
+        )
+        original_height, original_width = images.video_height, images.video_width
+        
+        return images, original_height, original_width
+
+
+def _load_sequence_frame(img_path, image_size, bits):
+    """
+    Read one frame of an image sequence (EXR/PNG/DPX/...) as a (3, S, S) float32
+    tensor in [0, 1] (float images are kept as is).
+    """
+    frame = cv2.imread(img_path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH ) 
+    if frame is None:
+        raise FileNotFoundError(f"Cannot read frame: {img_path}")
+    original_height,original_width = frame.shape[:2]
+    frame = cv2.resize(frame, (image_size, image_size))
+    frame = torch.from_numpy(np.array(frame)).permute(2,0,1).float()
+
+    if "float" not in bits :
         
-        # Reading only necessary frames
-        frame_count = 0   
-        renderProgress = nuke.ProgressTask('Reading frames..')
-        for fpath in tqdm(range(0,process_len), desc="Reading frames") :
+        if "8" in bits:
+            #Normalizing 8 bit values to fit in a 0-1 range
+            frame = frame/255
             
+        if "10" in bits:
+            #Normalizing 10 bit values to fit in a 0-1 range
+            frame = frame/1023
             
-            Step = 100 / process_len    
-            renderProgress.setProgress(int(frame_count * Step))
-            renderProgress.setMessage("Reading frames: (" + str(frame_count+1) + " of " + str(process_len) +")")
-            if renderProgress.isCancelled():
-                
-                gc.collect()
-                torch.cuda.empty_cache()
-                del renderProgress
-                raise Exception("Generation aborted")  
-            
-            if frame_count % stride == 0:
-                
-                fpath = frame_paths[frame_start]
-                frame = cv2.imread(fpath, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH ) 
-                original_height,original_width = frame.shape[:2]
-                frame = cv2.resize(frame, (self.image_size, self.image_size))
-                frame = np.array(frame)
-                frame = torch.from_numpy(frame).permute(2,0,1)
-
-                if "float" not in self.bits :
-                    
-                    if "8" in self.bits:
-                        #Normalizing 8 bit values to fit in a 0-1 range
-                        frame = frame/255
-                        
-                    if "10" in self.bits:
-                        #Normalizing 10 bit values to fit in a 0-1 range
-                        frame = frame/1023
-                        
-                    if "12" in self.bits:
-                        #Normalizing 12 bit values to fit in a 0-1 range
-                        frame = frame/4095
-
-                    if "14" in self.bits:
-                        #Normalizing 12 bit values to fit in a 0-1 range
-                        frame = frame/16383
-
-                    if "16" in self.bits:
-                        # Normalizing 16 bit values to fit in a 0-1 range
-                        frame = frame/65535
-
-                images[frame_count] = frame 
-            frame_count += 1  
-            frame_start += 1
+        if "12" in bits:
+            #Normalizing 12 bit values to fit in a 0-1 range
+            frame = frame/4095
 
-       
-        images = images.to(compute_device)
-        img_mean = img_mean.to(compute_device)
-        img_std = img_std.to(compute_device)
-     
-        # Normalizing by mean & std
-        images -= img_mean
-        images /= img_std
-       
-        
-        frame_start = self.frame_range_min - np.min(convert_num)
-        del renderProgress
-        return images, original_height, original_width, frame_start
+        if "14" in bits:
+            #Normalizing 12 bit values to fit in a 0-1 range
+            frame = frame/16383
+
+        if "16" in bits:
+            # Normalizing 16 bit values to fit in a 0-1 range
+            frame = frame/65535
+
+    return frame, original_height, original_width
+
+
+class StreamingFrameLoader:
+    """
+    An indexable image sequence that decodes frames on demand.
+
+    Only a small window around the last accessed frame is kept in memory: frames
+    up to `num_prefetch_frames` ahead of the cursor (in the direction tracking is
+    moving) are decoded by a pool of `num_decode_workers` threads, and frames more
+    than `num_keep_behind_frames` behind it are evicted. Memory therefore stays
+    flat regardless of the sequence length, and reading/decoding/resizing of the
+    next frames overlaps with inference on the current one.
+
+    `img_paths` has one entry per frame; `None` entries are returned as blank frames.
+    """
+
+    def __init__(
+        self,
+        img_paths,
+        image_size,
+        bits,
+        offload_video_to_cpu,
+        img_mean,
+        img_std,
+        compute_device,
+        num_prefetch_frames=16,
+        num_keep_behind_frames=2,
+        num_decode_workers=4,
+    ):
+        self.img_paths = img_paths
+        self.image_size = image_size
+        self.bits = bits
+        self.offload_video_to_cpu = offload_video_to_cpu
+        self.storage_device = (
+            torch.device("cpu") if offload_video_to_cpu else compute_device
+        )
+        self.img_mean = img_mean.to(self.storage_device)
+        self.img_std = img_std.to(self.storage_device)
+        self.num_prefetch_frames = max(num_prefetch_frames, 0)
+        self.num_keep_behind_frames = max(num_keep_behind_frames, 0)
+        # decoded frames in the current window, {index: tensor}
+        self.images = {}
+        # frames being decoded, {index: Future}; bounded by the window size
+        self.pending = {}
+        self.lock = RLock()
+        self.cursor = 0
+        self.direction = 1
+        self._blank = None
+        self.executor = ThreadPoolExecutor(
+            max_workers=max(num_decode_workers, 1),
+            thread_name_prefix="sam2_decode",
+        )
+
+        # decode the first non-blank frame to fill video_height and video_width
+        self.video_height = None
+        self.video_width = None
+        first_index = next(
+            (i for i, path in enumerate(img_paths) if path is not None), None
+        )
+        if first_index is None:
+            raise RuntimeError("No frames to read in the requested range")
+        self.images[first_index] = self._load(first_index)
+        with self.lock:
+            self._schedule()
+
+    def _load(self, index):
+        img_path = self.img_paths[index]
+        if img_path is None:
+            if self._blank is None:
+                blank = torch.zeros(3, self.image_size, self.image_size, device=self.storage_device)
+                self._blank = (blank - self.img_mean) / self.img_std
+            return self._blank
+
+        img, video_height, video_width = _load_sequence_frame(
+            img_path, self.image_size, self.bits
+        )
+        self.video_height = video_height
+        self.video_width = video_width
+        img = img.to(self.storage_device, non_blocking=True)
+        # normalize by mean and std
+        img -= self.img_mean
+        img /= self.img_std
+        return img
+
+    def _window(self):
+        """Indices that should be resident for the current cursor, nearest first"""
+        ahead = [
+            self.cursor + self.direction * i
+            for i in range(1, self.num_prefetch_frames + 1)
+        ]
+        behind = [
+            self.cursor - self.direction * i
+            for i in range(1, self.num_keep_behind_frames + 1)
+        ]
+        return [i for i in [self.cursor] + ahead + behind if 0 <= i < len(self)]
+
+    def _schedule(self):
+        """Evict frames outside the window and submit decodes for missing ones (holding the lock)"""
+        window = self._window()
+        window_set = set(window)
+        for i in [i for i in self.images if i not in window_set]:
+            del self.images[i]
+        for i in [i for i in self.pending if i not in window_set]:
+            # frames already being decoded finish and are dropped in _on_decoded
+            self.pending.pop(i).cancel()
+        if self.executor is None:
+            return
+        for i in window:
+            if i not in self.images and i not in self.pending:
+                future = self.executor.submit(self._load, i)
+                self.pending[i] = future
+                future.add_done_callback(lambda f, i=i: self._on_decoded(i, f))
+
+    def _on_decoded(self, index, future):
+        with self.lock:
+            if self.pending.get(index) is not future:
+                return  # evicted while decoding
+            del self.pending[index]
+            if future.cancelled() or future.exception() is not None:
+                # __getitem__ re-reads it synchronously and surfaces the error
+                return
+            self.images[index] = future.result()
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(f"Frame index {index} out of range")
+
+        with self.lock:
+            if index != self.cursor:
+                self.direction = 1 if index > self.cursor else -1
+                self.cursor = index
+            self._schedule()
+            img = self.images.get(index)
+            future = self.pending.get(index)
+
+        if img is not None:
+            return img
+        if future is not None:
+            # frames are delivered in the order they are requested, whatever order
+            # the pool finishes them in
+            try:
+                return future.result()
+            except CancelledError:
+                pass
+        return self._load(index)
+
+    def __len__(self):
+        return len(self.img_paths)
 
+    def close(self):
+        """Stop the decode threads and drop all decoded frames"""
+        with self.lock:
+            executor, self.executor = self.executor, None
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.images.clear()
+        if executor is not None:
+            executor.shutdown(wait=False)
 
 
 def load_video_frames_from_jpg_images(
@@ -458,7 +733,7 @@ def load_video_frames_from_jpg_images(
     img_mean=(0.485, 0.456, 0.406),
     img_std=(0.229, 0.224, 0.225),
     async_loading_frames=False,
-    compute_device=torch.device("cuda"),
+    compute_device=None,
 ):
     """
     Load the video frames from a directory of JPEG files ("<frame_index>.jpg" format).
@@ -467,7 +742,10 @@ def load_video_frames_from_jpg_images(
     `offload_video_to_cpu` is `False` and to CPU if `offload_video_to_cpu` is `True`.
 
     You can load a frame asynchronously by setting `async_loading_frames` to `True`.
+    `compute_device` defaults to CUDA if available, otherwise CPU.
     """
+    if compute_device is None:
+        compute_device = get_default_device()
     if isinstance(video_path, str) and os.path.isdir(video_path):
         jpg_folder = video_path
     else:
@@ -532,9 +810,11 @@ def load_video_frames_from_video_file(
     offload_video_to_cpu,
     img_mean=(0.485, 0.456, 0.406),
     img_std=(0.229, 0.224, 0.225),
-    compute_device=torch.device("cuda"),
+    compute_device=None,
 ):
     """Load the video frames from a video file."""
+    if compute_device is None:
+        compute_device = get_default_device()
     import decord
 
     img_mean = torch.tensor(img_mean, dtype=torch.float32)[:, None, None]
@@ -6,6 +6,13 @@ import subprocess
 import json
 import shutil
 import sys
+import time
+import tempfile
+from collections import OrderedDict
+
+from . import sam2_daemon_client
+from . import python_discovery
+from .python_discovery import find_system_python, get_python_info
 
 # NO torch or cv2 imports - using subprocess with system Python instead!
 # cv2 is imported locally in getBbox() function
@@ -13,6 +20,100 @@ import sys
 nuke.tprint('Current thread : ' +str(threading.current_thread().name) )
 
 
+class ProxyFrameCache:
+    """
+    LRU cache of downscaled 8-bit display proxies for the timeline bbox picker.
+
+    Decoding a 4K EXR takes far longer than the picker's key polling interval,
+    so frames are decoded once, shrunk to fit `max_size` and kept (up to
+    `capacity` frames). prefetch() decodes the neighbours of the current frame
+    on a small thread pool, so A/D stepping and scrubbing hit the cache.
+    """
+
+    def __init__(self, load_frame, frame_min, frame_max, max_size=1280, capacity=64, num_workers=2):
+        from concurrent.futures import ThreadPoolExecutor
+
+        self.load_frame = load_frame  # frame_num -> (full res image or None, path)
+        self.frame_min = frame_min
+        self.frame_max = frame_max
+        self.max_size = max_size
+        self.capacity = capacity
+        self.frames = OrderedDict()  # frame_num -> proxy, least recently used first
+        self.pending = {}  # frame_num -> Future
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+
+    def _make_proxy(self, frame_num):
+        import cv2
+        import numpy as np
+
+        img, _ = self.load_frame(frame_num)
+        if img is None:
+            return None
+
+        height, width = img.shape[:2]
+        scale = min(1.0, self.max_size / max(height, width))
+        if scale < 1.0:
+            img = cv2.resize(img, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+        # Same mapping cv2.imshow uses for float / 16-bit images, stored as 8-bit
+        if img.dtype == np.uint16:
+            img = (img >> 8).astype(np.uint8)
+        elif img.dtype != np.uint8:
+            img = (np.clip(img, 0.0, 1.0) * 255).astype(np.uint8)
+        if img.ndim == 2:
+            img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+        elif img.shape[2] == 4:
+            img = cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
+        return img
+
+    def _store(self, frame_num, proxy):
+        with self.lock:
+            self.pending.pop(frame_num, None)
+            if proxy is None:
+                return
+            self.frames[frame_num] = proxy
+            self.frames.move_to_end(frame_num)
+            while len(self.frames) > self.capacity:
+                self.frames.popitem(last=False)
+
+    def _decode(self, frame_num):
+        proxy = self._make_proxy(frame_num)
+        self._store(frame_num, proxy)
+        return proxy
+
+    def get(self, frame_num):
+        """Display proxy of a frame (decodes it now on a miss), None if unreadable"""
+        with self.lock:
+            proxy = self.frames.get(frame_num)
+            if proxy is not None:
+                self.frames.move_to_end(frame_num)
+                return proxy
+            future = self.pending.get(frame_num)
+        if future is not None:
+            return future.result()
+        return self._decode(frame_num)
+
+    def prefetch(self, center, radius=4):
+        """Decode frames around `center` in the background, nearest first"""
+        with self.lock:
+            for offset in range(1, radius + 1):
+                for frame_num in (center + offset, center - offset):
+                    if not self.frame_min <= frame_num <= self.frame_max:
+                        continue
+                    if frame_num in self.frames or frame_num in self.pending:
+                        continue
+                    self.pending[frame_num] = self.executor.submit(self._decode, frame_num)
+
+    def close(self):
+        with self.lock:
+            for future in self.pending.values():
+                future.cancel()
+            self.pending.clear()
+            self.frames.clear()
+        self.executor.shutdown(wait=False)
+
+
 class BoundingBox :
     input_path = None
     x = None
@@ -71,6 +172,7 @@ class BoundingBox :
             cls.h = h
             cls.bounding_box_coord = x, y, w, h
             cls.selected_frame = frame_min
+            store_node_bbox(nuke.thisNode(), cls.bounding_box_coord)
             nuke.tprint(f"[SAMURAI] Bbox: {x = } {y = } {w = } {h = }")
             return x, y, w, h, cls.bounding_box_coord
         
@@ -94,17 +196,19 @@ class BoundingBox :
             img = cv2.imread(frame_path, cv2.IMREAD_ANYCOLOR | cv2.IMREAD_ANYDEPTH)
             return img, frame_path
         
-        # Load first frame to get dimensions
-        initial_img, initial_path = load_frame(frame_min)
+        # Timeline shows downscaled proxies; only the final ROI uses the full res frame
+        proxies = ProxyFrameCache(load_frame, frame_min, frame_max)
+        
+        # Load first frame to check the sequence can be read
+        initial_img = proxies.get(frame_min)
         
         if initial_img is None:
+            proxies.close()
             error_msg = f"⚠️ Ошибка загрузки первого кадра!\n\n"
-            error_msg += f"Файл не найден:\n{initial_path}"
+            error_msg += f"Файл не найден:\n{load_frame(frame_min)[1]}"
             nuke.message(error_msg)
             return
         
-        height, width = initial_img.shape[:2]
-        
         # Create window with timeline controls
         window_name = "SAMURAI - Select Frame & Draw Bbox"
         cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
@@ -152,13 +256,16 @@ class BoundingBox :
         
         display_img = add_instructions(display_img, current_frame[0])
         cv2.imshow(window_name, display_img)
+        shown_frame = current_frame[0]
+        proxies.prefetch(shown_frame)
         
         # Main loop - navigate frames
         while True:
-            key = cv2.waitKey(100) & 0xFF
+            key = cv2.waitKey(30) & 0xFF
             
             # ESC - cancel
             if key == 27:
+                proxies.close()
                 cv2.destroyWindow(window_name)
                 nuke.message("❌ Bbox selection cancelled")
                 return None
@@ -187,13 +294,20 @@ class BoundingBox :
             if new_frame != current_frame[0]:
                 current_frame[0] = new_frame
             
-            # Always reload and display current frame
-            current_img, current_path = load_frame(current_frame[0])
+            # Redraw only when the frame changed
+            if current_frame[0] == shown_frame:
+                continue
+            
+            current_img = proxies.get(current_frame[0])
             
             if current_img is not None:
                 display_img = current_img.copy()
                 display_img = add_instructions(display_img, current_frame[0])
                 cv2.imshow(window_name, display_img)
+                shown_frame = current_frame[0]
+                proxies.prefetch(shown_frame)
+        
+        proxies.close()
         
         # User pressed Space/Enter - select bbox on current frame
         selected_frame[0] = current_frame[0]
@@ -231,6 +345,7 @@ class BoundingBox :
         
         # Store the frame number in the node
         nuke.thisNode().knob('ReferenceFrame').setValue(selected_frame[0])
+        store_node_bbox(nuke.thisNode(), cls.bounding_box_coord)
         
         nuke.tprint(f"[SAMURAI] ✅ Bbox selected: {x = } {y = } {w = } {h = } on frame {selected_frame[0]}")
         
@@ -244,8 +359,8 @@ class InputInfos :
     bits = None
     
     @classmethod
-    def getInputInfos(cls):
-        f = nuke.thisNode().dependencies()
+    def getInputInfos(cls, node=None):
+        f = (node or nuke.thisNode()).dependencies()
 
         for i in f:
             cls.read = i
@@ -279,83 +394,121 @@ class InputInfos :
                 TypeError("Cannot interpret bit depth from unsupported input format.")
        
 
+# MaskFormat knob value -> worker "mask_format" (see MASK_FORMATS in sam2_worker.py)
+MASK_FORMATS = {
+    'RGB 8-bit': "rgb8",
+    'Mono 8-bit': "mono8",
+    '1-bit': "bilevel",
+    'Float16 alpha': "alpha_f16",
+    'Object ID': "index",
+}
+
+
 def UpdatePath():
     InputInfos.getInputInfos()
     FilePath = InputInfos.path
     nuke.thisNode().knob('FilePath').setValue(FilePath)
     
 
-def GenerateMask():
-    # NEW: Use subprocess to run SAM2 in system Python (where torch WORKS with CUDA!)
-    import subprocess
-    import json
-    
-    Output_path = nuke.thisNode().knob('OutputPath').getValue()
+def store_node_bbox(node, bbox_coord):
+    """Keep the bbox on the node itself, so every SAMURAI node has its own (queue, saved scripts)"""
+    knob = node.knob('BBox')
+    if knob is not None:
+        knob.setValue(json.dumps([int(v) for v in bbox_coord]))
+
+
+def get_node_bbox(node):
+    """Bbox stored on the node, or the last drawn one for nodes created before the BBox knob"""
+    knob = node.knob('BBox')
+    if knob is not None and knob.value():
+        try:
+            return tuple(json.loads(knob.value()))
+        except ValueError:
+            pass
+    return BoundingBox.bounding_box_coord
+
+
+PYTHON_NOT_FOUND_MESSAGE = (
+    "Python 3.10/3.11/3.12 not found!\n\n"
+    "Please install Python 3.10+ and add it to PATH:\n"
+    "https://www.python.org/downloads/\n\n"
+    "Make sure to check 'Add Python to PATH' during installation."
+)
+
+
+def get_sam2_repo():
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sam2_repo")
+
+
+def collect_job_params(node):
+    """
+    Read everything the worker needs from a SAMURAI node.
+    Raises TypeError for invalid paths and ValueError (with a user message) for missing settings.
+    """
+    Output_path = node.knob('OutputPath').getValue()
 
     # Checks           
     if str(os.path.splitext(os.path.basename(Output_path))[0]) == '' :
         raise TypeError("You must assign a file name")
         
-    if nuke.thisNode()['FilePath'].value().lower().endswith("mp4") :
+    if node['FilePath'].value().lower().endswith("mp4") :
         raise TypeError('Unsupported input format. Input must be an Image Sequence')
         
-    file_type = nuke.thisNode().knob('FileType').value()
-    if file_type in ["exr", "png"]:
+    file_type = node.knob('FileType').value()
+    # A .smk mask file holds the whole shot, it has no frame number pattern
+    if file_type in ["exr", "png"] and not Output_path.lower().endswith(".smk"):
         if ("%04d" not in Output_path) and ("%03d" not in Output_path):
             raise TypeError("Your file must contains '####' or '###'")
         
 
     # Get values
-    video_path = nuke.thisNode().knob('FilePath').value()
-    video_output_path = nuke.thisNode().knob('OutputPath').getValue()
-    save_to_file = nuke.thisNode().knob('FileType').value()
-    bbox_coord = BoundingBox.bounding_box_coord
+    video_path = node.knob('FilePath').value()
+    video_output_path = node.knob('OutputPath').getValue()
+    bbox_coord = get_node_bbox(node)
     
     # Check all required fields
-    frame_min = nuke.thisNode().knob('FrameRangeMin').value()
-    frame_max = nuke.thisNode().knob('FrameRangeMax').value()
-    fps_value = nuke.thisNode().knob('FPS').value()
+    frame_min = node.knob('FrameRangeMin').value()
+    frame_max = node.knob('FrameRangeMax').value()
+    fps_value = node.knob('FPS').value()
     
     if frame_min is None or frame_max is None:
-        nuke.message("⚠️ Ошибка!\n\nУкажите Frame Range (диапазон кадров)")
-        return
+        raise ValueError("⚠️ Ошибка!\n\nУкажите Frame Range (диапазон кадров)")
     
     if fps_value is None or fps_value == 0:
-        nuke.message("⚠️ Ошибка!\n\nУкажите Output Frame Rate (FPS)")
-        return
+        raise ValueError("⚠️ Ошибка!\n\nУкажите Output Frame Rate (FPS)")
     
+    # fps / bit depth of the plate connected to this node
+    if node.dependencies():
+        InputInfos.getInputInfos(node)
     if InputInfos.original_fps is None:
-        nuke.message("⚠️ Ошибка!\n\nНажмите 'Update Path' для получения информации о файле")
-        return
+        raise ValueError("⚠️ Ошибка!\n\nНажмите 'Update Path' для получения информации о файле")
     
     if bbox_coord is None:
-        nuke.message("⚠️ Ошибка!\n\nСначала нажмите 'Create Bounding Box' и выделите объект")
-        return
+        raise ValueError("⚠️ Ошибка!\n\nСначала нажмите 'Create Bounding Box' и выделите объект")
     
     frame_range = [int(frame_min), int(frame_max)]  # No +1, UI shows inclusive range
     original_fps = int(InputInfos.original_fps)                        
     target_fps = int(fps_value)
     bits = InputInfos.bits
 
-    if nuke.thisNode().knob('ModelType').value() == 'Large' :
+    if node.knob('ModelType').value() == 'Large' :
         model_path = "checkpoints/sam2.1_hiera_large.pt"
-    elif nuke.thisNode().knob('ModelType').value() == 'Base+' :    
+    elif node.knob('ModelType').value() == 'Base+' :    
         model_path = "checkpoints/sam2.1_hiera_base_plus.pt"
-    elif nuke.thisNode().knob('ModelType').value() == 'Small' :    
+    elif node.knob('ModelType').value() == 'Small' :    
         model_path = "checkpoints/sam2.1_hiera_small.pt"
-    elif nuke.thisNode().knob('ModelType').value() == 'Tiny' :    
+    elif node.knob('ModelType').value() == 'Tiny' :    
         model_path = "checkpoints/sam2.1_hiera_tiny.pt"
 
-    # NEW: Run SAM2 via subprocess in system Python
-    script_dir = os.path.dirname(__file__)
-    worker_script = os.path.join(script_dir, "sam2_worker.py")
-    sam2_repo = os.path.join(os.path.dirname(script_dir), "sam2_repo")
-    
     # Get reference frame (which frame was used for bbox selection)
-    reference_frame = int(nuke.thisNode().knob('ReferenceFrame').value())
+    reference_frame = int(node.knob('ReferenceFrame').value())
     
+    # Nodes created by older versions don't have these knobs
+    mask_format_knob = node.knob('MaskFormat')
+    decode_threads_knob = node.knob('DecodeThreads')
+
     # Prepare parameters
-    params = {
+    return {
         "video_path": video_path,
         "output_path": video_output_path,
         "bbox_coord": list(bbox_coord),
@@ -365,254 +518,327 @@ def GenerateMask():
         "fps_original": original_fps,
         "fps_target": target_fps,
         "bits": bits,
-        "sam2_repo": sam2_repo,
+        "mask_format": MASK_FORMATS.get(mask_format_knob.value(), "rgb8") if mask_format_knob else "rgb8",
+        "decode_workers": int(decode_threads_knob.value()) if decode_threads_knob else 4,
+        "sam2_repo": get_sam2_repo(),
     }
+
+
+def create_mask_read_node(output_path_final, frame_min, frame_max, xpos, ypos):
+    """Create a Read node for generated masks (must run in the main thread)"""
+    try:
+        if output_path_final.lower().endswith(".smk"):
+            # Keyframe/delta mask file - Nuke can't read it, decode it with
+            # sam2.utils.mask_codec.MaskFileReader
+            nuke.tprint(f"[SAMURAI] ℹ️  Masks saved as a mask file (no Read node): {output_path_final}")
+            return
+
+        # Check if it's image sequence (supports %04d, %03d, ####, ###)
+        is_sequence = any(pattern in output_path_final for pattern in ["%04d", "%03d", "####", "###"])
+        
+        if is_sequence:
+            # Verify first frame exists
+            first_frame_path = output_path_final
+            if "%04d" in output_path_final:
+                first_frame_path = output_path_final.replace('%04d', f"{frame_min:04}")
+            elif "%03d" in output_path_final:
+                first_frame_path = output_path_final.replace('%03d', f"{frame_min:03}")
+            
+            if not os.path.exists(first_frame_path):
+                nuke.tprint(f"[SAMURAI] ⚠️ First frame not found: {first_frame_path}")
+                nuke.tprint(f"[SAMURAI] ℹ️  Masks path: {output_path_final}")
+                return
+            
+            # Create Read node with proper settings
+            read_node = nuke.nodes.Read(file=output_path_final)
+            
+            # Set frame range
+            read_node['first'].setValue(frame_min)
+            read_node['last'].setValue(frame_max)
+            read_node['origfirst'].setValue(frame_min)
+            read_node['origlast'].setValue(frame_max)
+            
+            # Set colorspace to linear (masks are linear data)
+            try:
+                read_node['colorspace'].setValue('linear')
+            except:
+                # If OCIO, try 'Linear' or 'Utility - Linear - sRGB'
+                try:
+                    read_node['colorspace'].setValue('Linear')
+                except:
+                    try:
+                        read_node['colorspace'].setValue('Utility - Linear - sRGB')
+                    except:
+                        nuke.tprint(f"[SAMURAI] ⚠️ Could not set colorspace, using default")
+            
+            # Position node
+            read_node.setXYpos(xpos + 200, ypos)
+            
+            nuke.tprint(f"[SAMURAI] ✅ Read node created: {output_path_final}")
+            nuke.tprint(f"[SAMURAI] ℹ️  Frame range: {frame_min}-{frame_max}")
+            nuke.tprint(f"[SAMURAI] ℹ️  Colorspace: {read_node['colorspace'].value()}")
+        else:
+            nuke.tprint(f"[SAMURAI] ⚠️ Read node not created: output must be image sequence (use %04d or ####)")
+    except Exception as e:
+        nuke.tprint(f"[SAMURAI] ⚠️ Could not create Read node: {e}")
+        import traceback
+        nuke.tprint(traceback.format_exc())
+
+
+# One-shot worker log (its stderr); only the JSON event stream is read live
+WORKER_LOG_FILE = os.path.join(tempfile.gettempdir(), "samurai_worker.log")
+
+
+def format_progress(event):
+    """'Frame 120/240 | 14.2 fps | ETA 0:08 | GPU 5.1 GB' from a worker progress event"""
+    parts = [f"Frame {event['frame']}/{event['total']}"]
+    if event.get("fps"):
+        eta = int(event.get("eta", 0))
+        parts.append(f"{event['fps']:.1f} fps")
+        parts.append(f"ETA {eta // 60}:{eta % 60:02d}")
+    if event.get("gpu_mem_mb") is not None:
+        parts.append(f"GPU {event['gpu_mem_mb'] / 1024:.1f} GB")
+    return " | ".join(parts)
+
+
+def format_summary(event):
+    """Stage timings / throughput of a finished job for the console"""
+    timings = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in event.get("timings", {}).items())
+    summary = f"Timings: {timings}" if timings else ""
+    if event.get("fps"):
+        summary += f" | {event['fps']:.1f} fps avg"
+    if event.get("gpu_peak_mb") is not None:
+        summary += f" | GPU peak {event['gpu_peak_mb'] / 1024:.1f} GB"
+    return summary
+
+
+class ProgressDisplay:
+    """
+    Applies worker events to a nuke.ProgressTask at a fixed refresh rate.
+
+    The worker sends an event per frame; redrawing the task (and printing to
+    the console) for each one slows Nuke down, so progress is only pushed to
+    the UI every REFRESH_INTERVAL seconds. Stage changes show up immediately.
+    """
+
+    REFRESH_INTERVAL = 0.25
+
+    def __init__(self, task):
+        self.task = task
+        self.message = None
+        self.value = None
+        self.dirty = False
+        self.last_refresh = 0
+
+    def handle(self, event):
+        kind = event.get("event")
+        if kind == "stage":
+            nuke.tprint(f"[SAMURAI] {event['message']}")
+            self.message = event["message"]
+            self.dirty = True
+            self.refresh(force=True)
+        elif kind == "progress":
+            self.value = int(event["value"])
+            if "frame" in event:
+                self.message = format_progress(event)
+            self.dirty = True
+            self.refresh()
+
+    def refresh(self, force=False):
+        if not self.dirty:
+            return
+        now = time.time()
+        if not force and now - self.last_refresh < self.REFRESH_INTERVAL:
+            return
+        self.last_refresh = now
+        self.dirty = False
+        if self.message is not None:
+            self.task.setMessage(self.message)
+        if self.value is not None:
+            self.task.setProgress(self.value)
+
+
+def read_log_tail(path, lines=20):
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read().splitlines()[-lines:]
+    except OSError:
+        return []
+
+
+def GenerateMask():
+    # NEW: Use subprocess to run SAM2 in system Python (where torch WORKS with CUDA!)
+    node = nuke.thisNode()
     
-    nuke.tprint(f"[SAMURAI] Reference Frame: {reference_frame}")
-    
-    params_json = json.dumps(params)
-    
-    # Find system Python automatically
-    # Helper function to check if Python version is compatible (3.10, 3.11, 3.12)
-    def is_compatible_python(python_path):
-        try:
-            result = subprocess.run([python_path, '--version'], capture_output=True, text=True, timeout=5)
-            version_output = result.stdout + result.stderr
-            for ver in ['Python 3.10', 'Python 3.11', 'Python 3.12']:
-                if ver in version_output:
-                    return True
-        except:
-            pass
-        return False
-    
-    system_python = None
-    
-    # Method 0: Check environment variable first (for advanced users)
-    env_python = os.getenv('SAMURAI_PYTHON')
-    if env_python and os.path.exists(env_python):
-        system_python = env_python
-    
-    # Method 1: Try 'python' in PATH
-    if not system_python:
-        python_cmd = shutil.which('python')
-        if python_cmd and is_compatible_python(python_cmd):
-            system_python = python_cmd
+    try:
+        params = collect_job_params(node)
+    except ValueError as e:
+        nuke.message(str(e))
+        return
     
-    # Method 2: Try 'python3' in PATH
-    if not system_python:
-        python3_cmd = shutil.which('python3')
-        if python3_cmd and is_compatible_python(python3_cmd):
-            system_python = python3_cmd
+    frame_min, frame_max = params["frame_range"]
+    video_output_path = params["output_path"]
+    sam2_repo = params["sam2_repo"]
+    worker_script = os.path.join(os.path.dirname(__file__), "sam2_worker.py")
     
-    # Method 3: Try Python Launcher (py.exe) - common on Windows
-    if not system_python:
-        py_cmd = shutil.which('py')
-        if py_cmd:
-            # Try to get Python 3.10, 3.11, or 3.12 via py launcher
-            for py_ver in ['-3.12', '-3.11', '-3.10']:
-                try:
-                    result = subprocess.run([py_cmd, py_ver, '-c', 'import sys; print(sys.executable)'], 
-                                          capture_output=True, text=True, timeout=5)
-                    if result.returncode == 0:
-                        found_python = result.stdout.strip()
-                        if found_python and os.path.exists(found_python):
-                            system_python = found_python
-                            break
-                except:
-                    pass
+    nuke.tprint(f"[SAMURAI] Reference Frame: {params['reference_frame']}")
     
-    # Method 4: Try common installation paths
-    if not system_python:
-        username = os.getenv('USERNAME', 'User')
-        common_paths = [
-            # User-specific installations (most common)
-            rf"C:\Users\{username}\AppData\Local\Programs\Python\Python312\python.exe",
-            rf"C:\Users\{username}\AppData\Local\Programs\Python\Python311\python.exe",
-            rf"C:\Users\{username}\AppData\Local\Programs\Python\Python310\python.exe",
-            # System-wide installations
-            r"C:\Python312\python.exe",
-            r"C:\Python311\python.exe",
-            r"C:\Python310\python.exe",
-            r"C:\Program Files\Python312\python.exe",
-            r"C:\Program Files\Python311\python.exe",
-            r"C:\Program Files\Python310\python.exe",
-            r"C:\Program Files (x86)\Python312\python.exe",
-            r"C:\Program Files (x86)\Python311\python.exe",
-            r"C:\Program Files (x86)\Python310\python.exe",
-        ]
-        for path in common_paths:
-            if os.path.exists(path):
-                system_python = path
-                break
+    params_json = json.dumps(params)
     
-    # Method 5: Search Windows Registry for Python installations
-    if not system_python:
-        try:
-            import winreg
-            for py_ver in ['3.12', '3.11', '3.10']:
-                for hkey in [winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE]:
-                    try:
-                        key_path = rf"SOFTWARE\Python\PythonCore\{py_ver}\InstallPath"
-                        with winreg.OpenKey(hkey, key_path) as key:
-                            install_path = winreg.QueryValue(key, None)
-                            python_exe = os.path.join(install_path, 'python.exe')
-                            if os.path.exists(python_exe):
-                                system_python = python_exe
-                                break
-                    except (FileNotFoundError, OSError):
-                        pass
-                if system_python:
-                    break
-        except ImportError:
-            pass
+    # Find system Python automatically
+    system_python = find_system_python()
     
     # If still not found, show error
     if not system_python:
-        error_msg = "Python 3.10/3.11/3.12 not found!\n\n"
-        error_msg += "Please install Python 3.10+ and add it to PATH:\n"
-        error_msg += "https://www.python.org/downloads/\n\n"
-        error_msg += "Make sure to check 'Add Python to PATH' during installation."
-        nuke.message(error_msg)
+        nuke.message(PYTHON_NOT_FOUND_MESSAGE)
         return
     
+    python_info = get_python_info()
     nuke.tprint("[SAMURAI] Starting SAM2 inference via system Python...")
-    nuke.tprint(f"[SAMURAI] Found Python: {system_python}")
-    nuke.tprint(f"[SAMURAI] Using GPU: torch with CUDA")
+    nuke.tprint(f"[SAMURAI] Found Python: {system_python} ({python_info['source']}, cached in {python_discovery.CACHE_FILE})")
+    if python_info["torch"] is None:
+        nuke.tprint("[SAMURAI] ⚠️ torch not found in this Python - install it or set SAMURAI_PYTHON")
+    else:
+        nuke.tprint(f"[SAMURAI] torch {python_info['torch']}, CUDA: {python_info['cuda']}")
     
     # Save node position for Read node creation
-    node_x = nuke.thisNode().xpos()
-    node_y = nuke.thisNode().ypos()
-    
-    def run_worker():
-        try:
-            # Prepare environment with sam2_repo in PYTHONPATH
-            env = os.environ.copy()
-            sam2_repo_path = os.path.join(os.path.dirname(worker_script), "..", "sam2_repo")
-            sam2_repo_path = os.path.abspath(sam2_repo_path)
-            
-            # Add sam2_repo to PYTHONPATH so Python can import sam2 module
-            if 'PYTHONPATH' in env:
-                env['PYTHONPATH'] = sam2_repo_path + os.pathsep + env['PYTHONPATH']
-            else:
-                env['PYTHONPATH'] = sam2_repo_path
-            
-            nuke.tprint(f"[SAMURAI] PYTHONPATH: {sam2_repo_path}")
-            
+    node_x = node.xpos()
+    node_y = node.ypos()
+    # Where the worker actually saved the masks (it can differ, e.g. PNG instead of EXR)
+    output = {"path": str(video_output_path)}
+    
+    def run_one_shot(renderProgress):
+        """Fresh worker process per job (old path). Returns 'ok' / 'cancelled' / 'failed'"""
+        # Prepare environment with sam2_repo in PYTHONPATH
+        env = os.environ.copy()
+        sam2_repo_path = os.path.join(os.path.dirname(worker_script), "..", "sam2_repo")
+        sam2_repo_path = os.path.abspath(sam2_repo_path)
+        
+        # Add sam2_repo to PYTHONPATH so Python can import sam2 module
+        if 'PYTHONPATH' in env:
+            env['PYTHONPATH'] = sam2_repo_path + os.pathsep + env['PYTHONPATH']
+        else:
+            env['PYTHONPATH'] = sam2_repo_path
+        
+        nuke.tprint(f"[SAMURAI] PYTHONPATH: {sam2_repo_path}")
+        
+        nuke.tprint(f"[SAMURAI] Worker log: {WORKER_LOG_FILE}")
+        
+        # stdout = JSON event stream, stderr (all log output) = log file
+        display = ProgressDisplay(renderProgress)
+        with open(WORKER_LOG_FILE, "w", encoding="utf-8") as log_file:
             process = subprocess.Popen(
                 [system_python, worker_script, params_json],
                 stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
+                stderr=log_file,
                 text=True,
+                encoding="utf-8",
                 bufsize=1,
                 env=env
             )
             
-            renderProgress = nuke.ProgressTask('SAM2 Propagation (GPU)')
-            
+            result = None
             for line in iter(process.stdout.readline, ''):
-                if not line:
-                    break
-                
-                line = line.strip()
-                nuke.tprint(line)
-                
-                # Parse stage (current step)
-                if line.startswith("STAGE:"):
-                    try:
-                        stage_name = line.split(":", 1)[1]
-                        renderProgress.setMessage(stage_name)
-                    except:
-                        pass
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    nuke.tprint(line.rstrip())  # not an event - shouldn't happen, but don't lose it
+                    continue
                 
-                # Parse progress (percentage)
-                if line.startswith("PROGRESS:"):
-                    try:
-                        progress = int(line.split(":")[1])
-                        renderProgress.setProgress(progress)
-                    except:
-                        pass
+                kind = event.get("event")
+                if kind == "result":
+                    output["path"] = event.get("output_path", output["path"])
+                    nuke.tprint(f"[SAMURAI] {format_summary(event)}")
+                    result = "ok"
+                elif kind == "error":
+                    nuke.tprint(f"[SAMURAI] ❌ Worker error: {event['message']}")
+                    result = "failed"
+                else:
+                    display.handle(event)
                 
                 # Check cancellation
                 if renderProgress.isCancelled():
                     process.kill()
-                    del renderProgress
-                    nuke.tprint("[SAMURAI] ❌ Cancelled by user")
-                    return
+                    process.wait()
+                    return "cancelled"
             
             process.wait()
+        
+        if process.returncode != 0 or result != "ok":
+            nuke.tprint(f"[SAMURAI] ❌ Worker failed with code {process.returncode}, last log lines:")
+            for log_line in read_log_tail(WORKER_LOG_FILE):
+                nuke.tprint(log_line)
+            return "failed"
+        return "ok"
+    
+    def run_in_daemon(renderProgress):
+        """
+        Resident worker - model stays loaded between clicks.
+        Returns 'ok' / 'cancelled' / 'failed', raises DaemonUnavailable if the daemon can't be used
+        """
+        renderProgress.setMessage("Connecting to SAM2 daemon...")
+        state = sam2_daemon_client.ensure_daemon(system_python, sam2_repo)
+        nuke.tprint(f"[SAMURAI] Using SAM2 daemon (pid {state['pid']}), log: {sam2_daemon_client.LOG_FILE}")
+        
+        job = sam2_daemon_client.DaemonJob(state, params)
+        display = ProgressDisplay(renderProgress)
+        cancel_sent = False
+        for event in job.events():
+            # Cancel stops the current propagation only - the daemon and its models stay alive
+            if renderProgress.isCancelled() and not cancel_sent:
+                job.cancel()
+                cancel_sent = True
+            
+            if event is None:
+                display.refresh()  # show coalesced progress even when events pause
+                continue
+            
+            kind = event.get("event")
+            if kind == "result":
+                output["path"] = event.get("output_path", output["path"])
+                nuke.tprint(f"[SAMURAI] Output: {event['output_path']}")
+                nuke.tprint(f"[SAMURAI] {format_summary(event)}")
+                return "ok"
+            elif kind == "cancelled":
+                return "cancelled"
+            elif kind == "error":
+                nuke.tprint(f"[SAMURAI] ❌ Daemon error: {event['message']}")
+                return "failed"
+            else:
+                display.handle(event)
+        return "failed"
+    
+    def run_worker():
+        try:
+            renderProgress = nuke.ProgressTask('SAM2 Propagation (GPU)')
+            
+            result = None
+            if os.getenv('SAMURAI_NO_DAEMON') != '1':
+                try:
+                    result = run_in_daemon(renderProgress)
+                except sam2_daemon_client.DaemonUnavailable as e:
+                    nuke.tprint(f"[SAMURAI] ⚠️ SAM2 daemon unavailable ({e}), running one-shot worker")
+            if result is None:
+                result = run_one_shot(renderProgress)
+            
             del renderProgress
             
-            if process.returncode == 0:
+            if result == "cancelled":
+                nuke.tprint("[SAMURAI] ❌ Cancelled by user")
+                return
+            
+            if result == "ok":
                 nuke.tprint("[SAMURAI] ✅ Masks generated successfully!")
                 
-                # Capture frame range NOW (before executeInMainThread)
-                captured_frame_min = int(frame_min)
-                captured_frame_max = int(frame_max)
-                captured_output_path = str(video_output_path)
-                
                 # Create Read node for masks in main thread
-                def create_read_node():
-                    try:
-                        # Use captured values (not nuke.thisNode() which doesn't work here)
-                        output_path_final = captured_output_path
-                        
-                        # Check if it's image sequence (supports %04d, %03d, ####, ###)
-                        is_sequence = any(pattern in output_path_final for pattern in ["%04d", "%03d", "####", "###"])
-                        
-                        if is_sequence:
-                            # Verify first frame exists
-                            first_frame_path = output_path_final
-                            if "%04d" in output_path_final:
-                                first_frame_path = output_path_final.replace('%04d', f"{captured_frame_min:04}")
-                            elif "%03d" in output_path_final:
-                                first_frame_path = output_path_final.replace('%03d', f"{captured_frame_min:03}")
-                            
-                            if not os.path.exists(first_frame_path):
-                                nuke.tprint(f"[SAMURAI] ⚠️ First frame not found: {first_frame_path}")
-                                nuke.tprint(f"[SAMURAI] ℹ️  Masks path: {output_path_final}")
-                                return
-                            
-                            # Create Read node with proper settings
-                            read_node = nuke.nodes.Read(file=output_path_final)
-                            
-                            # Set frame range
-                            read_node['first'].setValue(captured_frame_min)
-                            read_node['last'].setValue(captured_frame_max)
-                            read_node['origfirst'].setValue(captured_frame_min)
-                            read_node['origlast'].setValue(captured_frame_max)
-                            
-                            # Set colorspace to linear (masks are linear data)
-                            try:
-                                read_node['colorspace'].setValue('linear')
-                            except:
-                                # If OCIO, try 'Linear' or 'Utility - Linear - sRGB'
-                                try:
-                                    read_node['colorspace'].setValue('Linear')
-                                except:
-                                    try:
-                                        read_node['colorspace'].setValue('Utility - Linear - sRGB')
-                                    except:
-                                        nuke.tprint(f"[SAMURAI] ⚠️ Could not set colorspace, using default")
-                            
-                            # Position node
-                            read_node.setXYpos(node_x + 200, node_y)
-                            
-                            nuke.tprint(f"[SAMURAI] ✅ Read node created: {output_path_final}")
-                            nuke.tprint(f"[SAMURAI] ℹ️  Frame range: {captured_frame_min}-{captured_frame_max}")
-                            nuke.tprint(f"[SAMURAI] ℹ️  Colorspace: {read_node['colorspace'].value()}")
-                        else:
-                            nuke.tprint(f"[SAMURAI] ⚠️ Read node not created: output must be image sequence (use %04d or ####)")
-                    except Exception as e:
-                        nuke.tprint(f"[SAMURAI] ⚠️ Could not create Read node: {e}")
-                        import traceback
-                        nuke.tprint(traceback.format_exc())
+                nuke.executeInMainThread(create_mask_read_node, args=(output["path"], int(frame_min), int(frame_max), node_x, node_y))
                 
-                nuke.executeInMainThread(create_read_node)
-                
-                # Show output path
-                nuke.executeInMainThread(nuke.message, args=("✅ Генерация завершена!\n\nМаски сохранены в:\n" + video_output_path + "\n\nRead нода создана справа от узла SAMURAI!",))
+                # Show output path (a .smk mask file gets no Read node)
+                message = "✅ Генерация завершена!\n\nМаски сохранены в:\n" + output["path"]
+                if not output["path"].lower().endswith(".smk"):
+                    message += "\n\nRead нода создана справа от узла SAMURAI!"
+                nuke.executeInMainThread(nuke.message, args=(message,))
             else:
-                nuke.tprint(f"[SAMURAI] ❌ Worker failed with code {process.returncode}")
                 nuke.executeInMainThread(nuke.message, args=("❌ Ошибка генерации!\n\nПроверьте консоль для деталей",))
                 
         except Exception as e:
@@ -650,13 +876,22 @@ def CreateSamuraiNode():
     reference_frame_knob.setTooltip("The frame number where bounding box was drawn (auto-set)")
     s.addKnob(reference_frame_knob)
     
+    # Bounding box of this node (JSON [x, y, w, h], set by getBbox())
+    bbox_knob = nuke.String_Knob('BBox', 'Bounding Box')
+    bbox_knob.setFlag(nuke.INVISIBLE)
+    s.addKnob(bbox_knob)
+    
     s.addKnob(nuke.Enumeration_Knob('ModelType', 'Model type', ['Base+','Large', 'Small', 'Tiny']))
+    s.addKnob(nuke.Int_Knob("DecodeThreads", 'Decode Threads'))
 
     s.addKnob(nuke.Text_Knob(' ', ''))
     
     file_type_knob = nuke.Enumeration_Knob('FileType', 'File type', ['png', 'exr', 'mp4'])
     file_type_knob.setTooltip('PNG: Always works (recommended)\nEXR: Requires OpenCV with EXR support (may fallback to PNG)\nMP4: Not yet implemented')
     s.addKnob(file_type_knob)
+    mask_format_knob = nuke.Enumeration_Knob('MaskFormat', 'Mask format', list(MASK_FORMATS.keys()))
+    mask_format_knob.setTooltip('RGB 8-bit: white on black, 3 channels (old default)\nMono 8-bit: 1 channel, 3x smaller\n1-bit: packed 1 bit per pixel PNG, smallest\nFloat16 alpha: half float RGBA EXR, mask in all channels (rgba.alpha); mono 8-bit with PNG output\nObject ID: pixel value = object id + 1, 0 = background')
+    s.addKnob(mask_format_knob)
     s.addKnob(nuke.File_Knob('OutputPath', 'Output Path'))
     s.addKnob(nuke.PyScript_Knob('GenerateMask', 'Generate Mask', 'GenerateMask()'))
     
@@ -668,6 +903,7 @@ def CreateSamuraiNode():
     s['FrameRangeMin'].setValue(int(nuke.Root()['first_frame'].value())) 
     s['FrameRangeMax'].setValue(int(nuke.Root()['last_frame'].value())) 
     s['ReferenceFrame'].setValue(int(nuke.Root()['first_frame'].value()))
+    s['DecodeThreads'].setValue(4)
 
 
     s['FPS'].setFlag(nuke.STARTLINE)
@@ -679,6 +915,7 @@ def CreateSamuraiNode():
     s['CreateBoundingBox'].setTooltip("Create a bounding box. Press Enter or space to validate. Press C to cancel.")
     s['FPS'].setTooltip("Target FPS for the output video")
     s['ModelType'].setTooltip("Choose your model type")
-    s['OutputPath'].setTooltip("path/to/your/file_####.exr, to create an image sequence add #### or ### ")
+    s['DecodeThreads'].setTooltip("Number of threads reading and decoding plate frames ahead of the tracker. Raise it for heavy EXR/DPX plates")
+    s['OutputPath'].setTooltip("path/to/your/file_####.exr, to create an image sequence add #### or ### . A .smk path saves all masks to one compact keyframe/delta mask file instead (no Read node)")
     s['GenerateMask'].setTooltip("Generate Mask")
     
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""
+Поиск системного Python 3.10/3.11/3.12 с torch (used by nuke_samurai.py and torch_subprocess.py)
+
+The full search (PATH, py launcher, common install paths, registry) spawns
+several subprocesses, so its result is cached in a fingerprint file together
+with the torch version and CUDA availability:
+
+    ~/.nuke/samurai_python.json
+    {"python": ..., "mtime": ..., "size": ..., "version": "3.11.7",
+     "torch": "2.5.1+cu124", "cuda": true, "source": "PATH (python)"}
+
+The cache is reused as long as the executable still exists with the same
+mtime/size (one os.stat, no subprocess). Reinstalling/updating Python changes
+the mtime and triggers a new search; so does setting SAMURAI_PYTHON to
+another interpreter. Reinstalling only torch is not detected - call
+get_python_info(refresh=True) (or delete the file) after that.
+"""
+import os
+import json
+import shutil
+import subprocess
+
+
+CACHE_FILE = os.path.join(os.path.expanduser("~"), ".nuke", "samurai_python.json")
+
+COMPATIBLE_VERSIONS = ['3.12', '3.11', '3.10']
+
+# Printed as one JSON line by the candidate interpreter
+PROBE_SCRIPT = """
+import json, sys
+info = {"executable": sys.executable, "version": sys.version.split()[0], "torch": None, "cuda": False}
+try:
+    import torch
+    info["torch"] = torch.__version__
+    info["cuda"] = torch.cuda.is_available()
+except Exception:
+    pass
+print(json.dumps(info))
+"""
+
+_cached_info = None
+
+
+def is_compatible_python(python_path):
+    """Check if Python version is compatible (3.10, 3.11, 3.12)"""
+    try:
+        result = subprocess.run([python_path, '--version'], capture_output=True, text=True, timeout=5)
+        version_output = result.stdout + result.stderr
+        for ver in COMPATIBLE_VERSIONS:
+            if f'Python {ver}' in version_output:
+                return True
+    except:
+        pass
+    return False
+
+
+def search_python():
+    """
+    Full search for system Python (slow - several subprocesses).
+    Returns: (path to python.exe, how it was found) or (None, None)
+    """
+    # Method 0: Check environment variable first (for advanced users)
+    env_python = os.getenv('SAMURAI_PYTHON')
+    if env_python and os.path.exists(env_python):
+        return env_python, "SAMURAI_PYTHON"
+
+    # Method 1/2: Try 'python' and 'python3' in PATH
+    for name in ['python', 'python3']:
+        python_cmd = shutil.which(name)
+        if python_cmd and is_compatible_python(python_cmd):
+            return python_cmd, f"PATH ({name})"
+
+    # Method 3: Try Python Launcher (py.exe) - common on Windows
+    py_cmd = shutil.which('py')
+    if py_cmd:
+        # Try to get Python 3.10, 3.11, or 3.12 via py launcher
+        for py_ver in COMPATIBLE_VERSIONS:
+            try:
+                result = subprocess.run([py_cmd, f'-{py_ver}', '-c', 'import sys; print(sys.executable)'],
+                                      capture_output=True, text=True, timeout=5)
+                if result.returncode == 0:
+                    found_python = result.stdout.strip()
+                    if found_python and os.path.exists(found_python):
+                        return found_python, f"py launcher (-{py_ver})"
+            except:
+                pass
+
+    # Method 4: Try common installation paths
+    username = os.getenv('USERNAME', 'User')
+    folders = ['Python' + ver.replace('.', '') for ver in COMPATIBLE_VERSIONS]
+    # User-specific installations (most common), then system-wide installations
+    roots = [
+        rf"C:\Users\{username}\AppData\Local\Programs\Python",
+        "C:\\",
+        r"C:\Program Files",
+        r"C:\Program Files (x86)",
+    ]
+    common_paths = [os.path.join(root, folder, "python.exe") for root in roots for folder in folders]
+    for path in common_paths:
+        if os.path.exists(path):
+            return path, "common install path"
+
+    # Method 5: Search Windows Registry for Python installations
+    try:
+        import winreg
+        for py_ver in COMPATIBLE_VERSIONS:
+            for hkey in [winreg.HKEY_CURRENT_USER, winreg.HKEY_LOCAL_MACHINE]:
+                try:
+                    key_path = rf"SOFTWARE\Python\PythonCore\{py_ver}\InstallPath"
+                    with winreg.OpenKey(hkey, key_path) as key:
+                        install_path = winreg.QueryValue(key, None)
+                        python_exe = os.path.join(install_path, 'python.exe')
+                        if os.path.exists(python_exe):
+                            return python_exe, "registry"
+                except (FileNotFoundError, OSError):
+                    pass
+    except ImportError:
+        pass
+
+    return None, None
+
+
+def probe_python(python_path):
+    """Ask the interpreter for its version, torch version and CUDA availability"""
+    try:
+        # Importing torch (and initializing CUDA) can take a while on the first run
+        result = subprocess.run([python_path, '-c', PROBE_SCRIPT], capture_output=True, text=True, timeout=120)
+        if result.returncode == 0:
+            return json.loads(result.stdout.strip().splitlines()[-1])
+    except (OSError, subprocess.SubprocessError, ValueError, IndexError):
+        pass
+    return {"executable": python_path, "version": None, "torch": None, "cuda": False}
+
+
+def _stat_key(path):
+    st = os.stat(path)
+    return st.st_mtime, st.st_size
+
+
+def _read_cache():
+    try:
+        with open(CACHE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _is_valid(info):
+    """Cheap revalidation: one os.stat, no subprocess"""
+    if not info or not info.get("python"):
+        return False
+    env_python = os.getenv('SAMURAI_PYTHON')
+    if env_python and os.path.normcase(env_python) != os.path.normcase(info["python"]):
+        return False
+    try:
+        return _stat_key(info["python"]) == (info.get("mtime"), info.get("size"))
+    except OSError:
+        return False
+
+
+def _write_cache(info):
+    try:
+        os.makedirs(os.path.dirname(CACHE_FILE), exist_ok=True)
+        tmp_path = CACHE_FILE + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(info, f, indent=2)
+        os.replace(tmp_path, CACHE_FILE)
+    except OSError:
+        pass  # read-only home etc - we just search again next time
+
+
+def get_python_info(refresh=False):
+    """
+    Returns the fingerprint dict of the system Python (see module docstring),
+    or None if no compatible Python was found.
+    """
+    global _cached_info
+
+    if not refresh:
+        if _is_valid(_cached_info):
+            return _cached_info
+        info = _read_cache()
+        if _is_valid(info):
+            _cached_info = info
+            return info
+
+    python_path, source = search_python()
+    if not python_path:
+        _cached_info = None
+        return None
+
+    probe = probe_python(python_path)
+    mtime, size = _stat_key(python_path)
+    info = {
+        "python": python_path,
+        "mtime": mtime,
+        "size": size,
+        "version": probe["version"],
+        "torch": probe["torch"],
+        "cuda": probe["cuda"],
+        "source": source,
+    }
+    _write_cache(info)
+    _cached_info = info
+    return info
+
+
+def find_system_python(refresh=False):
+    """
+    Автоматический поиск Python 3.10/3.11/3.12
+    Returns: путь к python.exe или None
+    """
+    info = get_python_info(refresh=refresh)
+    return info["python"] if info else None
+
+
+def clear_cache():
+    global _cached_info
+    _cached_info = None
+    try:
+        os.remove(CACHE_FILE)
+    except OSError:
+        pass
@@ -0,0 +1,285 @@
+"""
+SAM2 Daemon - resident version of sam2_worker.py (runs in system Python)
+
+Loads each checkpoint once and keeps it in memory, so only the first
+GenerateMask pays for importing torch/hydra and building the predictor.
+
+Protocol: localhost TCP, one JSON object per line (utf-8).
+Every request must carry the token from the state file.
+
+    -> {"cmd": "ping", "token": ...}
+    <- {"event": "pong", "pid": ..., "busy": <job_id or null>, "models": [...]}
+
+    -> {"cmd": "submit", "token": ..., "params": {...}}   (same params as sam2_worker.py)
+    <- {"event": "accepted", "job_id": ...}
+    <- {"event": "stage", "stage": ..., "message": ..., "timings": {...}}   (repeated)
+    <- {"event": "progress", "value": ..., "frame": ..., "fps": ..., ...}  (repeated)
+    <- {"event": "result", "output_path": ..., "timings": {...}, "fps": ...}
+       or {"event": "cancelled"} / {"event": "error", "message": ...}
+
+    Job events are the same dicts the one-shot worker writes to its event
+    stream (see sam2_worker.Reporter for all fields).
+
+    -> {"cmd": "cancel", "token": ..., "job_id": ...}
+    <- {"event": "ok"}
+
+    -> {"cmd": "shutdown", "token": ...}
+    <- {"event": "ok"}
+
+The port/token/pid are written to samurai_daemon.json in the temp dir.
+Closing the submit connection also cancels the job.
+"""
+import sys
+import os
+import json
+import time
+import uuid
+import secrets
+import argparse
+import tempfile
+import threading
+import traceback
+import socketserver
+from collections import OrderedDict
+
+# NO nuke imports - daemon runs in system Python!
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import sam2_worker
+
+
+STATE_FILE = os.path.join(tempfile.gettempdir(), "samurai_daemon.json")
+
+
+class SocketReporter(sam2_worker.Reporter):
+    """Forwards job events to the submitting connection"""
+
+    def __init__(self, send, cancel_event):
+        super().__init__()
+        self.send = send
+        self.cancel_event = cancel_event
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def emit(self, message):
+        if message["event"] == "stage":
+            print(f"[SAM2 Daemon] {message['message']}")
+        try:
+            self.send(message)
+        except OSError:
+            # Nuke went away (closed / crashed) - nobody is waiting for this job
+            print("[SAM2 Daemon] Client disconnected, cancelling job")
+            self.cancel_event.set()
+
+
+class Daemon:
+    def __init__(self, sam2_repo, max_models=1, idle_timeout=1800):
+        self.sam2_repo = sam2_repo
+        self.max_models = max(1, max_models)
+        self.idle_timeout = idle_timeout
+        self.token = secrets.token_hex(16)
+
+        # (model_path, device) -> predictor, least recently used first
+        self.predictors = OrderedDict()
+
+        # One job at a time - the GPU is the bottleneck anyway
+        self.job_lock = threading.Lock()
+        self.current_job = None
+        self.cancel_events = {}
+        self.last_activity = time.time()
+        self.server = None
+
+    # Модели держим в памяти между задачами
+    def get_predictor(self, model_path, device):
+        key = (model_path, device)
+        if key in self.predictors:
+            print(f"[SAM2 Daemon] Reusing loaded model: {model_path}")
+            self.predictors.move_to_end(key)
+            return self.predictors[key]
+
+        while len(self.predictors) >= self.max_models:
+            old_key, _ = self.predictors.popitem(last=False)
+            print(f"[SAM2 Daemon] Unloading model: {old_key[0]}")
+            self.free_gpu_memory()
+
+        start = time.time()
+        predictor = sam2_worker.build_predictor(model_path, self.sam2_repo, device)
+        print(f"[SAM2 Daemon] Model loaded in {time.time() - start:.1f}s: {model_path}")
+        self.predictors[key] = predictor
+        return predictor
+
+    def free_gpu_memory(self):
+        import gc
+        import torch
+
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def run_submit(self, params, send):
+        job_id = uuid.uuid4().hex[:8]
+        cancel_event = threading.Event()
+        self.cancel_events[job_id] = cancel_event
+        send({"event": "accepted", "job_id": job_id})
+        reporter = SocketReporter(send, cancel_event)
+
+        try:
+            if not self.job_lock.acquire(blocking=False):
+                reporter.stage("Waiting for previous job...", "queued")
+                while not self.job_lock.acquire(timeout=0.5):
+                    if cancel_event.is_set():
+                        reporter.cancelled("Cancelled while waiting")
+                        return
+
+            try:
+                self.current_job = job_id
+                print(f"[SAM2 Daemon] Job {job_id} started")
+                try:
+                    output_path = sam2_worker.run_job(params, reporter, self.get_predictor)
+                except sam2_worker.JobCancelled as e:
+                    print(f"[SAM2 Daemon] Job {job_id} cancelled: {e}")
+                    reporter.cancelled(str(e))
+                except Exception as e:
+                    traceback.print_exc()
+                    reporter.error(str(e))
+                else:
+                    print(f"[SAM2 Daemon] Job {job_id} done: {output_path} {reporter.timings}")
+                    reporter.result(output_path)
+                finally:
+                    # inference_state of the finished job is garbage now, give VRAM back
+                    self.free_gpu_memory()
+            finally:
+                self.current_job = None
+                self.last_activity = time.time()
+                self.job_lock.release()
+        except OSError:
+            pass  # client is gone, nothing to report to
+        finally:
+            self.cancel_events.pop(job_id, None)
+
+    def handle(self, request, send):
+        if request.get("token") != self.token:
+            send({"event": "error", "message": "Invalid token"})
+            return
+
+        self.last_activity = time.time()
+        cmd = request.get("cmd")
+
+        if cmd == "ping":
+            send({
+                "event": "pong",
+                "pid": os.getpid(),
+                "busy": self.current_job,
+                "models": [key[0] for key in self.predictors],
+            })
+        elif cmd == "submit":
+            self.run_submit(request["params"], send)
+        elif cmd == "cancel":
+            cancel_event = self.cancel_events.get(request.get("job_id"))
+            if cancel_event is not None:
+                cancel_event.set()
+            send({"event": "ok"})
+        elif cmd == "shutdown":
+            send({"event": "ok"})
+            self.shutdown()
+        else:
+            send({"event": "error", "message": f"Unknown command: {cmd}"})
+
+    def shutdown(self):
+        print("[SAM2 Daemon] Shutting down")
+        for cancel_event in list(self.cancel_events.values()):
+            cancel_event.set()
+        # server.shutdown() blocks until serve_forever returns - can't call it from a handler thread
+        threading.Thread(target=self.server.shutdown, daemon=True).start()
+
+    def watch_idle(self):
+        while True:
+            time.sleep(30)
+            if self.current_job is None and time.time() - self.last_activity > self.idle_timeout:
+                print(f"[SAM2 Daemon] Idle for {self.idle_timeout}s")
+                self.shutdown()
+                return
+
+    def write_state_file(self, port):
+        state = {"port": port, "token": self.token, "pid": os.getpid()}
+        tmp_path = STATE_FILE + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, STATE_FILE)
+
+    def remove_state_file(self):
+        try:
+            with open(STATE_FILE) as f:
+                if json.load(f).get("pid") != os.getpid():
+                    return  # another daemon took over
+            os.remove(STATE_FILE)
+        except (OSError, ValueError):
+            pass
+
+    def serve(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                send_lock = threading.Lock()
+
+                def send(message):
+                    data = (json.dumps(message) + "\n").encode("utf-8")
+                    with send_lock:
+                        self.wfile.write(data)
+                        self.wfile.flush()
+
+                try:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    daemon.handle(json.loads(line.decode("utf-8")), send)
+                except (OSError, ValueError) as e:
+                    print(f"[SAM2 Daemon] Connection error: {e}")
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = False
+
+        # Only localhost - never expose the daemon to the network
+        self.server = Server(("127.0.0.1", 0), Handler)
+        port = self.server.server_address[1]
+        self.write_state_file(port)
+
+        threading.Thread(target=self.watch_idle, daemon=True).start()
+
+        print(f"[SAM2 Daemon] Listening on 127.0.0.1:{port} (pid {os.getpid()})")
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.remove_state_file()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Resident SAM2 worker for NukeSamurai")
+    parser.add_argument("--sam2-repo", required=True)
+    parser.add_argument("--max-models", type=int, default=1,
+                        help="How many checkpoints to keep loaded at once")
+    parser.add_argument("--idle-timeout", type=int, default=1800,
+                        help="Exit after this many seconds without jobs")
+    args = parser.parse_args()
+
+    sam2_repo = sam2_worker.setup_sam2_path(args.sam2_repo)
+
+    # Import torch/sam2 once, up front - this is the cold start we want to pay only once
+    try:
+        import torch
+        import sam2.build_sam  # noqa: F401
+    except ImportError as e:
+        print(f"[SAM2 Daemon] ERROR: Failed to import sam2 module: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"[SAM2 Daemon] torch {torch.__version__}, CUDA: {torch.cuda.is_available()}")
+
+    Daemon(sam2_repo, max_models=args.max_models, idle_timeout=args.idle_timeout).serve()
+
+
+if __name__ == "__main__":
+    main()
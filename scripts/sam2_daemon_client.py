@@ -0,0 +1,187 @@
+"""
+Client for sam2_daemon.py - used from Nuke's Python (NO torch imports here!)
+
+Starts the daemon in system Python on first use and talks to it over
+localhost. See sam2_daemon.py for the protocol.
+"""
+import os
+import sys
+import json
+import time
+import socket
+import tempfile
+import subprocess
+
+
+STATE_FILE = os.path.join(tempfile.gettempdir(), "samurai_daemon.json")
+LOG_FILE = os.path.join(tempfile.gettempdir(), "samurai_daemon.log")
+
+# Importing torch + sam2 in a fresh interpreter can take a while on a cold disk
+STARTUP_TIMEOUT = 120
+CONNECT_TIMEOUT = 2.0
+
+
+class DaemonUnavailable(Exception):
+    """The daemon could not be reached or started - caller should fall back to one-shot worker"""
+
+
+def read_state():
+    try:
+        with open(STATE_FILE) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _request(state, message, timeout=CONNECT_TIMEOUT):
+    """Open a connection, send one command and return the socket + reader"""
+    sock = socket.create_connection(("127.0.0.1", state["port"]), timeout=timeout)
+    message = dict(message, token=state["token"])
+    sock.sendall((json.dumps(message) + "\n").encode("utf-8"))
+    return sock, sock.makefile("r", encoding="utf-8")
+
+
+def ping(state):
+    """Returns the pong dict, or None if the daemon does not answer"""
+    if not state:
+        return None
+    try:
+        sock, reader = _request(state, {"cmd": "ping"})
+        try:
+            reply = json.loads(reader.readline())
+        finally:
+            sock.close()
+    except (OSError, ValueError):
+        return None
+    if reply.get("event") != "pong":
+        return None
+    return reply
+
+
+def start_daemon(system_python, sam2_repo):
+    """Spawn sam2_daemon.py detached from Nuke and wait until it answers"""
+    daemon_script = os.path.join(os.path.dirname(__file__), "sam2_daemon.py")
+    sam2_repo = os.path.abspath(sam2_repo)
+
+    env = os.environ.copy()
+    if 'PYTHONPATH' in env:
+        env['PYTHONPATH'] = sam2_repo + os.pathsep + env['PYTHONPATH']
+    else:
+        env['PYTHONPATH'] = sam2_repo
+
+    kwargs = {}
+    if sys.platform == "win32":
+        # No console window, and don't die with Nuke's console (Ctrl+C)
+        kwargs["creationflags"] = subprocess.CREATE_NO_WINDOW | subprocess.CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs["start_new_session"] = True
+
+    log = open(LOG_FILE, "a")
+    try:
+        process = subprocess.Popen(
+            [system_python, "-u", daemon_script, "--sam2-repo", sam2_repo],
+            stdin=subprocess.DEVNULL,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=env,
+            **kwargs
+        )
+    finally:
+        log.close()
+
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise DaemonUnavailable(f"Daemon exited with code {process.returncode}, see {LOG_FILE}")
+        state = read_state()
+        if state and state.get("pid") == process.pid and ping(state):
+            return state
+        time.sleep(0.25)
+
+    process.kill()
+    raise DaemonUnavailable(f"Daemon did not start in {STARTUP_TIMEOUT}s, see {LOG_FILE}")
+
+
+def ensure_daemon(system_python, sam2_repo):
+    """Returns the state of a running daemon, starting one if needed"""
+    state = read_state()
+    if ping(state):
+        return state
+    return start_daemon(system_python, sam2_repo)
+
+
+def shutdown_daemon():
+    """Stop a running daemon (frees the GPU memory held by the loaded models)"""
+    state = read_state()
+    if not ping(state):
+        return False
+    try:
+        sock, reader = _request(state, {"cmd": "shutdown"})
+        sock.close()
+    except OSError:
+        return False
+    return True
+
+
+class DaemonJob:
+    """
+    One submitted job. Iterate events() to follow it:
+
+        job = DaemonJob(state, params)
+        for event in job.events():
+            if event is None: ...  # no news - good time to check for cancel
+            ...
+        job.cancel()  # from any thread
+    """
+
+    def __init__(self, state, params, poll_interval=0.5):
+        self.state = state
+        self.job_id = None
+        self.cancel_pending = False
+        try:
+            self.sock, _ = _request(state, {"cmd": "submit", "params": params})
+            # Job may wait behind another one, only use the timeout to poll for cancel
+            self.sock.settimeout(poll_interval)
+        except OSError as e:
+            raise DaemonUnavailable(f"Cannot submit job: {e}")
+
+    def events(self):
+        """Yields event dicts until the job ends; yields None while nothing happens"""
+        buffer = b""
+        try:
+            while True:
+                try:
+                    chunk = self.sock.recv(65536)
+                except socket.timeout:
+                    yield None
+                    continue
+                if not chunk:
+                    raise DaemonUnavailable("Daemon closed the connection")
+                buffer += chunk
+                while b"\n" in buffer:
+                    line, buffer = buffer.split(b"\n", 1)
+                    if not line.strip():
+                        continue
+                    event = json.loads(line.decode("utf-8"))
+                    if event.get("event") == "accepted":
+                        self.job_id = event["job_id"]
+                        if self.cancel_pending:
+                            self.cancel()
+                    yield event
+                    if event.get("event") in ("result", "cancelled", "error"):
+                        return
+        finally:
+            self.sock.close()
+
+    def cancel(self):
+        """Ask the daemon to stop this job - the daemon itself keeps running"""
+        if self.job_id is None:
+            # Not accepted yet - cancel as soon as the daemon gives us the job id
+            self.cancel_pending = True
+            return
+        try:
+            sock, reader = _request(self.state, {"cmd": "cancel", "job_id": self.job_id})
+            reader.readline()
+            sock.close()
+        except OSError:
+            pass
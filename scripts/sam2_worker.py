@@ -1,435 +1,733 @@
 """
 SAM2 Worker - выполняется в системном Python с рабочим torch
+
+Two ways to use it:
+- one-shot:  python sam2_worker.py '<params json>'  (one process per job)
+- resident:  sam2_daemon.py imports `run_job` and keeps predictors loaded
+             between jobs (see sam2_daemon.py)
 """
 import sys
 import os
 import json
+import time
+import queue
+import contextlib
+import threading
+from collections import deque
 
-# Получаем параметры
-if len(sys.argv) < 2:
-    print("ERROR: No parameters provided")
-    sys.exit(1)
+# NO nuke imports - worker runs in system Python!
 
-params = json.loads(sys.argv[1])
 
-# Добавляем sam2_repo в path (должен быть в PYTHONPATH от parent process)
-sam2_repo = params["sam2_repo"]
-sam2_repo = os.path.abspath(sam2_repo)
+class JobCancelled(Exception):
+    """Raised inside run_job when the reporter says the job was cancelled"""
 
-# Ensure sam2_repo is in sys.path for imports
-if sam2_repo not in sys.path:
-    sys.path.insert(0, sam2_repo)
 
-# Set Hydra full error for better debugging
-os.environ['HYDRA_FULL_ERROR'] = '1'
+class Reporter:
+    """
+    Turns job state into protocol events (one dict per event, JSON-encoded by
+    the transport). Subclasses decide where events go by implementing emit().
 
-print(f"[SAM2 Worker] sys.path includes: {sam2_repo}")
-print(f"[SAM2 Worker] Attempting to import sam2 module...")
+        {"event": "stage", "stage": "propagate", "message": "[5/6] Propagating Masks...",
+         "timings": {"load_model": 3.1, ...}}
+        {"event": "progress", "value": 57, "stage": "propagate", "frame": 120, "total": 240,
+         "fps": 14.2, "eta": 8.4, "gpu_mem_mb": 5120, "gpu_peak_mb": 6400}
+        {"event": "result", "output_path": ..., "timings": {...}, "fps": 13.9, "gpu_peak_mb": 6400}
+        {"event": "cancelled", "message": ...} / {"event": "error", "message": ...}
 
-# Теперь импортируем torch и SAM2
-try:
-    import torch
-    import cv2
-    import numpy as np
-    import tempfile
-    import shutil
-    from pathlib import Path
-    from sam2.build_sam import build_sam2_video_predictor
-    print(f"[SAM2 Worker] Successfully imported sam2 module")
-except ImportError as e:
-    print(f"[SAM2 Worker] ERROR: Failed to import sam2 module: {e}", file=sys.stderr)
-    print(f"[SAM2 Worker] sam2_repo path: {sam2_repo}", file=sys.stderr)
-    print(f"[SAM2 Worker] Check that sam2_repo contains 'sam2' folder", file=sys.stderr)
-    sys.exit(1)
+    `timings` holds the seconds spent in each finished stage, `fps`/`eta` are
+    measured over the last FPS_WINDOW frames, GPU memory is in MiB (omitted on CPU).
+    """
 
-# NO nuke imports - worker runs in system Python!
+    FPS_WINDOW = 30
 
-print(f"[SAM2 Worker] torch {torch.__version__}, CUDA: {torch.cuda.is_available()}")
-
-# Извлекаем параметры
-video_path = params["video_path"]
-output_path = params["output_path"]
-bbox_coord = params["bbox_coord"]
-frame_range = params["frame_range"]
-reference_frame = params.get("reference_frame", frame_range[0])  # NEW: Selected frame for bbox
-model_path = os.path.join(params["sam2_repo"], params["model_path"])  # checkpoints inside sam2_repo!
-fps_original = params["fps_original"]
-fps_target = params["fps_target"]
-bits = params["bits"]
-
-print(f"[SAM2 Worker] Frame Range: {frame_range[0]}-{frame_range[1]}")
-print(f"[SAM2 Worker] Reference Frame: {reference_frame}")
-
-# Validate reference frame
-if reference_frame < frame_range[0] or reference_frame > frame_range[1]:
-    print(f"[SAM2 Worker] ERROR: Reference frame {reference_frame} outside range {frame_range}", file=sys.stderr)
-    sys.exit(1)
-
-# Check if output is EXR - OpenCV needs special compilation for EXR support
-is_exr_output = output_path.lower().endswith('.exr') or '.exr' in output_path.lower()
-if is_exr_output:
-    print("[SAM2 Worker] WARNING: EXR output requested")
-    print("[SAM2 Worker] OpenCV pip version doesn't support EXR by default")
-    print("[SAM2 Worker] Trying to save as EXR (requires OPENCV_IO_ENABLE_OPENEXR=1)")
-
-# Создаем mapping для переупорядочивания кадров
-def create_frame_mapping(frame_min, frame_max, reference_frame):
-    """
-    Creates a mapping: reading_index → actual_frame_number
-    
-    Reorders frames so reference_frame becomes index 0 for SAM2.
-    
-    Example:
-        frame_range: 1001-1200
-        reference: 1112
-        
-        Reading order: [1112, 1113, ..., 1200, 1001, 1002, ..., 1111]
-        Indices:       [0,    1,    ..., 88,   89,   90,   ..., 199]
-    
-    Returns:
-        index_to_frame: dict {0: 1112, 1: 1113, ..., 199: 1111}
-        frame_to_index: dict {1112: 0, 1113: 1, ..., 1111: 199}
-    """
-    index_to_frame = {}
-    frame_to_index = {}
-    
-    idx = 0
-    
-    # First: reference_frame to frame_max (forward)
-    for frame in range(reference_frame, frame_max + 1):
-        index_to_frame[idx] = frame
-        frame_to_index[frame] = idx
-        idx += 1
-    
-    # Then: frame_min to (reference_frame - 1) (wrap around)
-    if reference_frame > frame_min:
-        for frame in range(frame_min, reference_frame):
-            index_to_frame[idx] = frame
-            frame_to_index[frame] = idx
-            idx += 1
-    
-    return index_to_frame, frame_to_index
-
-# Create frame mapping for reordering
-index_to_frame, frame_to_index = create_frame_mapping(
-    frame_range[0], 
-    frame_range[1], 
-    reference_frame
-)
-
-print(f"[SAM2 Worker] Frame mapping created:")
-print(f"[SAM2 Worker]   Total frames: {len(index_to_frame)}")
-print(f"[SAM2 Worker]   Reading index 0 = Frame {index_to_frame[0]} (reference)")
-print(f"[SAM2 Worker]   Reading index 1 = Frame {index_to_frame[1]}")
-print(f"[SAM2 Worker]   Reading index 50 = Frame {index_to_frame.get(50, 'N/A')}")
-print(f"[SAM2 Worker]   Reading index 100 = Frame {index_to_frame.get(100, 'N/A')}")
-print(f"[SAM2 Worker]   Reading index {len(index_to_frame)-1} = Frame {index_to_frame[len(index_to_frame)-1]}")
-
-# Validate mapping
-for idx, frame_num in index_to_frame.items():
-    if frame_num < frame_range[0] or frame_num > frame_range[1]:
-        print(f"[SAM2 Worker] ERROR: Invalid mapping! Index {idx} -> Frame {frame_num} (outside range {frame_range[0]}-{frame_range[1]})")
-        sys.exit(1)
+    def __init__(self):
+        self.stage_name = None
+        self.stage_started = None
+        self.timings = {}
+        self.frame_times = deque(maxlen=self.FPS_WINDOW)
+        self.frames_started = None
+        self.frames_done = 0
+
+    def emit(self, event):
+        raise NotImplementedError
+
+    def is_cancelled(self):
+        return False
+
+    def _end_stage(self):
+        if self.stage_name is not None:
+            elapsed = time.perf_counter() - self.stage_started
+            self.timings[self.stage_name] = round(self.timings.get(self.stage_name, 0) + elapsed, 3)
+            self.stage_name = None
+
+    def stage(self, message, name=None):
+        """Report a stage message; a new `name` starts timing a new stage"""
+        if name is not None and name != self.stage_name:
+            self._end_stage()
+            self.stage_name = name
+            self.stage_started = time.perf_counter()
+        self.emit({"event": "stage", "stage": self.stage_name, "message": message, "timings": dict(self.timings)})
+
+    def progress(self, value):
+        self.emit({"event": "progress", "value": value, "stage": self.stage_name})
+
+    def frame(self, value, frame, total):
+        """Per-frame progress with throughput, ETA and GPU memory"""
+        now = time.perf_counter()
+        if self.frames_started is None:
+            self.frames_started = now
+        self.frames_done += 1
+        self.frame_times.append(now)
+
+        event = {"event": "progress", "value": value, "stage": self.stage_name, "frame": frame, "total": total}
+        if len(self.frame_times) > 1:
+            fps = (len(self.frame_times) - 1) / max(self.frame_times[-1] - self.frame_times[0], 1e-6)
+            event["fps"] = round(fps, 2)
+            event["eta"] = round((total - frame) / fps, 1)
+        event.update(gpu_memory())
+        self.emit(event)
+
+    def average_fps(self):
+        if self.frames_done < 2:
+            return None
+        return round((self.frames_done - 1) / max(self.frame_times[-1] - self.frames_started, 1e-6), 2)
 
-# Function to create reordered frame sequence
-def create_reordered_sequence(video_path, index_to_frame, frame_range):
+    def result(self, output_path):
+        self._end_stage()
+        event = {"event": "result", "output_path": output_path, "timings": dict(self.timings), "fps": self.average_fps()}
+        peak = gpu_memory().get("gpu_peak_mb")
+        if peak is not None:
+            event["gpu_peak_mb"] = peak
+        self.emit(event)
+
+    def cancelled(self, message=""):
+        self._end_stage()
+        self.emit({"event": "cancelled", "message": message, "timings": dict(self.timings)})
+
+    def error(self, message):
+        self._end_stage()
+        self.emit({"event": "error", "message": message, "timings": dict(self.timings)})
+
+
+class StreamReporter(Reporter):
     """
-    Creates temporary folder with frames in reordered sequence.
-    
-    SAM2 requires bbox to be on frame_idx=0, so we reorder frames
-    so that reference_frame becomes the first frame physically.
-    
-    Returns:
-        temp_dir: Path to temporary directory
-        reordered_video_path: Path pattern for reordered sequence
+    Writes events as JSON lines to a dedicated stream (one-shot mode: the
+    original stdout, while all log output goes to stderr - see main()).
+    This is the channel GenerateMask() reads.
     """
-    # Parse input video path pattern
-    input_file_name = os.path.basename(video_path)
-    input_dir = os.path.dirname(video_path)
-    file_ext = os.path.splitext(input_file_name)[1]  # .png, .exr, etc
-    
-    # Determine frame number pattern
-    if "%04d" in input_file_name:
-        frame_pattern = "%04d"
-        frame_digits = 4
-    elif "%03d" in input_file_name:
-        frame_pattern = "%03d"
-        frame_digits = 3
-    else:
-        # Single file or unsupported pattern
-        return None, video_path
-    
-    print(f"[SAM2 Worker] Creating temporary reordered sequence...")
-    print(f"[SAM2 Worker]   Original: {video_path}")
-    
-    # Create temporary directory
-    temp_dir = tempfile.mkdtemp(prefix="sam2_reorder_")
-    print(f"[SAM2 Worker]   Temp dir: {temp_dir}")
-    
-    # Create symlinks/copies in reordered sequence
-    reordered_basename = f"frame_{frame_pattern}{file_ext}"
-    
-    created_count = 0
-    for reading_idx, actual_frame in index_to_frame.items():
-        # Source file (actual frame number)
-        if frame_digits == 4:
-            source_file = video_path.replace('%04d', f"{actual_frame:04}")
-        else:
-            source_file = video_path.replace('%03d', f"{actual_frame:03}")
-        
-        # Check if source file exists
-        if not os.path.exists(source_file):
-            print(f"[SAM2 Worker] ERROR: Source frame does not exist!")
-            print(f"[SAM2 Worker]   Reading index: {reading_idx}")
-            print(f"[SAM2 Worker]   Actual frame: {actual_frame}")
-            print(f"[SAM2 Worker]   Source file: {source_file}")
-            print(f"[SAM2 Worker]   Frame range: {frame_range[0]}-{frame_range[1]}")
-            print(f"[SAM2 Worker]   Reference frame: {reference_frame}")
-            raise FileNotFoundError(f"Frame {actual_frame} not found: {source_file}")
-        
-        # Destination file (reading index as frame number)
-        dest_file = os.path.join(temp_dir, reordered_basename.replace(frame_pattern, f"{reading_idx:0{frame_digits}}"))
-        
-        # Try symlink first (fast), fallback to copy (slow but works)
-        try:
-            os.symlink(source_file, dest_file)
-            created_count += 1
-        except (OSError, NotImplementedError):
-            # Symlink failed (no admin rights on Windows), use copy
-            shutil.copy2(source_file, dest_file)
-            created_count += 1
-    
-    reordered_video_path = os.path.join(temp_dir, reordered_basename)
-    
-    print(f"[SAM2 Worker]   Reordered: {reordered_video_path}")
-    print(f"[SAM2 Worker]   Created {created_count}/{len(index_to_frame)} frame links/copies")
-    
-    return temp_dir, reordered_video_path
+
+    def __init__(self, stream):
+        super().__init__()
+        self.stream = stream
+
+    def emit(self, event):
+        self.stream.write(json.dumps(event) + "\n")
+        self.stream.flush()
+
+
+def gpu_memory():
+    """Allocated / peak CUDA memory in MiB ({} without CUDA). Doesn't synchronize."""
+    torch = sys.modules.get("torch")
+    if torch is None or not torch.cuda.is_available():
+        return {}
+    return {
+        "gpu_mem_mb": torch.cuda.memory_allocated() // (1024 * 1024),
+        "gpu_peak_mb": torch.cuda.max_memory_allocated() // (1024 * 1024),
+    }
+
+
+def setup_sam2_path(sam2_repo):
+    """Make `import sam2` work from sam2_repo and return its absolute path"""
+    sam2_repo = os.path.abspath(sam2_repo)
+
+    # Ensure sam2_repo is in sys.path for imports
+    if sam2_repo not in sys.path:
+        sys.path.insert(0, sam2_repo)
+
+    # Set Hydra full error for better debugging
+    os.environ['HYDRA_FULL_ERROR'] = '1'
+    return sam2_repo
+
 
 # Определяем конфигурацию модели
-def determine_model_cfg(model_path):
+def determine_model_cfg(model_path, sam2_repo):
     if "large" in model_path:
-        return os.path.join(params["sam2_repo"], "sam2/configs/samurai/sam2.1_hiera_l.yaml")
+        return os.path.join(sam2_repo, "sam2/configs/samurai/sam2.1_hiera_l.yaml")
     elif "base_plus" in model_path:
-        return os.path.join(params["sam2_repo"], "sam2/configs/samurai/sam2.1_hiera_b+.yaml")
+        return os.path.join(sam2_repo, "sam2/configs/samurai/sam2.1_hiera_b+.yaml")
     elif "small" in model_path:
-        return os.path.join(params["sam2_repo"], "sam2/configs/samurai/sam2.1_hiera_s.yaml")
+        return os.path.join(sam2_repo, "sam2/configs/samurai/sam2.1_hiera_s.yaml")
     elif "tiny" in model_path:
-        return os.path.join(params["sam2_repo"], "sam2/configs/samurai/sam2.1_hiera_t.yaml")
+        return os.path.join(sam2_repo, "sam2/configs/samurai/sam2.1_hiera_t.yaml")
     else:
         raise ValueError("Unknown model!")
 
-# Выполняем inference
-temp_dir = None  # For cleanup
-try:
-    x, y, w, h = bbox_coord
-    bbox = (x, y, x + w, y + h)
-    
-    model_cfg = determine_model_cfg(model_path)
-    device = "cuda:0" if torch.cuda.is_available() else "cpu"
-    
-    # STAGE 1: Model Loading
-    print("STAGE:[1/7] Loading Model...")
-    print("PROGRESS:0")
-    print(f"[SAM2 Worker] Loading model: {model_path}")
-    print(f"[SAM2 Worker] Device: {device}")
-    
+
+def build_predictor(model_path, sam2_repo, device):
+    """Build a SAM2 video predictor for a checkpoint (the slow, cold-start part)"""
+    from sam2.build_sam import build_sam2_video_predictor
+
+    model_cfg = determine_model_cfg(model_path, sam2_repo)
     predictor = build_sam2_video_predictor(model_cfg, model_path, device=device)
-    print("PROGRESS:10")
-    print("STAGE:[2/7] Reordering Frames...")
-    
-    # Create reordered sequence (reference frame becomes index 0)
-    temp_dir, reordered_video_path = create_reordered_sequence(
-        video_path, 
-        index_to_frame, 
-        frame_range
-    )
-    
-    # If reordering failed (single file), use original path
-    if reordered_video_path == video_path:
-        print("[SAM2 Worker] WARNING: Could not reorder frames (single file?), using original sequence")
-        print("[SAM2 Worker] Reference frame feature will not work correctly!")
-        use_reordering = False
-    else:
-        use_reordering = True
-        print(f"[SAM2 Worker] OK: Frames reordered successfully")
-    
-    print("PROGRESS:15")
-    print("STAGE:[3/7] Initializing Video...")
-    
-    # Инициализация
-    autocast_context = torch.autocast("cuda", dtype=torch.float16) if torch.cuda.is_available() else torch.autocast("cpu", enabled=False)
-    
-    total_frames = frame_range[1] - frame_range[0] + 1
-    print("PROGRESS:20")
-    print(f"STAGE:[4/7] Reading Frames (0/{total_frames})...")
-    
-    # NEW: Use reordered path for init_state
-    # This makes SAM2 read frames in the order: [reference, reference+1, ..., max, min, ..., reference-1]
-    # So reference frame becomes index 0 (SAM2 requirement!)
-    init_video_path = reordered_video_path if use_reordering else video_path
-    
-    # For reordered sequence, frame range is now 0 to (total_frames-1)
-    # IMPORTANT: SAM2 processes frames [frame_range_min, frame_range_max-1], not inclusive of max!
-    # So we need to add +1 to get all frames processed
-    init_frame_min = 0 if use_reordering else frame_range[0]
-    init_frame_max = total_frames if use_reordering else (frame_range[1] + 1)
-    
-    print(f"[SAM2 Worker] Init state with frame range: {init_frame_min} - {init_frame_max-1} (requesting {init_frame_max} as max)")
-    
-    with torch.inference_mode(), autocast_context:
-        state, images, frame_start = predictor.init_state(
-            init_video_path,
-            offload_video_to_cpu=True,
-            frame_range_min=init_frame_min,
-            frame_range_max=init_frame_max,
-            original_fps=fps_original,
-            target_fps=fps_target,
-            bits=bits
-        )
-        
-        print("PROGRESS:35")
-        print(f"STAGE:[5/7] Detecting Object (Reference Frame {reference_frame})...")
-        # frame_idx=0 now corresponds to reference_frame due to reordering!
-        _, _, masks = predictor.add_new_points_or_box(state, box=bbox, frame_idx=0, obj_id=0)
-        print("PROGRESS:40")
-    
-    # Получаем размеры изображения (from reference frame)
-    input_file_name = os.path.splitext(os.path.basename(video_path))[0]
-    if "%04d" in input_file_name:
-        first_frame_path = video_path.replace('%04d', f"{reference_frame:04}")
-    elif "%03d" in input_file_name:
-        first_frame_path = video_path.replace('%03d', f"{reference_frame:03}")
-    else:
-        first_frame_path = video_path
-    
-    first_frame = cv2.imread(first_frame_path)
-    if first_frame is None:
-        print(f"[SAM2 Worker] ERROR: Cannot read reference frame: {first_frame_path}", file=sys.stderr)
-        sys.exit(1)
-    
-    height, width = first_frame.shape[:2]
-    print(f"[SAM2 Worker] Image size: {width}x{height}")
-    
-    output_dir = os.path.dirname(output_path)
-    output_basename = os.path.splitext(os.path.basename(output_path))[0]
-    
-    # Propagation
-    print(f"STAGE:[6/7] Propagating Masks (0/{total_frames})...")
-    print(f"[SAM2 Worker] Starting propagation...")
-    
-    color = [(255, 255, 255)]
-    
-    # Track actual output format (may fallback to PNG)
-    actual_output_path = output_path
-    used_png_fallback = False
-    
-    # NEW: Frame counter for propagation
-    # frame_idx from SAM2 is the READING index (0, 1, 2, ...)
-    # We need to map it back to ACTUAL frame number using index_to_frame
-    reading_idx = 0
-    
-    for frame_idx, object_ids, masks in predictor.propagate_in_video(state):
-        # Map reading index to actual frame number
-        if use_reordering:
-            actual_frame_num = index_to_frame[reading_idx]
-        else:
-            actual_frame_num = frame_range[0] + reading_idx
-        
-        processed_frames = reading_idx + 1
-        progress_base = 40  # Start from 40% (after detection)
-        progress_range = 55  # Propagation takes 40-95%
-        progress = int(progress_base + (processed_frames / total_frames) * progress_range)
-        
-        print(f"PROGRESS:{progress}")
-        # Детальная информация с количеством кадров
-        print(f"STAGE:[6/7] Processing Frame {processed_frames}/{total_frames} ({progress}%)")
-        print(f"[SAM2 Worker] Reading index {reading_idx} -> Frame {actual_frame_num}")
-        
-        # Обработка масок
-        mask_to_vis = {}
-        for obj_id, mask in zip(object_ids, masks):
-            mask = mask[0].cpu().numpy()
-            mask = mask > 0.0
-            mask_to_vis[obj_id] = mask
-        
-        # Создание изображения маски
-        mask_img = np.zeros((height, width, 3), np.uint8)
-        for obj_id, mask in mask_to_vis.items():
-            mask_img[mask] = color[(obj_id + 1) % len(color)]
-        
+    if str(device) == "cpu":
+        import torch
+        # oneDNN convolutions are faster on NHWC; the Hiera trunk works in NHWC anyway
+        predictor = predictor.to(memory_format=torch.channels_last)
+    return predictor
+
+
+# Mask output formats (params["mask_format"])
+#   rgb8      - 3-channel 8-bit, white object on black (legacy)
+#   mono8     - 1-channel 8-bit 0/255
+#   bilevel   - 1-bit packed PNG (EXR output: same as mono8 but half float)
+#   alpha_f16 - half float RGBA EXR, 0.0/1.0 in all channels, so a Read node puts
+#               the mask in rgba.alpha (PNG output: same as mono8)
+#   index     - object ID map: 0 = background, obj_id + 1 for each object
+#               (8-bit, 16-bit if ids don't fit; half float in EXR)
+MASK_FORMATS = ["rgb8", "mono8", "bilevel", "alpha_f16", "index"]
+
+# Output path extension of keyframe/delta mask files (see MaskFileOutput)
+MASK_FILE_EXT = ".smk"
+
+
+class MaskWriter:
+    """
+    Background mask writer: encodes and saves mask images on a small thread pool
+    so PNG/EXR compression overlaps with inference of the next frames.
+
+    submit() takes the masks still on the device, starts the copy to host and
+    returns; it blocks only when `max_pending` frames are already queued.
+    Low-res mask logits (low_res_output) are resized to the plate size in
+    submit(), only inside the object box if `crop_to_bbox`.
+    The first error raised by a writer thread is re-raised by submit()/flush().
+    """
+
+    def __init__(self, output_path, height, width, mask_format="rgb8", num_workers=2, max_pending=8, crop_to_bbox=True):
+        self.mask_format = mask_format
+        self.crop_to_bbox = crop_to_bbox
+        self.output_path = output_path
+        self.output_dir = os.path.dirname(output_path)
+        self.output_basename = os.path.splitext(os.path.basename(output_path))[0]
         # Determine file extension from output_path
-        file_ext = os.path.splitext(output_path)[1]  # .png or .exr
-        if not file_ext:
-            file_ext = ".png"  # default to PNG
-        
+        self.file_ext = os.path.splitext(output_path)[1]  # .png or .exr
+        if not self.file_ext:
+            self.file_ext = ".png"  # default to PNG
+        self.height = height
+        self.width = width
+        self.color = [(255, 255, 255)]
+
+        # Track actual output format (may fallback to PNG)
+        self.actual_output_path = output_path
+        self.used_png_fallback = False
+        self.fallback_lock = threading.Lock()
+        if self.file_ext.lower() != '.exr':
+            self._note_png_format()
+
+        self.error = None
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.threads = []
+        for i in range(max(num_workers, 1)):
+            thread = threading.Thread(target=self._run, name=f"mask_writer_{i}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def save_path(self, frame_num):
         # Build save path with correct extension
-        # Use actual_frame_num (not reading_idx) for output file names
-        if "%04d" in output_basename:
-            save_path = os.path.join(output_dir, output_basename.replace('%04d', f"{actual_frame_num:04}") + file_ext)
-        elif "%03d" in output_basename:
-            save_path = os.path.join(output_dir, output_basename.replace('%03d', f"{actual_frame_num:03}") + file_ext)
+        # Use actual frame number (not reading index) for output file names
+        if "%04d" in self.output_basename:
+            return os.path.join(self.output_dir, self.output_basename.replace('%04d', f"{frame_num:04}") + self.file_ext)
+        elif "%03d" in self.output_basename:
+            return os.path.join(self.output_dir, self.output_basename.replace('%03d', f"{frame_num:03}") + self.file_ext)
         else:
-            save_path = os.path.join(output_dir, f"{output_basename}_{actual_frame_num:04}{file_ext}")
-        
+            return os.path.join(self.output_dir, f"{self.output_basename}_{frame_num:04}{self.file_ext}")
+
+    def submit(self, frame_num, object_ids, masks):
+        """Queue the masks of one frame (device tensor of shape (num_objects, 1, H, W))"""
+        import torch
+
+        self.raise_error()
+
+        if masks.shape[-2:] != (self.height, self.width):
+            from sam2.utils.misc import resize_mask_logits
+            masks = resize_mask_logits(masks, self.height, self.width, crop_to_bbox=self.crop_to_bbox)
+
+        # Composite all objects in one go on the device and copy only the final
+        # (H, W) / (H, W, 3) image back. Later objects are drawn over earlier ones.
+        fg = masks[:, 0] > 0.0
+        num_objects = fg.shape[0]
+        # position (1-based) of the last object covering each pixel, 0 = background
+        last = num_objects - 1 - torch.flip(fg, dims=[0]).to(torch.uint8).argmax(dim=0)
+        covered = fg.any(dim=0)
+
+        if self.mask_format == "rgb8":
+            lut = torch.tensor(
+                [[0, 0, 0]] + [self.color[(obj_id + 1) % len(self.color)] for obj_id in object_ids],
+                dtype=torch.uint8, device=fg.device,
+            )
+            image = lut[torch.where(covered, last + 1, 0)]
+        elif self.mask_format == "index":
+            ids = [0] + [obj_id + 1 for obj_id in object_ids]
+            dtype = torch.uint8 if max(ids) <= 255 else torch.int32  # int32 -> uint16 on host
+            lut = torch.tensor(ids, dtype=dtype, device=fg.device)
+            image = lut[torch.where(covered, last + 1, 0)]
+        else:
+            image = covered.to(torch.uint8) * 255
+
+        ready = None
+        if image.is_cuda:
+            host_image = torch.empty(image.shape, dtype=image.dtype, pin_memory=True)
+            host_image.copy_(image, non_blocking=True)
+            ready = torch.cuda.Event()
+            ready.record()
+        else:
+            host_image = image.clone()
+
+        item = (frame_num, host_image, ready)
+        while True:
+            try:
+                self.queue.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                # Queue full - make sure we don't wait forever on dead writers
+                self.raise_error()
+
+    def encode(self, mask_img, file_ext):
+        """Returns (image, cv2.imwrite params) for the mask format and container"""
+        import cv2
+        import numpy as np
+
+        if self.mask_format == "index" and mask_img.dtype != np.uint8:
+            mask_img = mask_img.astype(np.uint16)
+
+        if self.mask_format == "rgb8":
+            return mask_img, []
+
+        if file_ext.lower() == '.exr':
+            # OpenCV writes a single channel EXR as luminance (Y); store it as half float
+            if self.mask_format == "index":
+                values = mask_img.astype(np.float32)
+            else:
+                values = mask_img.astype(np.float32) / 255.0
+            if self.mask_format == "alpha_f16":
+                # 4 channels are written as R, G, B and A, a 1-channel EXR has no alpha
+                values = np.repeat(values[:, :, None], 4, axis=2)
+            return values, [cv2.IMWRITE_EXR_TYPE, cv2.IMWRITE_EXR_TYPE_HALF]
+
+        if self.mask_format == "bilevel":
+            return mask_img, [cv2.IMWRITE_PNG_BILEVEL, 1]
+        return mask_img, []
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                if self.error is None:
+                    self._write(*item)
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _write(self, frame_num, host_image, ready):
+        import cv2
+
+        if ready is not None:
+            ready.synchronize()
+        mask_img = host_image.numpy()
+
+        save_path = self.save_path(frame_num)
+        file_ext = self.file_ext
+
         # Try to save in requested format
         try:
-            success = cv2.imwrite(save_path, mask_img)
+            image, write_params = self.encode(mask_img, file_ext)
+            success = cv2.imwrite(save_path, image, write_params)
             if not success and file_ext.lower() == '.exr':
                 # EXR failed, fallback to PNG
                 save_path_png = save_path.replace('.exr', '.png').replace('.EXR', '.png')
-                if not used_png_fallback:
-                    # Update actual output path on first fallback
-                    actual_output_path = output_path.replace('.exr', '.png').replace('.EXR', '.png')
-                    used_png_fallback = True
-                    print(f"[SAM2 Worker] WARNING: EXR not supported by OpenCV, using PNG")
-                    print(f"[SAM2 Worker] Output format changed: {actual_output_path}")
-                cv2.imwrite(save_path_png, mask_img)
+                with self.fallback_lock:
+                    if not self.used_png_fallback:
+                        # Update actual output path on first fallback
+                        self.actual_output_path = self.output_path.replace('.exr', '.png').replace('.EXR', '.png')
+                        self.used_png_fallback = True
+                        print(f"[SAM2 Worker] WARNING: EXR not supported by OpenCV, using PNG")
+                        print(f"[SAM2 Worker] Output format changed: {self.actual_output_path}")
+                        self._note_png_format()
+                image, write_params = self.encode(mask_img, '.png')
+                cv2.imwrite(save_path_png, image, write_params)
         except Exception as e:
             # If saving failed, try PNG
             if file_ext.lower() != '.png':
                 save_path_png = os.path.splitext(save_path)[0] + '.png'
-                if not used_png_fallback:
-                    # Update actual output path on first fallback
-                    actual_output_path = os.path.splitext(output_path)[0] + '.png'
-                    used_png_fallback = True
-                    print(f"[SAM2 Worker] WARNING: {file_ext} save failed, using PNG")
-                    print(f"[SAM2 Worker] Output format changed: {actual_output_path}")
-                cv2.imwrite(save_path_png, mask_img)
-        
-        reading_idx += 1
-    
-    print(f"PROGRESS:95")
-    print(f"STAGE:[7/7] Finalizing ({total_frames}/{total_frames} frames saved)...")
-    print(f"[SAM2 Worker] All masks saved successfully!")
-    
-    # Cleanup temporary directory
-    if temp_dir and os.path.exists(temp_dir):
-        print(f"[SAM2 Worker] Cleaning up temporary directory: {temp_dir}")
-        try:
-            shutil.rmtree(temp_dir)
-            print(f"[SAM2 Worker] OK: Temporary directory removed")
-        except Exception as cleanup_error:
-            print(f"[SAM2 Worker] WARNING: Failed to cleanup temp dir: {cleanup_error}")
-    
-    print(f"PROGRESS:100")
-    print("STAGE:[COMPLETE] All Done!")
-    if used_png_fallback:
-        print(f"[SAM2 Worker] NOTE: Used PNG format (EXR not supported)")
-    print(f"OUTPUT_PATH:{actual_output_path}")  # Для создания Read node в Nuke
+                with self.fallback_lock:
+                    if not self.used_png_fallback:
+                        # Update actual output path on first fallback
+                        self.actual_output_path = os.path.splitext(self.output_path)[0] + '.png'
+                        self.used_png_fallback = True
+                        print(f"[SAM2 Worker] WARNING: {file_ext} save failed, using PNG")
+                        print(f"[SAM2 Worker] Output format changed: {self.actual_output_path}")
+                        self._note_png_format()
+                image, write_params = self.encode(mask_img, '.png')
+                cv2.imwrite(save_path_png, image, write_params)
+
+    def _note_png_format(self):
+        """Log the formats that PNG output can't store as requested"""
+        if self.mask_format == "alpha_f16":
+            print("[SAM2 Worker] WARNING: Float16 alpha needs EXR output, masks are saved as mono 8-bit PNG")
+
+    def raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Mask writing failed: {self.error}") from self.error
+
+    def flush(self):
+        """Wait until every submitted frame is on disk"""
+        self.queue.join()
+        self.raise_error()
+
+    def close(self):
+        """Finish pending writes and stop the writer threads"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class MaskFileOutput:
+    """
+    Writes all masks of the shot to one keyframe/delta mask file (.smk, see
+    sam2.utils.mask_codec) instead of an image per frame: every object is stored
+    as an RLE of its XOR with the last keyframe (every `keyframe_interval` frames),
+    which is an order of magnitude smaller than PNGs on long shots. Read it back
+    with MaskFileReader (random access by frame number).
+
+    Same interface as MaskWriter; encoding is cheap (run lengths are computed on
+    the device), so it runs in submit().
+    """
+
+    def __init__(self, output_path, height, width, keyframe_interval=32, crop_to_bbox=True):
+        from sam2.utils.mask_codec import MaskFileWriter
+
+        self.actual_output_path = output_path
+        self.used_png_fallback = False
+        self.height = height
+        self.width = width
+        self.crop_to_bbox = crop_to_bbox
+        self.file = MaskFileWriter(self.actual_output_path, keyframe_interval=keyframe_interval)
+
+    def submit(self, frame_num, object_ids, masks):
+        """Add the masks of one frame (device tensor of shape (num_objects, 1, H, W))"""
+        if masks.shape[-2:] != (self.height, self.width):
+            from sam2.utils.misc import resize_mask_logits
+            masks = resize_mask_logits(masks, self.height, self.width, crop_to_bbox=self.crop_to_bbox)
+        self.file.write(frame_num, object_ids, masks[:, 0] > 0.0)
+
+    def flush(self):
+        """Finish the file (index included)"""
+        self.file.close()
+        print(f"[SAM2 Worker] Mask file: {self.file.num_bytes / 1024**2:.1f} MB, {len(self.file.index)} frames")
+
+    def close(self):
+        self.file.close()
+
+
+def run_job(params, reporter, get_predictor):
+    """
+    Run one masking job: read the plate, detect the object on the reference
+    frame, propagate and save one mask image per frame.
+
+    `reporter` (a Reporter) receives stage/progress events and is polled for
+    cancellation once per frame (JobCancelled is raised when it returns True).
+    The caller reports the result/error itself.
+    `get_predictor(model_path, device)` returns a ready SAM2 video predictor,
+    so a resident worker can hand back an already loaded model.
+
+    Returns the actual output path (may differ from params["output_path"] if
+    EXR saving fell back to PNG).
+    """
+    import torch
+    import cv2
+
+    # Извлекаем параметры
+    sam2_repo = params["sam2_repo"]
+    video_path = params["video_path"]
+    output_path = params["output_path"]
+    bbox_coord = params["bbox_coord"]
+    frame_range = params["frame_range"]
+    reference_frame = params.get("reference_frame", frame_range[0])  # NEW: Selected frame for bbox
+    model_path = os.path.join(sam2_repo, params["model_path"])  # checkpoints inside sam2_repo!
+    fps_original = params["fps_original"]
+    fps_target = params["fps_target"]
+    bits = params["bits"]
+    mask_format = params.get("mask_format", "rgb8")  # see MASK_FORMATS
+    decode_workers = params.get("decode_workers", 4)  # threads reading/decoding plate frames
+    # Frame outputs memory attention can't reach anymore: "evict", "spill" (to disk) or "keep_all"
+    memory_policy = params.get("memory_policy", "evict")
+    # Frames the image encoder runs on at once, ahead of the tracked frame (1 = one by one)
+    encoder_batch_size = params.get("encoder_batch_size", 8)
+    # Image features kept for re-propagation: bytes on the GPU, plus bytes in pinned
+    # host memory (0 = none; a job propagates each frame once, so it is off by default)
+    feature_cache_gpu_bytes = params.get("feature_cache_gpu_bytes", 256 << 20)
+    feature_cache_cpu_bytes = params.get("feature_cache_cpu_bytes", 0)
+    # CPU only: intra-op threads (0 = one per physical core) and bfloat16 autocast
+    # (True / False / "auto" = when the CPU has native bfloat16 support)
+    cpu_threads = params.get("cpu_threads", 0)
+    cpu_bf16 = params.get("cpu_bf16", "auto")
+    # Compile the per-frame tracking step (slow first run, compiled kernels are cached on disk)
+    compile_track_step = params.get("compile_track_step", False)
+    # Keep the low-res (256x256) mask logits while tracking and resize them only when
+    # writing each frame (inside the object box if crop_masks_to_bbox)
+    low_res_output = params.get("low_res_output", False)
+    crop_masks_to_bbox = params.get("crop_masks_to_bbox", True)
+    # .smk output only: a full mask every this many frames, the others as deltas
+    keyframe_interval = params.get("keyframe_interval", 32)
+    compile_cache_dir = params.get(
+        "compile_cache_dir", os.path.join(os.path.expanduser("~"), ".nuke", "samurai_compile_cache")
+    )
+
+    print(f"[SAM2 Worker] Frame Range: {frame_range[0]}-{frame_range[1]}")
+    print(f"[SAM2 Worker] Reference Frame: {reference_frame}")
+
+    # Validate reference frame
+    if reference_frame < frame_range[0] or reference_frame > frame_range[1]:
+        raise ValueError(f"Reference frame {reference_frame} outside range {frame_range}")
+
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask format: {mask_format} (expected one of {MASK_FORMATS})")
+
+    # Check if output is EXR - OpenCV needs special compilation for EXR support
+    is_exr_output = output_path.lower().endswith('.exr') or '.exr' in output_path.lower()
+    if is_exr_output:
+        print("[SAM2 Worker] WARNING: EXR output requested")
+        print("[SAM2 Worker] OpenCV pip version doesn't support EXR by default")
+        print("[SAM2 Worker] Trying to save as EXR (requires OPENCV_IO_ENABLE_OPENEXR=1)")
+
+    # Frames are read in their natural order straight from the plate (no temp
+    # copies) and tracking runs forward and backward from the reference frame
+    frame_numbers = list(range(frame_range[0], frame_range[1] + 1))
+    reference_idx = reference_frame - frame_range[0]
+
+    print(f"[SAM2 Worker] Total frames: {len(frame_numbers)}")
+    print(f"[SAM2 Worker] Reference index {reference_idx} = Frame {reference_frame}")
+
+    # Выполняем inference
+    images = None  # streaming frame loader, has a prefetch thread to stop
+    state = None  # inference state, its memory store may have spill files
+    writer = None  # background mask writer
+    try:
+        x, y, w, h = bbox_coord
+        bbox = (x, y, x + w, y + h)
+
+        device = "cuda:0" if torch.cuda.is_available() else "cpu"
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()  # peak GPU memory is reported per job
+        else:
+            from sam2.utils.misc import configure_cpu_threads
+            print(f"[SAM2 Worker] CPU threads: {configure_cpu_threads(cpu_threads)}")
+
+        # STAGE 1: Model Loading
+        reporter.stage("[1/6] Loading Model...", "load_model")
+        reporter.progress(0)
+        print(f"[SAM2 Worker] Loading model: {model_path}")
+        print(f"[SAM2 Worker] Device: {device}")
+
+        predictor = get_predictor(model_path, device)
+        if compile_track_step:
+            # No-op if this (resident) predictor is already compiled
+            predictor.compile_tracking_step(cache_dir=compile_cache_dir)
+        reporter.progress(15)
+        reporter.stage("[2/6] Initializing Video...", "init_video")
+
+        # Инициализация
+        if torch.cuda.is_available():
+            autocast_context = torch.autocast("cuda", dtype=torch.float16)
+            propagate_context = contextlib.nullcontext()  # propagation runs in fp32
+        else:
+            from sam2.utils.misc import cpu_supports_bf16
+            use_bf16 = cpu_supports_bf16() if cpu_bf16 == "auto" else bool(cpu_bf16)
+            print(f"[SAM2 Worker] CPU bfloat16 autocast: {use_bf16}")
+            # On CPU the whole job (propagation too) runs in bfloat16 when supported
+            autocast_context = torch.autocast("cpu", dtype=torch.bfloat16, enabled=use_bf16)
+            propagate_context = torch.autocast("cpu", dtype=torch.bfloat16, enabled=use_bf16)
+
+        total_frames = len(frame_numbers)
+        reporter.progress(20)
+        reporter.stage(f"[3/6] Reading Frames (0/{total_frames})...", "read_frames")
+
+        with torch.inference_mode(), autocast_context:
+            state, images, frame_start = predictor.init_state(
+                video_path,
+                offload_video_to_cpu=True,
+                frame_range_min=frame_range[0],
+                frame_range_max=frame_range[1] + 1,  # exclusive
+                original_fps=fps_original,
+                target_fps=fps_target,
+                bits=bits,
+                num_decode_workers=decode_workers,
+                frame_numbers=frame_numbers,
+                reference_index=reference_idx,  # fps stride counts from the reference frame
+                memory_policy=memory_policy,
+                encoder_batch_size=encoder_batch_size,
+                feature_cache_gpu_bytes=feature_cache_gpu_bytes,
+                feature_cache_cpu_bytes=feature_cache_cpu_bytes,
+            )
+
+            reporter.progress(35)
+            reporter.stage(f"[4/6] Detecting Object (Reference Frame {reference_frame})...", "detect")
+            _, _, masks = predictor.add_new_points_or_box(state, box=bbox, frame_idx=reference_idx, obj_id=0)
+            reporter.progress(40)
+
+        # Получаем размеры изображения (from reference frame)
+        input_file_name = os.path.splitext(os.path.basename(video_path))[0]
+        if "%04d" in input_file_name:
+            first_frame_path = video_path.replace('%04d', f"{reference_frame:04}")
+        elif "%03d" in input_file_name:
+            first_frame_path = video_path.replace('%03d', f"{reference_frame:03}")
+        else:
+            first_frame_path = video_path
+
+        first_frame = cv2.imread(first_frame_path)
+        if first_frame is None:
+            raise FileNotFoundError(f"Cannot read reference frame: {first_frame_path}")
+
+        height, width = first_frame.shape[:2]
+        print(f"[SAM2 Worker] Image size: {width}x{height}")
+
+        # Propagation
+        reporter.stage(f"[5/6] Propagating Masks (0/{total_frames})...", "propagate")
+        if compile_track_step:
+            print(f"[SAM2 Worker] Compiling tracking step...")
+            warm_up_start = time.time()
+            with propagate_context:
+                predictor.warm_up(state)
+            print(f"[SAM2 Worker] Tracking step ready in {time.time() - warm_up_start:.1f}s")
+        print(f"[SAM2 Worker] Starting propagation...")
+
+        if output_path.lower().endswith(MASK_FILE_EXT):
+            # All frames go to one keyframe/delta mask file
+            writer = MaskFileOutput(output_path, height, width, keyframe_interval=keyframe_interval, crop_to_bbox=crop_masks_to_bbox)
+        else:
+            # Masks are encoded and saved in the background while the next frame is tracked
+            writer = MaskWriter(output_path, height, width, mask_format=mask_format, crop_to_bbox=crop_masks_to_bbox)
+
+        def propagate():
+            # Forward: reference frame -> last frame
+            yield from predictor.propagate_in_video(state, start_frame_idx=reference_idx, low_res_output=low_res_output)
+            if reference_idx > 0:
+                # Backward: reference frame -> first frame, reusing the conditioning
+                # output of the reference frame. The Kalman filter restarts from it.
+                print(f"[SAM2 Worker] Propagating backward from frame {reference_frame}...")
+                predictor.reset_samurai_state(state["samurai_state"])
+                for frame_idx, object_ids, masks in predictor.propagate_in_video(state, start_frame_idx=reference_idx, reverse=True, low_res_output=low_res_output):
+                    if frame_idx != reference_idx:  # already saved by the forward pass
+                        yield frame_idx, object_ids, masks
+
+        processed_frames = 0
+        with propagate_context:
+            for frame_idx, object_ids, masks in propagate():
+                if reporter.is_cancelled():
+                    raise JobCancelled(f"Cancelled at frame {processed_frames}/{total_frames}")
+
+                # frame_idx from SAM2 is the reading index, map it back to the actual frame number
+                actual_frame_num = frame_numbers[frame_idx]
+
+                processed_frames += 1
+                progress_base = 40  # Start from 40% (after detection)
+                progress_range = 55  # Propagation takes 40-95%
+                progress = int(progress_base + (processed_frames / total_frames) * progress_range)
+
+                # One event per frame (frames/s, ETA, GPU memory) - the UI decides how often to redraw
+                reporter.frame(progress, processed_frames, total_frames)
+
+                writer.submit(actual_frame_num, object_ids, masks)
+
+        # All masks must be on disk before the result is reported
+        reporter.stage(f"[6/6] Finalizing ({total_frames}/{total_frames} frames saved)...", "finalize")
+        reporter.progress(95)
+        writer.flush()
+        actual_output_path = writer.actual_output_path
+        used_png_fallback = writer.used_png_fallback
+        print(f"[SAM2 Worker] All masks saved successfully!")
+        print(f"[SAM2 Worker] Tracking memory: {predictor.get_memory_stats(state)}")
+        print(f"[SAM2 Worker] Feature cache: {predictor.get_feature_cache_stats(state)}")
+
+        reporter.progress(100)
+        reporter.stage("[COMPLETE] All Done!")
+        if used_png_fallback:
+            print(f"[SAM2 Worker] NOTE: Used PNG format (EXR not supported)")
+        return actual_output_path
+
+    finally:
+        if writer is not None:
+            writer.close()
+
+        # Stop frame prefetching so a resident worker doesn't keep decoded frames around
+        if images is not None:
+            images.close()
+
+        if state is not None:
+            state["output_dict"]["non_cond_frame_outputs"].close()
+
+
+def main():
+    # Event channel: the original stdout carries JSON lines only (see Reporter).
+    # Everything else - our prints, tracebacks, and whatever torch/hydra/C code
+    # writes to fd 1 - is redirected to stderr, so logs can't corrupt the events.
+    sys.stdout.flush()
+    events = os.fdopen(os.dup(sys.stdout.fileno()), "w", encoding="utf-8")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    reporter = StreamReporter(events)
+
+    # Получаем параметры
+    if len(sys.argv) < 2:
+        reporter.error("No parameters provided")
+        sys.exit(1)
+
+    params = json.loads(sys.argv[1])
+
+    # Добавляем sam2_repo в path (должен быть в PYTHONPATH от parent process)
+    sam2_repo = setup_sam2_path(params["sam2_repo"])
+
+    print(f"[SAM2 Worker] sys.path includes: {sam2_repo}")
+    print(f"[SAM2 Worker] Attempting to import sam2 module...")
+
+    # Теперь импортируем torch и SAM2
+    try:
+        import torch
+        import cv2
+        import numpy as np
+        from sam2.build_sam import build_sam2_video_predictor
+        print(f"[SAM2 Worker] Successfully imported sam2 module")
+    except ImportError as e:
+        print(f"[SAM2 Worker] ERROR: Failed to import sam2 module: {e}", file=sys.stderr)
+        print(f"[SAM2 Worker] sam2_repo path: {sam2_repo}", file=sys.stderr)
+        print(f"[SAM2 Worker] Check that sam2_repo contains 'sam2' folder", file=sys.stderr)
+        reporter.error(f"Failed to import sam2 module: {e}")
+        sys.exit(1)
+
+    print(f"[SAM2 Worker] torch {torch.__version__}, CUDA: {torch.cuda.is_available()}")
+
+    try:
+        actual_output_path = run_job(
+            params,
+            reporter,
+            lambda model_path, device: build_predictor(model_path, params["sam2_repo"], device),
+        )
+    except Exception as e:
+        print(f"[SAM2 Worker] ERROR: {e}", file=sys.stderr)
+        import traceback
+        traceback.print_exc()
+        reporter.error(str(e))
+        sys.exit(1)
+
+    print(f"[SAM2 Worker] Output: {actual_output_path}")
+    reporter.result(actual_output_path)  # Для создания Read node в Nuke
     sys.exit(0)
-    
-except Exception as e:
-    # Cleanup temporary directory even on error
-    if temp_dir and os.path.exists(temp_dir):
-        print(f"[SAM2 Worker] Cleaning up temporary directory after error: {temp_dir}")
-        try:
-            shutil.rmtree(temp_dir)
-        except:
-            pass
-    
-    print(f"[SAM2 Worker] ERROR: {e}", file=sys.stderr)
-    import traceback
-    traceback.print_exc()
-    sys.exit(1)
 
+
+if __name__ == "__main__":
+    main()
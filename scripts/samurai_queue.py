@@ -0,0 +1,309 @@
+"""
+SAMURAI job queue - runs many SAMURAI nodes one after another through the
+resident SAM2 daemon (see sam2_daemon.py), so the model is loaded once for
+the whole batch instead of once per node.
+
+- Jobs using the same checkpoint run back to back (fewer model reloads)
+- The queue is saved to ~/.nuke/samurai_queue.json after every change;
+  jobs that were running when Nuke crashed go back to pending on restart
+- Open the panel from the SAMURAI menu, or use JobQueue from a script:
+
+    queue = JobQueue()
+    queue.add_node(nuke.toNode('SAMURAI1'))
+    queue.run(find_system_python())
+"""
+import nuke
+import nukescripts
+import os
+import json
+import time
+import uuid
+import threading
+
+from . import sam2_daemon_client
+from .nuke_samurai import collect_job_params, create_mask_read_node, find_system_python, get_sam2_repo, PYTHON_NOT_FOUND_MESSAGE
+from .nuke_samurai import format_progress, format_summary
+
+
+QUEUE_FILE = os.path.join(os.path.expanduser("~"), ".nuke", "samurai_queue.json")
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class JobQueue:
+
+    def __init__(self, path=QUEUE_FILE):
+        self.path = path
+        self.jobs = []
+        self.lock = threading.RLock()
+        self.running = False
+        self.cancel_requested = False
+        self.current_job = None  # DaemonJob of the running job
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                self.jobs = json.load(f).get("jobs", [])
+        except (OSError, ValueError):
+            self.jobs = []
+            return
+
+        # Jobs that were running when Nuke died start again from scratch
+        for job in self.jobs:
+            if job["status"] == RUNNING:
+                job["status"] = PENDING
+                job["progress"] = 0
+                job["message"] = "Interrupted - will resume"
+        self.save()
+
+    def save(self):
+        with self.lock:
+            data = json.dumps({"jobs": self.jobs}, indent=2)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def add_node(self, node):
+        """Snapshot the node settings as a new pending job (replaces a pending job of the same node)"""
+        params = collect_job_params(node)
+        with self.lock:
+            self.jobs = [
+                job for job in self.jobs
+                if not (job["node"] == node.fullName() and job["status"] == PENDING)
+            ]
+            job = {
+                "id": uuid.uuid4().hex[:8],
+                "node": node.fullName(),
+                "params": params,
+                "status": PENDING,
+                "progress": 0,
+                "message": "",
+                "output_path": None,
+                "xpos": node.xpos(),
+                "ypos": node.ypos(),
+            }
+            self.jobs.append(job)
+        self.save()
+        return job
+
+    def remove_finished(self):
+        with self.lock:
+            self.jobs = [job for job in self.jobs if job["status"] in (PENDING, RUNNING)]
+        self.save()
+
+    def next_job(self, preferred_model=None):
+        """
+        Next pending job: same checkpoint as `preferred_model` first (no reload),
+        otherwise the checkpoint of the oldest pending job
+        """
+        with self.lock:
+            pending = [job for job in self.jobs if job["status"] == PENDING]
+        if not pending:
+            return None
+        for job in pending:
+            if preferred_model and os.path.basename(job["params"]["model_path"]) == preferred_model:
+                return job
+        return pending[0]
+
+    def update(self, job, **values):
+        with self.lock:
+            job.update(values)
+
+    def cancel(self):
+        """Stop after cancelling the running job"""
+        self.cancel_requested = True
+        if self.current_job is not None:
+            self.current_job.cancel()
+
+    def run(self, system_python, on_update=None):
+        """
+        Run all pending jobs (blocking - call it from a thread).
+        `on_update()` is called whenever a job changes.
+        """
+        def notify():
+            if on_update is not None:
+                on_update()
+
+        self.running = True
+        self.cancel_requested = False
+        try:
+            state = None
+            preferred_model = None
+            while not self.cancel_requested:
+                if state is None:
+                    # Start with the checkpoint the daemon already has loaded
+                    state = sam2_daemon_client.ensure_daemon(system_python, get_sam2_repo())
+                    pong = sam2_daemon_client.ping(state) or {}
+                    loaded = pong.get("models") or []
+                    preferred_model = os.path.basename(loaded[-1]) if loaded else None
+
+                job = self.next_job(preferred_model)
+                if job is None:
+                    break
+                preferred_model = os.path.basename(job["params"]["model_path"])
+
+                self.update(job, status=RUNNING, progress=0, message="Starting...")
+                self.save()
+                notify()
+                nuke.tprint(f"[SAMURAI Queue] Running {job['node']} ({preferred_model})")
+
+                try:
+                    status = self.run_job(state, job, notify)
+                except sam2_daemon_client.DaemonUnavailable as e:
+                    # Daemon died (e.g. out of memory) - start a new one for the next job
+                    nuke.tprint(f"[SAMURAI Queue] ❌ Daemon unavailable: {e}")
+                    self.update(job, status=FAILED, message=str(e))
+                    state = None
+                    status = FAILED
+                self.save()
+                notify()
+
+                if status == DONE:
+                    frame_min, frame_max = job["params"]["frame_range"]
+                    nuke.executeInMainThread(
+                        create_mask_read_node,
+                        args=(job["output_path"], frame_min, frame_max, job["xpos"], job["ypos"]),
+                    )
+        finally:
+            self.running = False
+            self.current_job = None
+            notify()
+
+    def run_job(self, state, job, notify):
+        self.current_job = sam2_daemon_client.DaemonJob(state, job["params"])
+        try:
+            for event in self.current_job.events():
+                if event is None:
+                    continue
+                kind = event.get("event")
+                if kind == "stage":
+                    self.update(job, message=event["message"])
+                    notify()
+                elif kind == "progress":
+                    if "frame" in event:
+                        self.update(job, progress=int(event["value"]), message=format_progress(event))
+                    else:
+                        self.update(job, progress=int(event["value"]))
+                    notify()
+                elif kind == "result":
+                    nuke.tprint(f"[SAMURAI Queue] {job['node']}: {format_summary(event)}")
+                    self.update(job, status=DONE, progress=100, message="Done", output_path=event["output_path"])
+                    return DONE
+                elif kind == "cancelled":
+                    self.update(job, status=CANCELLED, message="Cancelled")
+                    return CANCELLED
+                elif kind == "error":
+                    nuke.tprint(f"[SAMURAI Queue] ❌ {job['node']}: {event['message']}")
+                    self.update(job, status=FAILED, message=event["message"])
+                    return FAILED
+            self.update(job, status=FAILED, message="No result from daemon")
+            return FAILED
+        finally:
+            self.current_job = None
+
+
+class SamuraiQueuePanel(nukescripts.PythonPanel):
+    # Refresh the job list at most this often while jobs are running
+    REFRESH_INTERVAL = 0.25
+
+    def __init__(self, queue):
+        nukescripts.PythonPanel.__init__(self, 'SAMURAI Queue', 'com.samurai.queue')
+        self.queue = queue
+        self.last_refresh = 0
+        self.refresh_scheduled = False
+
+        self.add_knob = nuke.PyScript_Knob('add', 'Add Selected Nodes')
+        self.start_knob = nuke.PyScript_Knob('start', 'Start')
+        self.cancel_knob = nuke.PyScript_Knob('cancel', 'Cancel')
+        self.clear_knob = nuke.PyScript_Knob('clear', 'Remove Finished')
+        self.jobs_knob = nuke.Multiline_Eval_String_Knob('jobs', 'Jobs')
+        for knob in (self.add_knob, self.start_knob, self.cancel_knob, self.clear_knob, self.jobs_knob):
+            self.addKnob(knob)
+        self.jobs_knob.setFlag(nuke.STARTLINE)
+        self.jobs_knob.setEnabled(False)
+
+        self.refresh()
+
+    def knobChanged(self, knob):
+        if knob is self.add_knob:
+            self.add_selected()
+        elif knob is self.start_knob:
+            self.start()
+        elif knob is self.cancel_knob:
+            self.queue.cancel()
+        elif knob is self.clear_knob:
+            self.queue.remove_finished()
+            self.refresh()
+
+    def add_selected(self):
+        nodes = [n for n in nuke.selectedNodes() if n.knob('GenerateMask') is not None]
+        if not nodes:
+            nuke.message("Select one or more SAMURAI nodes first")
+            return
+        errors = []
+        for node in nodes:
+            try:
+                self.queue.add_node(node)
+            except (ValueError, TypeError) as e:
+                errors.append(f"{node.name()}: {e}")
+        self.refresh()
+        if errors:
+            nuke.message("Some nodes were not added:\n\n" + "\n\n".join(errors))
+
+    def start(self):
+        if self.queue.running:
+            return
+        system_python = find_system_python()
+        if not system_python:
+            nuke.message(PYTHON_NOT_FOUND_MESSAGE)
+            return
+
+        def run():
+            try:
+                self.queue.run(system_python, on_update=self.schedule_refresh)
+            except Exception as e:
+                nuke.tprint(f"[SAMURAI Queue] ❌ Exception: {e}")
+                nuke.executeInMainThread(nuke.message, args=(f"❌ Ошибка: {e}",))
+
+        threading.Thread(target=run).start()
+
+    def schedule_refresh(self):
+        """Called from the queue thread - coalesce updates into one refresh per interval"""
+        if self.refresh_scheduled:
+            return
+        if time.time() - self.last_refresh < self.REFRESH_INTERVAL and self.queue.running:
+            return
+        self.refresh_scheduled = True
+        nuke.executeInMainThread(self.refresh)
+
+    def refresh(self):
+        self.refresh_scheduled = False
+        self.last_refresh = time.time()
+        with self.queue.lock:
+            lines = []
+            for job in self.queue.jobs:
+                params = job["params"]
+                frame_min, frame_max = params["frame_range"]
+                model = os.path.splitext(os.path.basename(params["model_path"]))[0]
+                lines.append(
+                    f"[{job['status']:>9}] {job['node']:<16} {model:<24} "
+                    f"{frame_min}-{frame_max}  {job['progress']:>3}%  {job['message']}"
+                )
+        self.jobs_knob.setValue("\n".join(lines) if lines else "(empty - select SAMURAI nodes and press 'Add Selected Nodes')")
+
+
+_panel = None
+
+
+def show_queue_panel():
+    global _panel
+    if _panel is None:
+        _panel = SamuraiQueuePanel(JobQueue())
+    _panel.show()